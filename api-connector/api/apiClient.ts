@@ -2,6 +2,18 @@
  * Basis API Client für xrisk Frontend
  */
 
+/**
+ * Antwort eines bedingten GET Requests (If-None-Match)
+ */
+export interface ConditionalResponse<T> {
+  /** Antwort-Body, null bei 304 Not Modified */
+  data: T | null;
+  /** ETag der Antwort - beim nächsten Request wieder mitgeben */
+  etag: string | null;
+  /** true, wenn sich seit dem mitgegebenen ETag nichts geändert hat (304) */
+  notModified: boolean;
+}
+
 export class ApiClient {
   protected baseUrl: string;
 
@@ -38,43 +50,49 @@ export class ApiClient {
 
     try {
       const response = await fetch(url, config);
-
-      if (response.status === 204 || response.status === 302) {
-        return {} as T;
+      return await this.parseResponse<T>(response);
+    } catch (error) {
+      if (error instanceof ApiError) {
+        throw error;
       }
+      
+      throw new ApiError(
+        error instanceof Error ? error.message : 'Netzwerkfehler',
+        0
+      );
+    }
+  }
 
-      const contentType = response.headers.get('content-type');
-      if (contentType && contentType.includes('application/json')) {
-        const data = await response.json();
-        
-        if (!response.ok) {
-          throw new ApiError(
-            data.error || data.message || 'Ein Fehler ist aufgetreten',
-            response.status
-          );
-        }
-        
-        return data;
-      }
+  /**
+   * Wertet eine Fetch-Response aus (JSON-Body oder ApiError)
+   */
+  protected async parseResponse<T>(response: Response): Promise<T> {
+    if (response.status === 204 || response.status === 302) {
+      return {} as T;
+    }
 
+    const contentType = response.headers.get('content-type');
+    if (contentType && contentType.includes('application/json')) {
+      const data = await response.json();
+      
       if (!response.ok) {
         throw new ApiError(
-          `HTTP ${response.status}: ${response.statusText}`,
+          data.error || data.message || 'Ein Fehler ist aufgetreten',
           response.status
         );
       }
-
-      return {} as T;
-    } catch (error) {
-      if (error instanceof ApiError) {
-        throw error;
-      }
       
+      return data;
+    }
+
+    if (!response.ok) {
       throw new ApiError(
-        error instanceof Error ? error.message : 'Netzwerkfehler',
-        0
+        `HTTP ${response.status}: ${response.statusText}`,
+        response.status
       );
     }
+
+    return {} as T;
   }
 
   /**
@@ -89,6 +107,60 @@ export class ApiClient {
     });
   }
 
+  /**
+   * Bedingter GET Request
+   *
+   * Sendet If-None-Match explizit mit dem übergebenen ETag - unabhängig vom
+   * Browser-Cache (Node, deaktivierter Cache). Bei 304 ist data null.
+   *
+   * @param endpoint Endpoint
+   * @param etag ETag der letzten Antwort (optional)
+   */
+  protected async getConditional<T>(
+    endpoint: string,
+    etag?: string | null
+  ): Promise<ConditionalResponse<T>> {
+    const url = `${this.baseUrl}${endpoint}`;
+    const headers: Record<string, string> = {
+      'Accept': 'application/json',
+    };
+    if (etag) {
+      headers['If-None-Match'] = etag;
+    }
+
+    try {
+      const response = await fetch(url, {
+        method: 'GET',
+        credentials: 'include',
+        headers,
+      });
+
+      if (response.status === 304) {
+        return {
+          data: null,
+          etag: response.headers.get('etag') || etag || null,
+          notModified: true,
+        };
+      }
+
+      const data = await this.parseResponse<T>(response);
+      return {
+        data,
+        etag: response.headers.get('etag'),
+        notModified: false,
+      };
+    } catch (error) {
+      if (error instanceof ApiError) {
+        throw error;
+      }
+
+      throw new ApiError(
+        error instanceof Error ? error.message : 'Netzwerkfehler',
+        0
+      );
+    }
+  }
+
   /**
    * POST Request mit JSON
    */
@@ -228,11 +228,12 @@ export class SSEController {
         
         // Prüfe ob automatischer Reconnect gewünscht ist
         if (this.config.autoReconnect && !this.isManualClose) {
-          // Nur reconnecten wenn nicht completed oder failed
+          // Nur reconnecten wenn nicht completed, failed oder rejected
           const status = this.lastEvent?.meta?.status || this.lastEvent?.status;
           if (this.lastEvent && 
               status !== 'completed' && 
-              status !== 'failed') {
+              status !== 'failed' &&
+              status !== 'rejected') {
             this._scheduleReconnect();
           }
         }
@@ -273,6 +274,7 @@ export class SSEController {
     return (
       status === 'completed' ||
       status === 'failed' ||
+      status === 'rejected' ||
       status === 'inquiry_awaiting_response' ||
       status === 'inquiry_required' ||
       status === 'login_required' ||
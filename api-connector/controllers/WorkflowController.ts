@@ -4,7 +4,7 @@
  * Verwaltet das Starten, Überwachen und Fortsetzen von Risikoanalysen
  */
 
-import { ApiClient, ApiError } from '../api/apiClient.js';
+import { ApiClient, ApiError, ConditionalResponse } from '../api/apiClient.js';
 import {
   StartWorkflowRequest,
   StartWorkflowResponse,
@@ -70,13 +70,23 @@ export class WorkflowController extends ApiClient {
    * Ruft den Workflow-Status anhand der Task ID ab
    * 
    * @param taskId Celery Task ID
-   * @returns Promise<WorkflowStatusResponse>
+   * @param waitSeconds Long-Poll: bis zu 25 Sekunden auf eine Änderung warten
+   *                    (wirkt nur zusammen mit etag)
+   * @param etag ETag der letzten Antwort - wird als If-None-Match gesendet;
+   *             unverändert ergibt notModified: true (304)
+   * @returns Promise<ConditionalResponse<WorkflowStatusResponse>>
    * @throws ApiError bei Fehlern
    */
-  async getStatusByTaskId(taskId: string): Promise<WorkflowStatusResponse> {
+  async getStatusByTaskId(
+    taskId: string,
+    waitSeconds?: number,
+    etag?: string | null
+  ): Promise<ConditionalResponse<WorkflowStatusResponse>> {
     try {
-      const response = await this.get<WorkflowStatusResponse>(
-        `/workflow/state/task/${taskId}`
+      const query = waitSeconds ? `?wait=${waitSeconds}` : '';
+      const response = await this.getConditional<WorkflowStatusResponse>(
+        `/workflow/state/task/${taskId}${query}`,
+        etag
       );
       return response;
     } catch (error) {
@@ -91,13 +101,23 @@ export class WorkflowController extends ApiClient {
    * Ruft den Workflow-Status anhand der Risk UUID ab
    * 
    * @param riskUuid Risk UUID
-   * @returns Promise<WorkflowStatusByRiskResponse>
+   * @param waitSeconds Long-Poll: bis zu 25 Sekunden auf eine Änderung warten
+   *                    (wirkt nur zusammen mit etag)
+   * @param etag ETag der letzten Antwort - wird als If-None-Match gesendet;
+   *             unverändert ergibt notModified: true (304)
+   * @returns Promise<ConditionalResponse<WorkflowStatusByRiskResponse>>
    * @throws ApiError bei Fehlern
    */
-  async getStatusByRiskUuid(riskUuid: string): Promise<WorkflowStatusByRiskResponse> {
+  async getStatusByRiskUuid(
+    riskUuid: string,
+    waitSeconds?: number,
+    etag?: string | null
+  ): Promise<ConditionalResponse<WorkflowStatusByRiskResponse>> {
     try {
-      const response = await this.get<WorkflowStatusByRiskResponse>(
-        `/workflow/state/risk/${riskUuid}`
+      const query = waitSeconds ? `?wait=${waitSeconds}` : '';
+      const response = await this.getConditional<WorkflowStatusByRiskResponse>(
+        `/workflow/state/risk/${riskUuid}${query}`,
+        etag
       );
       return response;
     } catch (error) {
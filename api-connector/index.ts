@@ -6,6 +6,7 @@ export { AuthController } from './controllers/AuthController.js';
 export { SSEController } from './controllers/SSEController.js';
 export { WorkflowController, WorkflowValidationError } from './controllers/WorkflowController.js';
 export { ApiClient, ApiError } from './api/apiClient.js';
+export type { ConditionalResponse } from './api/apiClient.js';
 export * from './types/auth.js';
 export * from './types/sse.js';
 export * from './types/workflow.js';
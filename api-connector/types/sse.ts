@@ -23,6 +23,8 @@ export interface WorkflowEventMeta {
   error?: boolean;
   error_type?: string;
   risk_type?: string;
+  reason?: string; // Begründung bei status 'rejected'
+  retryable?: boolean;
   user_not_logged_in?: boolean;
   [key: string]: any; // Weitere dynamische Felder
 }
@@ -49,6 +51,9 @@ export interface WorkflowEvent {
 export type WorkflowStep =
   | 'pending'
   | 'started'
+  | 'validation'
+  | 'validated'
+  | 'rejected'
   | 'classification'
   | 'classified'
   | 'inquiry'
@@ -20,10 +20,13 @@ export interface StartWorkflowResponse {
   task_id: string;
   risk_uuid: string;
   user_uuid: string;
+  status?: string; // 'created' - Validierung läuft asynchron als erste Workflow-Stufe
 }
 
 /**
  * Error Response bei Validierungsfehler (API Response Format)
+ * Beim Start nur durch die lokale Vorprüfung - die Ablehnung durch den
+ * ValidationAgent kommt als Workflow-Event mit status 'rejected' und reason
  */
 export interface WorkflowValidationErrorResponse {
   error: 'risk_validation_failed';
@@ -60,7 +63,7 @@ export interface WorkflowStatusByRiskResponse {
   inquiry?: string[];
   risk_uuid: string;
   user_uuid: string;
-  failed_reason?: string | null;
+  failed_reason?: string | null; // Bei status 'rejected': Begründung der Ablehnung
 }
 
 /**
@@ -71,7 +74,9 @@ export type WorkflowStatus =
   | 'progress'
   | 'inquiry_awaiting_response'
   | 'login_required'
+  | 'created'
   | 'validated'
+  | 'rejected'
   | 'classified'
   | 'inquired'
   | 'researched'
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Checks that the hot risk_assessments access paths use their indexes.
+
+Seeds a scratch database with synthetic risks (default 1,000,000 rows, generated
+server-side with generate_series), runs ANALYZE and compares the EXPLAIN plan of
+each access path (compiled from the real ORM queries) with the expected indexes.
+A plan that falls back to a sequential scan fails the check - run it after
+adding or changing queries on risk_assessments.
+
+Usage:
+    python check_query_plans.py
+    python check_query_plans.py --rows 200000 --keep
+    ./deploy/check_query_plans.py --force
+
+Requirements:
+    - DATABASE_URL pointing to a PostgreSQL scratch database
+    - Schema created/migrated (the app does this on startup)
+
+The seeded rows are tagged and deleted afterwards (unless --keep). The script refuses
+to run on a database with other risks unless --force is given.
+
+Exit code 0 if all plans use the expected indexes, 1 otherwise.
+"""
+
+import argparse
+import json
+import sys
+import os
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+server_dir = os.path.join(project_root, 'server')
+sys.path.insert(0, server_dir)
+
+SEED_PROMPT = '__query_plan_check__'
+SEED_USERS = 10000
+
+
+def seed_rows(db, rows):
+    """
+    Insert synthetic risks with a production-like status mix
+
+    ~90% completed/signed, 5% available, 2% rejected, the rest spread over
+    the workflow statuses; ~0.1% failed. Payloads only for analyzed risks.
+    """
+    from sqlalchemy import text
+
+    db.session.execute(text("""
+        INSERT INTO risk_assessments (
+            creation_date, last_updated, user_uuid, risk_uuid, status, initial_prompt,
+            insurance_value, analysis, report, retry_count, failed_at, admin_notified, lease_token
+        )
+        SELECT
+            now() - (n % 730) * interval '1 day' - (n % 86400) * interval '1 second',
+            now(),
+            md5('user' || (n % :users))::uuid::text,
+            md5('risk' || n || random())::uuid::text,
+            s.status,
+            :prompt,
+            (n % 500) * 1000.0,
+            CASE WHEN s.status IN ('analyzed', 'completed', 'available', 'signed') THEN
+                jsonb_build_object(
+                    'probability_percentage', (n % 1000) / 10.0,
+                    'expected_damage', (n % 2000) * 50.0,
+                    'max_damage_pml', (n % 2000) * 500.0
+                )
+            END,
+            CASE WHEN s.status IN ('completed', 'available', 'signed') THEN
+                jsonb_build_object('title', 'Risk ' || n)
+            END,
+            0,
+            CASE WHEN n % 1000 = 0 THEN now() - interval '1 hour' END,
+            false,
+            0
+        FROM generate_series(1, :rows) AS n
+        CROSS JOIN LATERAL (
+            SELECT CASE
+                WHEN n % 100 < 60 THEN 'completed'
+                WHEN n % 100 < 90 THEN 'signed'
+                WHEN n % 100 < 95 THEN 'available'
+                WHEN n % 100 < 97 THEN 'rejected'
+                WHEN n % 100 = 97 THEN 'inquiry_awaiting_response'
+                ELSE (ARRAY['created', 'validated', 'inquired', 'researched', 'analyzed'])[(1 + n % 5)::int]
+            END AS status
+        ) AS s
+    """), {'rows': rows, 'users': SEED_USERS, 'prompt': SEED_PROMPT})
+    # Nicht-fehlgeschlagene Kandidaten im Retry-Scan: nur wenige sind wirklich offen
+    db.session.execute(text("""
+        UPDATE risk_assessments SET processing_since = now()
+        WHERE initial_prompt = :prompt AND failed_at IS NULL
+          AND status IN ('created', 'validated', 'inquired', 'researched', 'analyzed')
+          AND id % 50 <> 0
+    """), {'prompt': SEED_PROMPT})
+    db.session.commit()
+    db.session.execute(text("ANALYZE risk_assessments"))
+    db.session.commit()
+
+
+def delete_seed_rows(db):
+    from sqlalchemy import text
+
+    db.session.execute(text("DELETE FROM risk_assessments WHERE initial_prompt = :prompt"), {'prompt': SEED_PROMPT})
+    db.session.commit()
+
+
+def access_paths(user_uuid, risk_uuid):
+    """
+    Access paths of the app and the indexes that may serve them
+
+    Returns:
+        list: (name, query, accepted index names)
+    """
+    from datetime import datetime, timezone
+    from sqlalchemy import or_
+    from models import RiskAssessment
+
+    available = RiskAssessment.status == 'available'
+    now = datetime.now(timezone.utc)
+
+    def retry_batch(query):
+        # Wie retry_task._claim_batches: Keyset über id, FOR UPDATE SKIP LOCKED
+        return query.filter(RiskAssessment.id > 0).order_by(RiskAssessment.id).limit(100).with_for_update(
+            skip_locked=True, of=RiskAssessment
+        )
+
+    return [
+        ('get_by_uuids',
+         RiskAssessment.query.filter_by(user_uuid=user_uuid, risk_uuid=risk_uuid),
+         {'ix_risk_assessments_risk_uuid'}),
+        ('own risks by creation date',
+         RiskAssessment.query_with_payloads().filter(RiskAssessment.user_uuid == user_uuid)
+         .order_by(RiskAssessment.creation_date.desc(), RiskAssessment.id),
+         {'ix_risk_assessments_user_created', 'ix_risk_assessments_user_uuid'}),
+        ('own + marketplace risks by creation date',
+         RiskAssessment.query_with_payloads().filter(or_(RiskAssessment.user_uuid == user_uuid, available))
+         .order_by(RiskAssessment.creation_date.desc(), RiskAssessment.id),
+         {'ix_risk_assessments_available_created', 'ix_risk_assessments_status_created'}),
+        ('marketplace by probability',
+         RiskAssessment.query_with_payloads().filter(available, RiskAssessment.analysis_probability >= 95)
+         .order_by(RiskAssessment.analysis_probability.desc().nulls_last(), RiskAssessment.id),
+         {'ix_risk_assessments_available_probability'}),
+        ('marketplace by expected damage',
+         RiskAssessment.query_with_payloads().filter(available, RiskAssessment.analysis_expected_damage <= 500)
+         .order_by(RiskAssessment.analysis_expected_damage.asc().nulls_last(), RiskAssessment.id),
+         {'ix_risk_assessments_available_expected_damage'}),
+        ('get_by_status',
+         RiskAssessment.query.filter_by(status='validated').order_by(RiskAssessment.creation_date.desc()),
+         {'ix_risk_assessments_status_created'}),
+        ('retry scan: pending',
+         retry_batch(RiskAssessment.pending_risks_query(now)),
+         {'ix_risk_assessments_retry_pending'}),
+        ('retry scan: failed',
+         retry_batch(RiskAssessment.failed_risks_query(now)),
+         {'ix_risk_assessments_retry_failed'}),
+    ]
+
+
+def plan_indexes(node):
+    """Collect the index names and scan types of an EXPLAIN (FORMAT JSON) plan"""
+    indexes, scans = set(), set()
+    if 'Index Name' in node:
+        indexes.add(node['Index Name'])
+    scans.add(node['Node Type'])
+    for child in node.get('Plans', []):
+        child_indexes, child_scans = plan_indexes(child)
+        indexes |= child_indexes
+        scans |= child_scans
+    return indexes, scans
+
+
+def explain(db, query):
+    from sqlalchemy.dialects import postgresql
+
+    sql = query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    result = db.session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    plan = result if isinstance(result, list) else json.loads(result)
+    return plan[0]['Plan']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check index usage of the risk_assessments access paths')
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of synthetic risks (default: 1000000)')
+    parser.add_argument('--keep', action='store_true', help='Keep the seeded rows')
+    parser.add_argument('--force', action='store_true', help='Run on a database that contains other risks')
+    args = parser.parse_args()
+
+    from sqlalchemy import text
+    from app import app
+    from models import db, RiskAssessment
+
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            print("❌ Query plans can only be checked on PostgreSQL")
+            return 1
+
+        other_rows = RiskAssessment.query.filter(RiskAssessment.initial_prompt != SEED_PROMPT).count()
+        if other_rows and not args.force:
+            print(f"❌ Database contains {other_rows} other risks - use a scratch database or --force")
+            return 1
+
+        seeded = RiskAssessment.query.filter(RiskAssessment.initial_prompt == SEED_PROMPT).count()
+        if seeded < args.rows:
+            if seeded:
+                delete_seed_rows(db)
+            print(f"Seeding {args.rows} risks...")
+            seed_rows(db, args.rows)
+
+        sample = db.session.execute(text(
+            "SELECT user_uuid, risk_uuid FROM risk_assessments WHERE initial_prompt = :prompt LIMIT 1"
+        ), {'prompt': SEED_PROMPT}).first()
+
+        failures = 0
+        try:
+            for name, query, accepted in access_paths(sample.user_uuid, sample.risk_uuid):
+                plan = explain(db, query)
+                indexes, scans = plan_indexes(plan)
+                if indexes & accepted and 'Seq Scan' not in scans:
+                    print(f"✅ {name}: {', '.join(sorted(indexes))} (cost {plan['Total Cost']:.0f})")
+                else:
+                    failures += 1
+                    used = ', '.join(sorted(indexes)) or ', '.join(sorted(scans))
+                    print(f"❌ {name}: expected {' or '.join(sorted(accepted))}, plan uses {used}")
+        finally:
+            db.session.rollback()
+            if not args.keep:
+                delete_seed_rows(db)
+
+        if failures:
+            print(f"❌ {failures} access path(s) without their index")
+            return 1
+        print("✅ All access paths use their indexes")
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,9 +9,9 @@ Analyzes risk probability and potential damage
 import json
 import logging
 import re
-from typing import Dict
+from typing import Callable, Dict, Optional
 from agents.base_agent import AIAgent
-from agents.prompt_templates import AnalysisPromptTemplate
+from agents.prompt_templates import AnalysisPromptTemplate, get_length_instruction
 from config import Config
 
 
@@ -26,13 +26,15 @@ class AnalysisAgent(AIAgent):
             "premium_range": (0, 10000)     # 0 to 10K EUR per month
         }
     
-    def analyze_risk(self, risk_description: str, research_data: Dict) -> Dict:
+    def analyze_risk(self, risk_description: str, research_data: Dict,
+                     on_partial: Optional[Callable[[Dict], None]] = None) -> Dict:
         """
         Analyze risk probability and potential damage
         
         Args:
             risk_description (str): The risk description
             research_data (Dict): Research data from previous steps
+            on_partial (Callable): Optional callback for streamed partial fields
             
         Returns:
             Dict: Risk analysis results
@@ -44,13 +46,17 @@ class AnalysisAgent(AIAgent):
             },
             {
                 "role": "user",
-                "content": f"Analysieren Sie dieses Risiko: {risk_description}\n\nRecherchedaten: {json.dumps(research_data, indent=2)}"
+                "content": f"Analysieren Sie dieses Risiko: {risk_description}\n\nRecherchedaten: {json.dumps(research_data, indent=2)}\n\n{get_length_instruction('analysis')}"
             }
         ]
         
-        response = self._make_request(messages)
+        response = self._make_request(
+            messages,
+            on_partial=on_partial,
+            response_format=AnalysisPromptTemplate.get_response_format()
+        )
         try:
-            analysis = self._extract_json_from_response(response)
+            analysis = self._parse_json_response(response, repair=self._extract_json_from_response)
             logging.info(f"Successfully parsed analysis: {analysis}")
             return self._validate_analysis(analysis)
         except (json.JSONDecodeError, ValueError, TypeError) as e:
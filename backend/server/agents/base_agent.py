@@ -10,9 +10,14 @@ import json
 import logging
 import os
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from config import Config
 from agents.model_config import ModelConfigWrapper
+from agents.stream_parser import IncrementalJSONFieldParser
+from llm_batch import LLMBatchPending, current_batch_scope, submit_or_replay
+from llm_ledger import record_llm_call
+from llm_trace import TruncatedText, should_trace, write_trace
+from tracing import span
 
 # Hole den bereits in app.py initialisierten OpenAI_API Logger
 logger = logging.getLogger('OpenAI_API')
@@ -53,6 +58,9 @@ class AIAgent:
         masked_key = api_key[:8] + "..." + api_key[-4:] if len(api_key) > 12 else "***"
         logger.info(f"{agent_name} using API key: {masked_key}")
         
+        # Token-Verbrauch des letzten Requests (inkl. gecachter Prompt-Tokens)
+        self.last_usage: Dict = {}
+        
         try:
             self.client = openai.OpenAI(api_key=api_key)
             logger.info(f"{agent_name} successfully initialized")
@@ -60,13 +68,23 @@ class AIAgent:
             logger.error(f"Failed to initialize {agent_name}: {str(e)}")
             raise Exception(f"Fehler beim Initialisieren des OpenAI-Clients: {str(e)}")
     
-    def _make_request(self, messages: List[Dict], model: str = None) -> str:
+    # JSON-Felder, die im Streaming-Modus vorab veröffentlicht werden
+    STREAM_PARTIAL_FIELDS = ('title', 'summary')
+    
+    def _make_request(self, messages: List[Dict], model: str = None,
+                      on_partial: Optional[Callable[[Dict], None]] = None,
+                      response_format: Optional[Dict] = None) -> str:
         """
         Make a request to OpenAI API with comprehensive logging
         
         Args:
             messages (List[Dict]): List of message dictionaries
             model (str): OpenAI model to use (if None, uses agent-specific config)
+            on_partial (Callable): Optional callback for partial fields. Only used if
+                streaming is enabled for this agent (AGENT_STREAMING); receives a dict
+                with all fields of STREAM_PARTIAL_FIELDS completed so far
+            response_format (Dict): Optional structured output format (json_schema). Only
+                used if enabled for this agent (AGENT_STRUCTURED_OUTPUT) and supported by the model
             
         Returns:
             str: Response content from OpenAI
@@ -97,29 +115,28 @@ class AIAgent:
         temperature = Config.AGENT_TEMPERATURES.get(config_key, Config.OPENAI_TEMPERATURE)
         max_tokens = Config.AGENT_MAX_TOKENS.get(config_key, Config.OPENAI_MAX_TOKENS)
         use_flex = Config.AGENT_USE_FLEX.get(config_key, False)
+        use_streaming = on_partial is not None and Config.AGENT_STREAMING.get(config_key, False)
+        if response_format is not None and not Config.AGENT_STRUCTURED_OUTPUT.get(config_key, False):
+            response_format = None
         
         request_id = f"req_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
         
-        import inspect
-        frame = inspect.currentframe()
-        calling_frame = frame.f_back.f_back
-        calling_file = calling_frame.f_code.co_filename.split('/')[-1] if calling_frame else 'unknown'
-        calling_method = calling_frame.f_code.co_name if calling_frame else 'unknown'
-        
-        logger.info(f"[{request_id}] ===== {agent_name.upper()} - OpenAI API Request =====")
-        logger.info(f"[{request_id}] Agent: {agent_name}")
-        logger.info(f"[{request_id}] Called from: {calling_file}:{calling_method}")
-        logger.info(f"[{request_id}] Model: {model}")
-        logger.info(f"[{request_id}] Temperature: {temperature}")
-        logger.info(f"[{request_id}] Max Tokens: {max_tokens}")
-        logger.info(f"[{request_id}] Config Use Flex: {use_flex}")
-        
-        logger.info(f"[{request_id}] Messages count: {len(messages)}")
-        for i, msg in enumerate(messages):
-            role = msg.get('role', 'unknown')
-            content = msg.get('content', '')
-            logger.info(f"[{request_id}] Message {i+1} ({role}): {content}")
-            
+        # Nur Metadaten auf INFO - Payloads gekürzt auf DEBUG, vollständig nur im Trace-Store
+        logger.info(
+            "[%s] %s request: model=%s temperature=%s max_tokens=%s flex=%s streaming=%s structured=%s messages=%d",
+            request_id, agent_name, model, temperature, max_tokens, use_flex, use_streaming,
+            response_format is not None, len(messages)
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, msg in enumerate(messages):
+                logger.debug("[%s] Message %d (%s): %s", request_id, i + 1,
+                             msg.get('role', 'unknown'), TruncatedText(msg.get('content', '')))
+        
+        trace = should_trace()
+        effective_service_tier = None
+        safe_params = {}
+        request_params = {}
+        start_time = datetime.now()
         try:
             model_config = ModelConfigWrapper(model)
             model_info = model_config.get_model_info()
@@ -131,56 +148,57 @@ class AIAgent:
             if use_flex and not model_supports_flex:
                 logger.warning(f"[{request_id}] Agent configured to use flex, but model {model} does not support service_tier. Ignoring flex setting.")
             
-            logger.info(f"[{request_id}] Effective Service Tier: {effective_service_tier if effective_service_tier else 'None'}")
-            
             request_params = model_config.get_request_params(
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
-                service_tier=effective_service_tier
+                service_tier=effective_service_tier,
+                response_format=response_format
             )
-            
-            logger.info(f"[{request_id}] Model capabilities: {model_info}")
+            if use_streaming:
+                request_params['stream'] = True
+                request_params['stream_options'] = {'include_usage': True}
             
             safe_params = {k: v for k, v in request_params.items() if k != 'messages'}
-            logger.info(f"[{request_id}] Request parameters: {json.dumps(safe_params, indent=2)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[%s] Model capabilities: %s", request_id, model_info)
+                logger.debug("[%s] Request parameters: %s", request_id, TruncatedText(json.dumps(safe_params)))
+            
+            # Nicht-interaktive Workflows laufen über die Batch API
+            if current_batch_scope() is not None:
+                logger.info(f"[{request_id}] Batch scope active - routing request through Batch API")
+                return submit_or_replay(config_key, request_params)
             
             start_time = datetime.now()
-            response = self.client.chat.completions.create(
-                **request_params
-            )
+            response = self._create_completion(request_params, request_id, on_partial if use_streaming else None)
             end_time = datetime.now()
             
             duration = (end_time - start_time).total_seconds()
+            response_content = response['content']
             
-            logger.info(f"[{request_id}] ===== {agent_name.upper()} - OpenAI API Response =====")
-            logger.info(f"[{request_id}] OpenAI Request ID: {response.id}")
-            logger.info(f"[{request_id}] API call completed in {duration:.2f} seconds")
-            logger.info(f"[{request_id}] Response model: {response.model}")
-            logger.info(f"[{request_id}] Usage - Prompt tokens: {response.usage.prompt_tokens}")
-            logger.info(f"[{request_id}] Usage - Completion tokens: {response.usage.completion_tokens}")
-            logger.info(f"[{request_id}] Usage - Total tokens: {response.usage.total_tokens}")
-            
-            response_content = response.choices[0].message.content
-            
-            logger.info(f"[{request_id}] Response content: {response_content}")
-            logger.info(f"[{request_id}] Response length: {len(response_content)} characters")
-            
-            finish_reason = response.choices[0].finish_reason
-            logger.info(f"[{request_id}] Finish reason: {finish_reason}")
-            logger.info(f"[{request_id}] ===== {agent_name.upper()} - Request Complete =====")
+            logger.info(
+                "[%s] %s response: openai_id=%s model=%s tier=%s duration=%.2fs finish_reason=%s length=%d",
+                request_id, agent_name, response['id'], response['model'], effective_service_tier,
+                duration, response['finish_reason'], len(response_content or '')
+            )
+            logger.debug("[%s] Response content: %s", request_id, TruncatedText(response_content))
+            self._log_usage(request_id, response['usage'])
+            record_llm_call(config_key, model, effective_service_tier, duration * 1000, self.last_usage)
+            if trace:
+                write_trace(request_id, config_key, request_params, response_content,
+                            duration=duration, usage=self.last_usage)
             
             return response_content
             
+        except LLMBatchPending:
+            raise
         except Exception as e:
             error_type = type(e).__name__
             error_str = str(e)
-            logger.error(f"[{request_id}] OpenAI API error: {error_str}")
-            logger.error(f"[{request_id}] Error type: {error_type}")
-            logger.error(f"[{request_id}] Failed request parameters: {json.dumps(safe_params, indent=2)}")
-            
-            import traceback
-            logger.error(f"[{request_id}] Full traceback: {traceback.format_exc()}")
+            logger.error("[%s] OpenAI API error (%s): %s", request_id, error_type, error_str, exc_info=True)
+            logger.error("[%s] Failed request parameters: %s", request_id, TruncatedText(json.dumps(safe_params)))
+            if trace:
+                write_trace(request_id, config_key, request_params, error=f"{error_type}: {error_str}")
             
             # Automatisches Retry NUR bei OpenAI API Fehlern (Timeout oder 5xx) MIT service_tier
             # NICHT bei eigenen Server-Fehlern!
@@ -216,39 +234,154 @@ class AIAgent:
                 retry_params = {k: v for k, v in request_params.items() if k != 'service_tier'}
                 
                 try:
-                    logger.info(f"[{request_id}] Retry ohne service_tier nach 5 Sekunden: {json.dumps({k: v for k, v in retry_params.items() if k != 'messages'}, indent=2)}")
+                    logger.info("[%s] Retry ohne service_tier nach 5 Sekunden", request_id)
                     
                     # Retry ohne service_tier
-                    response = self.client.chat.completions.create(
-                        **retry_params
-                    )
+                    response = self._create_completion(retry_params, request_id, on_partial if use_streaming else None)
                     
                     end_time = datetime.now()
                     duration = (end_time - start_time).total_seconds()
                     
-                    logger.info(f"[{request_id}] ===== {agent_name.upper()} - OpenAI API Response (RETRY) =====")
-                    logger.info(f"[{request_id}] Retry successful after removing service_tier")
-                    logger.info(f"[{request_id}] OpenAI Request ID: {response.id}")
-                    logger.info(f"[{request_id}] API call completed in {duration:.2f} seconds (inkl. 5s Wartezeit)")
-                    logger.info(f"[{request_id}] Response model: {response.model}")
-                    logger.info(f"[{request_id}] Usage - Prompt tokens: {response.usage.prompt_tokens}")
-                    logger.info(f"[{request_id}] Usage - Completion tokens: {response.usage.completion_tokens}")
-                    logger.info(f"[{request_id}] Usage - Total tokens: {response.usage.total_tokens}")
+                    response_content = response['content']
                     
-                    response_content = response.choices[0].message.content
-                    logger.info(f"[{request_id}] Response content: {response_content}")
-                    logger.info(f"[{request_id}] Response length: {len(response_content)} characters")
-                    logger.info(f"[{request_id}] Finish reason: {response.choices[0].finish_reason}")
-                    logger.info(f"[{request_id}] ===== {agent_name.upper()} - Retry Complete =====")
+                    logger.info(
+                        "[%s] %s retry response (without service_tier): openai_id=%s model=%s "
+                        "duration=%.2fs (inkl. 5s Wartezeit) finish_reason=%s length=%d",
+                        request_id, agent_name, response['id'], response['model'],
+                        duration, response['finish_reason'], len(response_content or '')
+                    )
+                    logger.debug("[%s] Response content: %s", request_id, TruncatedText(response_content))
+                    self._log_usage(request_id, response['usage'])
+                    record_llm_call(config_key, model, None, duration * 1000, self.last_usage, retries=1)
+                    if trace:
+                        write_trace(request_id, config_key, retry_params, response_content,
+                                    duration=duration, usage=self.last_usage)
                     
                     return response_content
                     
                 except Exception as retry_error:
                     logger.error(f"[{request_id}] Retry also failed: {str(retry_error)}")
+                    record_llm_call(config_key, model, None, (datetime.now() - start_time).total_seconds() * 1000,
+                                    None, retries=1, success=False)
                     raise Exception(f"OpenAI API error nach Retry: {str(retry_error)}")
             
+            record_llm_call(config_key, model, effective_service_tier,
+                            (datetime.now() - start_time).total_seconds() * 1000, None, success=False)
             raise Exception(f"OpenAI API error: {str(e)}")
     
+    def _create_completion(self, request_params: Dict, request_id: str,
+                           on_partial: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Execute the chat completion call, either blocking or as stream
+        
+        Every call is traced as span 'openai.chat.completions' (incl. token usage).
+        
+        Args:
+            request_params (Dict): Parameters for chat.completions.create
+            request_id (str): Local request ID for logging
+            on_partial (Callable): Callback for partial fields (streaming only)
+            
+        Returns:
+            Dict: id, model, content, finish_reason and usage of the completion
+        """
+        with span('openai.chat.completions', kind='client', agent=self.__class__.__name__,
+                  model=request_params.get('model'), request_id=request_id,
+                  service_tier=request_params.get('service_tier'),
+                  stream=bool(request_params.get('stream'))) as active_span:
+            result = self._execute_completion(request_params, request_id, on_partial)
+            for key, value in self._usage_to_dict(result['usage']).items():
+                active_span.set_attribute(f"usage.{key}", value)
+            active_span.set_attribute('finish_reason', result['finish_reason'])
+            return result
+    
+    def _execute_completion(self, request_params: Dict, request_id: str,
+                            on_partial: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Run chat.completions.create and collect the result (see _create_completion)"""
+        if not request_params.get('stream'):
+            response = self.client.chat.completions.create(**request_params)
+            return {
+                'id': response.id,
+                'model': response.model,
+                'content': response.choices[0].message.content,
+                'finish_reason': response.choices[0].finish_reason,
+                'usage': response.usage
+            }
+        
+        stream = self.client.chat.completions.create(**request_params)
+        parser = IncrementalJSONFieldParser(self.STREAM_PARTIAL_FIELDS)
+        result = {'id': None, 'model': None, 'content': '', 'finish_reason': None, 'usage': None}
+        content_parts = []
+        
+        for chunk in stream:
+            result['id'] = result['id'] or chunk.id
+            result['model'] = result['model'] or chunk.model
+            # Letzter Chunk enthält bei include_usage nur die Usage-Daten
+            if getattr(chunk, 'usage', None):
+                result['usage'] = chunk.usage
+            if not chunk.choices:
+                continue
+            
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                result['finish_reason'] = choice.finish_reason
+            delta = choice.delta.content if choice.delta else None
+            if not delta:
+                continue
+            
+            content_parts.append(delta)
+            if parser.feed(delta):
+                try:
+                    on_partial(dict(parser.emitted))
+                except Exception as e:
+                    # Fortschrittsmeldungen dürfen den Request nie abbrechen
+                    logger.warning(f"[{request_id}] Partial callback failed: {str(e)}")
+        
+        result['content'] = ''.join(content_parts)
+        logger.info(f"[{request_id}] Stream finished - partial fields published: {list(parser.emitted.keys())}")
+        return result
+    
+    @staticmethod
+    def _usage_to_dict(usage) -> Dict:
+        """
+        Convert an OpenAI usage object into a plain dict
+        
+        Args:
+            usage: Usage object from the OpenAI response or None
+            
+        Returns:
+            Dict: prompt, completion, total and cached (prefix cache hit) tokens
+        """
+        if usage is None:
+            return {}
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return {
+            'prompt_tokens': usage.prompt_tokens or 0,
+            'completion_tokens': usage.completion_tokens or 0,
+            'total_tokens': usage.total_tokens or 0,
+            'cached_tokens': (getattr(details, 'cached_tokens', None) or 0) if details else 0
+        }
+    
+    def _log_usage(self, request_id: str, usage) -> None:
+        """
+        Log and record token usage of a completion (usage may be missing for streams)
+        
+        The result is kept in self.last_usage so callers can evaluate
+        the prompt cache hit rate (cached_tokens / prompt_tokens).
+        
+        Args:
+            request_id (str): Local request ID for logging
+            usage: Usage object from the OpenAI response or None
+        """
+        self.last_usage = self._usage_to_dict(usage)
+        if not self.last_usage:
+            logger.info("[%s] Usage - not reported", request_id)
+            return
+        logger.info(
+            "[%s] Usage - prompt=%d cached=%d completion=%d total=%d", request_id,
+            self.last_usage['prompt_tokens'], self.last_usage['cached_tokens'],
+            self.last_usage['completion_tokens'], self.last_usage['total_tokens']
+        )
+    
     def get_agent_config(self) -> Dict:
         """
         Get the configuration for this specific agent
@@ -306,6 +439,33 @@ class AIAgent:
         
         return cleaned_response.strip()
     
+    def _parse_json_response(self, response: str, repair: Optional[Callable[[str], object]] = None):
+        """
+        Parse a JSON response in a single pass, repairing it only if necessary
+        
+        With structured output the response is guaranteed to be valid JSON, so
+        json.loads succeeds directly. The repair function is only used as fallback
+        (e.g. for models without structured output support).
+        
+        Args:
+            response (str): Raw response from AI
+            repair (Callable): Fallback parser (default: strip markdown and parse)
+            
+        Returns:
+            Parsed JSON data
+            
+        Raises:
+            json.JSONDecodeError: If the response cannot be parsed at all
+        """
+        try:
+            return json.loads(response)
+        except json.JSONDecodeError as e:
+            logger.warning(f"{self.__class__.__name__}: response is not plain JSON ({str(e)}), using repair fallback")
+        
+        if repair is None:
+            return json.loads(self._clean_json_response(response))
+        return repair(response)
+    
     def _validate_response(self, response: str, expected_type: str = "json") -> bool:
         """
         Validate the response format
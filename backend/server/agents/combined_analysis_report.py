@@ -8,9 +8,9 @@ Combines analysis and report generation for small risks (threshold configurable
 
 import json
 import logging
-from typing import Dict
+from typing import Callable, Dict, Optional
 from agents.base_agent import AIAgent
-from agents.prompt_templates import CombinedPromptTemplate
+from agents.prompt_templates import CombinedPromptTemplate, get_length_instruction
 from config import Config
 
 
@@ -33,7 +33,8 @@ class CombinedAnalysisReportAgent(AIAgent):
             'uncertainties'
         ]
     
-    def analyze_and_report(self, risk_description: str, risk_data: Dict) -> Dict:
+    def analyze_and_report(self, risk_description: str, risk_data: Dict,
+                           on_partial: Optional[Callable[[Dict], None]] = None) -> Dict:
         """
         Combined analysis and report generation for small risks
         This combines the functionality of AnalysisAgent and ReportAgent in a single call
@@ -41,6 +42,7 @@ class CombinedAnalysisReportAgent(AIAgent):
         Args:
             risk_description (str): The risk description
             risk_data (Dict): Risk data including classification, inquiry responses, etc.
+            on_partial (Callable): Optional callback for streamed partial fields
             
         Returns:
             Dict: Combined analysis and report results
@@ -54,9 +56,8 @@ class CombinedAnalysisReportAgent(AIAgent):
             },
             {
                 "role": "user",
-                "content": f"""Analysieren Sie dieses Risiko UND berechnen SIE ALLE WERTE basierend auf den folgenden Daten. Verwenden Sie KEINE Beispieldaten - berechnen Sie alles neu:
-
-{formatted_risk_data}
+                # Statische Anweisungen zuerst, Risikodaten zuletzt (Prefix Caching)
+                "content": f"""Führen Sie die kombinierte Analyse und Berichterstellung durch. Analysieren Sie dieses Risiko UND berechnen SIE ALLE WERTE basierend auf den folgenden Daten. Verwenden Sie KEINE Beispieldaten - berechnen Sie alles neu.
 
 WICHTIG: 
 - Analysieren Sie die Risikobeschreibung und Risikodaten sorgfältig
@@ -64,15 +65,19 @@ WICHTIG:
 - Nutzen Sie die Recherche-Ergebnisse zur Kontextualisierung der Risikobewertung
 - Verwenden Sie die Rückfragen und Antworten für zusätzliche Informationen
 - Geben Sie NUR berechnete Werte zurück, keine Beispieldaten
+- {get_length_instruction('report')}
 
-Führen Sie die kombinierte Analyse und Berichterstellung durch."""
+{formatted_risk_data}"""
             }
         ]
         
-        response = self._make_request(messages)
+        response = self._make_request(
+            messages,
+            on_partial=on_partial,
+            response_format=CombinedPromptTemplate.get_response_format()
+        )
         try:
-            cleaned_response = self._clean_json_response(response)
-            result = json.loads(cleaned_response)
+            result = self._parse_json_response(response)
             
             validated_result = self._validate_combined_result(result)
             return validated_result
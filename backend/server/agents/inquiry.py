@@ -9,7 +9,7 @@ Generates precise questions for incomplete risk descriptions
 import json
 from typing import List
 from agents.base_agent import AIAgent
-from config import Config
+from agents.prompt_templates import InquiryPromptTemplate, get_length_instruction
 
 
 class InquiryAgent(AIAgent):
@@ -35,7 +35,6 @@ class InquiryAgent(AIAgent):
                 "content": f"""# Rolle und Ziel
 Sie sind ein Experte für Versicherungsunderwriting. Analysieren Sie die gegebene Risikobeschreibung und prüfen Sie, ob zusätzliche Informationen benötigt werden.
 # Anweisungen
-- Halten Sie Ihre Antwort präzise und verwenden Sie weniger als {Config.AGENT_MAX_TOKENS.get('inquiry', 3000)} Tokens.
 - Generieren Sie bis zu {self.max_inquiries} kurze, präzise, spezifische Rückfragen, um das Risiko besser zu verstehen.
 - Fokussieren Sie auf die Spezifizierung vager Begriffe und stellen Sie für unterschiedliche Risikotypen gezielte Rückfragen.
 
@@ -84,15 +83,16 @@ WICHTIG: Geben Sie NUR das JSON-Objekt zurück, ohne zusätzlichen Text oder For
             },
             {
                 "role": "user",
-                "content": f"Analysieren Sie diese Risikobeschreibung und generieren Sie bei Bedarf Rückfragen: {risk_description}"
+                "content": f"{get_length_instruction('inquiry', 3000)}\n\nAnalysieren Sie diese Risikobeschreibung und generieren Sie bei Bedarf Rückfragen: {risk_description}"
             }
         ]
         
-        response = self._make_request(messages)
+        response = self._make_request(
+            messages,
+            response_format=InquiryPromptTemplate.get_response_format()
+        )
         try:
-            # Nutze die zentrale Methode zum Bereinigen der Response
-            cleaned_response = self._clean_json_response(response)
-            result = json.loads(cleaned_response)
+            result = self._parse_json_response(response)
             # Extrahiere die questions Liste aus dem JSON
             if isinstance(result, dict) and 'questions' in result:
                 inquiries = result['questions']
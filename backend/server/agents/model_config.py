@@ -23,42 +23,48 @@ class ModelConfigWrapper:
             'supports_max_tokens': False,   # Uses max_completion_tokens
             'supports_service_tier': True,  # Supports flex
             'default_temperature': 1.0,
-            'max_completion_tokens_param': True
+            'max_completion_tokens_param': True,
+            'supports_structured_output': True
         },
         'gpt-4o': {
             'supports_temperature': True,
             'supports_max_tokens': True,
             'supports_service_tier': False,
             'default_temperature': 0.7,
-            'max_completion_tokens_param': False
+            'max_completion_tokens_param': False,
+            'supports_structured_output': True
         },
         'gpt-4o-mini': {
             'supports_temperature': True,
             'supports_max_tokens': True,
             'supports_service_tier': False,
             'default_temperature': 0.7,
-            'max_completion_tokens_param': False
+            'max_completion_tokens_param': False,
+            'supports_structured_output': True
         },
         'o3': {
             'supports_temperature': True,
             'supports_max_tokens': False,   # Uses max_completion_tokens
             'supports_service_tier': True,  # Supports flex
             'default_temperature': 0.7,
-            'max_completion_tokens_param': True
+            'max_completion_tokens_param': True,
+            'supports_structured_output': True
         },
         'o4-mini': {
             'supports_temperature': True,
             'supports_max_tokens': False,   # Uses max_completion_tokens
             'supports_service_tier': True,  # Supports flex
             'default_temperature': 0.7,
-            'max_completion_tokens_param': True
+            'max_completion_tokens_param': True,
+            'supports_structured_output': True
         },
         'gpt-3.5-turbo': {
             'supports_temperature': True,
             'supports_max_tokens': True,
             'supports_service_tier': False,
             'default_temperature': 0.7,
-            'max_completion_tokens_param': False
+            'max_completion_tokens_param': False,
+            'supports_structured_output': False
         }
     }
     
@@ -75,7 +81,8 @@ class ModelConfigWrapper:
             'supports_max_tokens': True,
             'supports_service_tier': False,
             'default_temperature': 0.7,
-            'max_completion_tokens_param': False
+            'max_completion_tokens_param': False,
+            'supports_structured_output': False
         })
         
         logger.debug(f"ModelConfigWrapper initialized for {model}")
@@ -126,11 +133,28 @@ class ModelConfigWrapper:
         
         return requested_service_tier
     
+    def get_response_format(self, requested_format: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Get the structured output format for the model
+        
+        Args:
+            requested_format (Dict[str, Any]): The requested response_format (json_schema)
+            
+        Returns:
+            Optional[Dict[str, Any]]: The response_format to use, or None if not supported
+        """
+        if not self.capabilities.get('supports_structured_output', False):
+            logger.debug(f"Model {self.model} does not support structured output. Ignoring.")
+            return None
+        
+        return requested_format
+    
     def get_request_params(self, 
                           messages: list,
                           temperature: float,
                           max_tokens: int,
-                          service_tier: str = None) -> Dict[str, Any]:
+                          service_tier: str = None,
+                          response_format: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         Get the complete request parameters for the model
         
@@ -139,6 +163,7 @@ class ModelConfigWrapper:
             temperature (float): The requested temperature
             max_tokens (int): The requested max tokens
             service_tier (str): The requested service tier
+            response_format (Dict[str, Any]): The requested structured output format
             
         Returns:
             Dict[str, Any]: Complete request parameters for the API call
@@ -162,6 +187,12 @@ class ModelConfigWrapper:
             if tier:
                 params['service_tier'] = tier
         
+        # Handle structured output
+        if response_format:
+            fmt = self.get_response_format(response_format)
+            if fmt:
+                params['response_format'] = fmt
+        
         logger.debug(f"Generated request params for {self.model}: {list(params.keys())}")
         return params
     
@@ -178,6 +209,7 @@ class ModelConfigWrapper:
             'supports_temperature': self.capabilities['supports_temperature'],
             'supports_max_tokens': self.capabilities['supports_max_tokens'],
             'supports_service_tier': self.capabilities['supports_service_tier'],
+            'supports_structured_output': self.capabilities.get('supports_structured_output', False),
             'uses_max_completion_tokens': self.capabilities['max_completion_tokens_param']
         }
     
@@ -4,23 +4,71 @@ Author: Manuel Schott
 
 Centralized prompt templates for AI agents to ensure consistency
 and maintainability across Analysis, Report, and Combined agents.
+Also contains the JSON schemas used for structured output (strict mode).
 """
 
 from typing import Dict
 from config import Config
 
 
-class AnalysisPromptTemplate:
-    """Template for analysis-related prompts"""
+# JSON-Schema der Analyse-Kennzahlen (gemeinsam für Analysis, Report und Combined)
+ANALYSIS_VALUES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "summary": {"type": "string"},
+        "probability_percentage": {"type": "number"},
+        "average_damage_per_event": {"type": "number"},
+        "expected_damage": {"type": "number"},
+        "expected_damage_standard_deviation": {"type": "number"},
+        "max_damage_pml": {"type": "number"},
+        "acceptance_risk_percentage": {"type": "number"}
+    },
+    "required": [
+        "title",
+        "summary",
+        "probability_percentage",
+        "average_damage_per_event",
+        "expected_damage",
+        "expected_damage_standard_deviation",
+        "max_damage_pml",
+        "acceptance_risk_percentage"
+    ],
+    "additionalProperties": False
+}
+
+
+def build_response_format(name: str, schema: Dict) -> Dict:
+    """
+    Build the OpenAI response_format parameter for strict structured output
     
-    @staticmethod
-    def get_system_prompt() -> str:
-        """Get the system prompt for analysis tasks"""
-        max_tokens = Config.AGENT_MAX_TOKENS.get('analysis', 4000)
+    Args:
+        name (str): Schema name (a-z, 0-9, underscores)
+        schema (Dict): JSON schema of the expected response
         
-        return f"""Sie sind ein Experte für Risikoanalyse und Versicherungsmathematik. Basierend auf der Risikobeschreibung und den Recherchedaten berechnen Sie:
+    Returns:
+        Dict: response_format parameter for chat.completions.create
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": schema
+        }
+    }
 
-1. Eintrittswahrscheinlichkeit (in Prozent) - Wahrscheinlichkeit für mindestens einen Schaden (im angegebenen Versicherungszeitraum) basierend auf Risikotyp, Nutzungsmuster und historischen Daten
+
+# ---------------------------------------------------------------------------
+# Statische Prompt-Bausteine
+#
+# Die System-Prompts werden einmalig beim Import zusammengesetzt und enthalten
+# keine variablen Werte. Dadurch ist der Prompt-Anfang bei jedem Aufruf
+# byte-identisch und kann vom Provider gecacht werden (Prefix Caching).
+# Variable Werte (Risikodaten, Token-Limit) stehen immer am Ende der User-Message.
+# ---------------------------------------------------------------------------
+
+_CALCULATION_BLOCK = """1. Eintrittswahrscheinlichkeit (in Prozent) - Wahrscheinlichkeit für mindestens einen Schaden (im angegebenen Versicherungszeitraum) basierend auf Risikotyp, Nutzungsmuster und historischen Daten
 2. Durchschnittliche Schadenhöhe (in EUR) - Erwarteter durchschnittlicher Schaden pro Ereignis unter Berücksichtigung der Versicherungssumme
 3. Standardabweichung der Schadenhöhe (in EUR) - Streuung/Volatilität der möglichen Schäden bezogen auf die durchschnittliche Schadenhöhe
 4. Erwarteter Schaden (in EUR) - Erwarteter Schaden (Eintrittswahrscheinlichkeit × Durchschnittliche Schadenhöhe)
@@ -41,10 +89,9 @@ WICHTIG:
 - Berechnen Sie die Wahrscheinlichkeit für den angegebenen Versicherungszeitraum, nicht pro Jahr
 - Der erwartete Schaden bezieht sich auf den gesamten Versicherungszeitraum
 - Berechnen Sie ALLE Werte basierend auf der tatsächlichen Risikobeschreibung - verwenden Sie KEINE Beispieldaten.
-- Verwenden Sie die bereitgestellten Risikodaten (Classification, Inquiry, etc.) für Ihre Berechnungen.
-- Halten Sie Ihre Antwort präzise - verwenden Sie weniger als {max_tokens} Tokens.
+- Verwenden Sie die bereitgestellten Risikodaten (Classification, Inquiry, etc.) für Ihre Berechnungen."""
 
-WICHTIG zum Feld "acceptance_risk_percentage":
+_ACCEPTANCE_RISK_BLOCK = """WICHTIG zum Feld "acceptance_risk_percentage":
 - Dies ist eine Gesamtbewertung, wie riskant die Übernahme dieses Risikos für den Versicherer wäre
 - Skala von 0-100%, wobei:
   * 0-20%: Sehr geringes Übernahmerisiko (gut kalkulierbar, geringe Volatilität, leicht verdientes Geld)
@@ -52,10 +99,10 @@ WICHTIG zum Feld "acceptance_risk_percentage":
   * 40-60%: Mittleres Übernahmerisiko (erhöhte Aufmerksamkeit erforderlich)
   * 60-80%: Hohes Übernahmerisiko (schwierig kalkulierbar, hohe Unsicherheiten, wahrscheinlich Schaden)
   * 80-100%: Sehr hohes Übernahmerisiko (kaum versicherbar, extreme Unsicherheiten, fast sicher Verlust)
-- Berücksichtigen Sie: Schadenhöhe, Volatilität, Vorhersagbarkeit, Datenlage, externe Faktoren
+- Berücksichtigen Sie: Schadenhöhe, Volatilität, Vorhersagbarkeit, Datenlage, externe Faktoren"""
 
-Antworten Sie mit einem JSON-Objekt:
-{{
+_ANALYSIS_JSON_BLOCK = """Antworten Sie mit einem JSON-Objekt:
+{
     "title": string,
     "summary": string,
     "probability_percentage": number,
@@ -64,125 +111,147 @@ Antworten Sie mit einem JSON-Objekt:
     "expected_damage_standard_deviation": number,
     "max_damage_pml": number,
     "acceptance_risk_percentage": number
-}}
+}"""
+
+_REPORT_JSON_BLOCK = """Antworten Sie AUSSCHLIESSLICH mit einem JSON-Objekt in folgender Struktur:
+{
+    "Analyse-Zusammenfassung": {
+        "title": string,
+        "summary": string,
+        "probability_percentage": number,
+        "average_damage_per_event": number,
+        "expected_damage": number,
+        "expected_damage_standard_deviation": number,
+        "max_damage_pml": number,
+        "acceptance_risk_percentage": number
+    }
+}"""
 
-## Validierung
+_VALIDATION_BLOCK = """## Validierung
 - Alle Prozentwerte (Wahrscheinlichkeit, acceptance_risk_percentage) müssen zwischen 0 und 100 sein
 - Alle Geldwerte (in EUR) müssen nicht-negativ sein
 - Alle Felder müssen ausgefüllt sein
 - WICHTIG: Die Wahrscheinlichkeit und der erwartete Schaden beziehen sich auf den gesamten Versicherungszeitraum"""
 
 
-class CombinedPromptTemplate:
-    """Template for combined analysis and report generation"""
+def get_length_instruction(config_key: str, default: int = 4000) -> str:
+    """
+    Get the token limit instruction for an agent
     
-    @staticmethod
-    def get_system_prompt() -> str:
-        """
-        Get the combined system prompt by merging analysis and report templates
-        """
-        max_tokens = Config.AGENT_MAX_TOKENS.get('report', 4000)
+    Wird an das Ende der User-Message gehängt, damit der System-Prompt
+    unabhängig von der Konfiguration byte-identisch bleibt.
+    
+    Args:
+        config_key (str): Agent config key (e.g. 'analysis', 'report')
+        default (int): Fallback if no limit is configured
         
-        return f"""Sie sind ein Experte für Risikoanalyse und Versicherungsmathematik. Basierend auf der Risikobeschreibung führen Sie eine KOMBINIERTE ANALYSE und BERICHTERSTELLUNG durch.
+    Returns:
+        str: Instruction line with the configured token limit
+    """
+    max_tokens = Config.AGENT_MAX_TOKENS.get(config_key, default)
+    return f"Halten Sie Ihre Antwort präzise - verwenden Sie weniger als {max_tokens} Tokens."
 
-## Analyse-Teil
-Berechnen Sie für das gegebene Risiko:
-1. Eintrittswahrscheinlichkeit (in Prozent) - Wahrscheinlichkeit für mindestens einen Schaden (im angegebenen Versicherungszeitraum) basierend auf Risikotyp, Nutzungsmuster und historischen Daten
-2. Durchschnittliche Schadenhöhe (in EUR) - Erwarteter durchschnittlicher Schaden pro Ereignis unter Berücksichtigung der Versicherungssumme
-3. Standardabweichung der Schadenhöhe (in EUR) - Streuung/Volatilität der möglichen Schäden bezogen auf die durchschnittliche Schadenhöhe
-4. Erwarteter Schaden (in EUR) - Erwarteter Schaden (Eintrittswahrscheinlichkeit × Durchschnittliche Schadenhöhe)
-5. Aussagekräftiger Titel zur Risikobeschreibung (in max. 10 Wörtern) - Aussagekräftiger Titel des Risikos, z.B. "Espressomaschine - Leihgabe an Freund für 2 Wochen", basierend auf RISIKO-GRUNDINFORMATIONEN und RÜCKFRAGEN UND ANTWORTEN
-6. Kurzfassung der Risikobeschreibung (in max. 40 Wörtern) - Kurze Zusammenfassung der Risikobeschreibung basierend auf RISIKO-GRUNDINFORMATIONEN und RÜCKFRAGEN UND ANTWORTEN, OHNE den Titel zu wiederholen und OHNE die berechneten Schadenskennzahlen
 
-Berücksichtigen Sie Faktoren wie:
-- Historische Häufigkeit, Zeitraum und Schadensstatistiken für diesen Risikotyp
-- Aktuelle Marktbedingungen
-- Regulatorische Umgebung und Vorgaben
-- Risikoseverität und Versicherungswert
-- Branchenstandards für ähnliche Risiken
-- Datenunsicherheit und Volatilität
-- Dauer des Versicherungszeitraums
-
-WICHTIG:
-- Die Risikobeschreibung enthält den Versicherungszeitraum von/bis im Format YYYY-MM-DD
-- Berechnen Sie die Wahrscheinlichkeit für den angegebenen Versicherungszeitraum, nicht pro Jahr
-- Der erwartete Schaden bezieht sich auf den gesamten Versicherungszeitraum
-- Berechnen Sie ALLE Werte basierend auf der tatsächlichen Risikobeschreibung - verwenden Sie KEINE Beispieldaten.
-- Verwenden Sie die bereitgestellten Risikodaten (Classification, Inquiry, etc.) für Ihre Berechnungen.
-- Halten Sie Ihre Antwort präzise - verwenden Sie weniger als {max_tokens} Tokens.
-
-WICHTIG zum Feld "acceptance_risk_percentage":
-- Dies ist eine Gesamtbewertung, wie riskant die Übernahme dieses Risikos für den Versicherer wäre
-- Skala von 0-100%, wobei:
-  * 0-20%: Sehr geringes Übernahmerisiko (gut kalkulierbar, geringe Volatilität, leicht verdientes Geld)
-  * 20-40%: Geringes Übernahmerisiko (normal versicherbar, attraktives Geschäft)
-  * 40-60%: Mittleres Übernahmerisiko (erhöhte Aufmerksamkeit erforderlich)
-  * 60-80%: Hohes Übernahmerisiko (schwierig kalkulierbar, hohe Unsicherheiten, wahrscheinlich Schaden)
-  * 80-100%: Sehr hohes Übernahmerisiko (kaum versicherbar, extreme Unsicherheiten, fast sicher Verlust)
-- Berücksichtigen Sie: Schadenhöhe, Volatilität, Vorhersagbarkeit, Datenlage, externe Faktoren
+class AnalysisPromptTemplate:
+    """Template for analysis-related prompts"""
+    
+    RESPONSE_SCHEMA = ANALYSIS_VALUES_SCHEMA
+    
+    SYSTEM_PROMPT = "\n\n".join([
+        "Sie sind ein Experte für Risikoanalyse und Versicherungsmathematik. Basierend auf der Risikobeschreibung und den Recherchedaten berechnen Sie:",
+        _CALCULATION_BLOCK,
+        _ACCEPTANCE_RISK_BLOCK,
+        _ANALYSIS_JSON_BLOCK,
+        _VALIDATION_BLOCK
+    ])
+    
+    @classmethod
+    def get_response_format(cls) -> Dict:
+        """Get the structured output format for analysis tasks"""
+        return build_response_format("risk_analysis", cls.RESPONSE_SCHEMA)
+    
+    @classmethod
+    def get_system_prompt(cls) -> str:
+        """Get the system prompt for analysis tasks (static, cache-friendly)"""
+        return cls.SYSTEM_PROMPT
 
-Antworten Sie mit einem JSON-Objekt:
-{{
-    "title": string,
-    "summary": string,
-    "probability_percentage": number,
-    "average_damage_per_event": number,
-    "expected_damage": number,
-    "expected_damage_standard_deviation": number,
-    "max_damage_pml": number,
-    "acceptance_risk_percentage": number
-}}
 
-## Validierung
-- Alle Prozentwerte (Wahrscheinlichkeit, acceptance_risk_percentage) müssen zwischen 0 und 100 sein
-- Alle Geldwerte (in EUR) müssen nicht-negativ sein
-- Alle Felder müssen ausgefüllt sein
-- WICHTIG: Die Wahrscheinlichkeit und der erwartete Schaden beziehen sich auf den gesamten Versicherungszeitraum"""
+class CombinedPromptTemplate:
+    """Template for combined analysis and report generation"""
+    
+    RESPONSE_SCHEMA = ANALYSIS_VALUES_SCHEMA
+    
+    SYSTEM_PROMPT = "\n\n".join([
+        "Sie sind ein Experte für Risikoanalyse und Versicherungsmathematik. Basierend auf der Risikobeschreibung führen Sie eine KOMBINIERTE ANALYSE und BERICHTERSTELLUNG durch.",
+        "## Analyse-Teil\nBerechnen Sie für das gegebene Risiko:\n" + _CALCULATION_BLOCK,
+        _ACCEPTANCE_RISK_BLOCK,
+        _ANALYSIS_JSON_BLOCK,
+        _VALIDATION_BLOCK
+    ])
+    
+    @classmethod
+    def get_response_format(cls) -> Dict:
+        """Get the structured output format for combined analysis and report"""
+        return build_response_format("combined_analysis_report", cls.RESPONSE_SCHEMA)
+    
+    @classmethod
+    def get_system_prompt(cls) -> str:
+        """
+        Get the combined system prompt (analysis and report blocks, static, cache-friendly)
+        """
+        return cls.SYSTEM_PROMPT
 
 
 class ReportPromptTemplate:
     """Template for report-related prompts"""
     
-    @staticmethod
-    def get_system_prompt() -> str:
-        """Get the system prompt for report generation tasks"""
-        max_tokens = Config.AGENT_MAX_TOKENS.get('report', 4000)
-        
-        return f"""Sie sind ein Experte für Versicherungsberichterstellung. Erstellen Sie einen umfassenden Risikobewertungsbericht basierend auf den VORHANDENEN ANALYSE-DATEN.
-
-WICHTIG: 
-- Halten Sie Ihre Antwort präzise - verwenden Sie weniger als {max_tokens} Tokens.
+    RESPONSE_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "Analyse-Zusammenfassung": ANALYSIS_VALUES_SCHEMA
+        },
+        "required": ["Analyse-Zusammenfassung"],
+        "additionalProperties": False
+    }
+    
+    SYSTEM_PROMPT = "\n\n".join([
+        "Sie sind ein Experte für Versicherungsberichterstellung. Erstellen Sie einen umfassenden Risikobewertungsbericht basierend auf den VORHANDENEN ANALYSE-DATEN.",
+        """WICHTIG: 
 - Der Report basiert IMMER auf bereits durchgeführten Analyse-Daten.
 - Übernehmen Sie die Werte aus den Analyse-Daten DIREKT - berechnen Sie NICHTS neu.
-- Verwenden Sie KEINE Beispieldaten.
-
-WICHTIG zum Feld "acceptance_risk_percentage":
-- Dies ist eine Gesamtbewertung, wie riskant die Übernahme dieses Risikos für den Versicherer wäre
-- Skala von 0-100%, wobei:
-  * 0-20%: Sehr geringes Übernahmerisiko (gut kalkulierbar, geringe Volatilität, leicht verdientes Geld)
-  * 20-40%: Geringes Übernahmerisiko (normal versicherbar, attraktives Geschäft)
-  * 40-60%: Mittleres Übernahmerisiko (erhöhte Aufmerksamkeit erforderlich)
-  * 60-80%: Hohes Übernahmerisiko (schwierig kalkulierbar, hohe Unsicherheiten, wahrscheinlich Schaden)
-  * 80-100%: Sehr hohes Übernahmerisiko (kaum versicherbar, extreme Unsicherheiten, fast sicher Verlust)
-- Berücksichtigen Sie: Schadenhöhe, Volatilität, Vorhersagbarkeit, Datenlage, externe Faktoren
-
-Antworten Sie AUSSCHLIESSLICH mit einem JSON-Objekt in folgender Struktur:
-{{{{
-    "Analyse-Zusammenfassung": {{{{
-        "title": string,
-        "summary": string,
-        "probability_percentage": number,
-        "average_damage_per_event": number,
-        "expected_damage": number,
-        "expected_damage_standard_deviation": number,
-        "max_damage_pml": number,
-        "acceptance_risk_percentage": number
-    }}}}
-}}}}
+- Verwenden Sie KEINE Beispieldaten.""",
+        _ACCEPTANCE_RISK_BLOCK,
+        _REPORT_JSON_BLOCK,
+        _VALIDATION_BLOCK
+    ])
+    
+    @classmethod
+    def get_response_format(cls) -> Dict:
+        """Get the structured output format for report generation"""
+        return build_response_format("risk_report", cls.RESPONSE_SCHEMA)
+    
+    @classmethod
+    def get_system_prompt(cls) -> str:
+        """Get the system prompt for report generation tasks (static, cache-friendly)"""
+        return cls.SYSTEM_PROMPT
 
-## Validierung
-- Alle Prozentwerte (Wahrscheinlichkeit, acceptance_risk_percentage) müssen zwischen 0 und 100 sein
-- Alle Geldwerte (in EUR) müssen nicht-negativ sein
-- Alle Felder müssen ausgefüllt sein
-- WICHTIG: Die Wahrscheinlichkeit und der erwartete Schaden beziehen sich auf den gesamten Versicherungszeitraum"""
 
+class InquiryPromptTemplate:
+    """Template for inquiry-related prompts"""
+    
+    RESPONSE_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "questions": {
+                "type": "array",
+                "items": {"type": "string"}
+            }
+        },
+        "required": ["questions"],
+        "additionalProperties": False
+    }
+    
+    @classmethod
+    def get_response_format(cls) -> Dict:
+        """Get the structured output format for inquiry generation"""
+        return build_response_format("risk_inquiries", cls.RESPONSE_SCHEMA)
@@ -7,9 +7,9 @@ Generates comprehensive risk assessment reports
 """
 
 import json
-from typing import Dict
+from typing import Callable, Dict, Optional
 from agents.base_agent import AIAgent
-from agents.prompt_templates import ReportPromptTemplate
+from agents.prompt_templates import ReportPromptTemplate, get_length_instruction
 from config import Config
 
 
@@ -27,12 +27,13 @@ class ReportAgent(AIAgent):
             'uncertainties'
         ]
     
-    def generate_report(self, risk_data: Dict) -> Dict:
+    def generate_report(self, risk_data: Dict, on_partial: Optional[Callable[[Dict], None]] = None) -> Dict:
         """
         Generate a comprehensive risk assessment report
         
         Args:
             risk_data (Dict): Complete risk assessment data
+            on_partial (Callable): Optional callback for streamed partial fields
             
         Returns:
             Dict: Structured report
@@ -46,23 +47,27 @@ class ReportAgent(AIAgent):
             },
             {
                 "role": "user",
-                "content": f"""Erstellen Sie einen Bericht für diese Risikobewertung. VERWENDEN SIE DIE WERTE AUS DEN ANALYSE-DATEN:
-
-{formatted_risk_data}
+                # Statische Anweisungen zuerst, Risikodaten zuletzt (Prefix Caching)
+                "content": f"""Erstellen Sie einen Bericht für diese Risikobewertung. VERWENDEN SIE DIE WERTE AUS DEN ANALYSE-DATEN.
 
 WICHTIG:
 - Die bereits berechneten Analyse-Werte müssen Sie DIREKT übernehmen (siehe Abschnitt "BEREITS BERECHNETE ANALYSE-WERTE")
 - Die Wahrscheinlichkeit bezieht sich auf den GESAMTEN Versicherungszeitraum, nicht pro Jahr
 - Nutzen Sie die Recherche-Ergebnisse zur Kontextualisierung der Risikobewertung
-- Geben Sie NUR echte Werte zurück, keine Beispieldaten"""
+- Geben Sie NUR echte Werte zurück, keine Beispieldaten
+- {get_length_instruction('report')}
+
+{formatted_risk_data}"""
             }
         ]
         
-        response = self._make_request(messages)
+        response = self._make_request(
+            messages,
+            on_partial=on_partial,
+            response_format=ReportPromptTemplate.get_response_format()
+        )
         try:
-            # Nutze die zentrale Methode zum Bereinigen der Response
-            cleaned_response = self._clean_json_response(response)
-            report = json.loads(cleaned_response)
+            report = self._parse_json_response(response)
             return self._validate_report(report, risk_data)
         except json.JSONDecodeError as e:
             import logging
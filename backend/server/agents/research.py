@@ -10,8 +10,10 @@ from datetime import datetime, timezone
 from typing import Dict
 import logging
 import concurrent.futures
+import contextvars
 import time
 from agents.base_agent import AIAgent
+from llm_batch import LLMBatchPending
 from agents.research_current import ResearchCurrent
 from agents.research_historical import ResearchHistorical
 from agents.research_regulatory import ResearchRegulatory
@@ -89,9 +91,12 @@ class ResearchAgent(AIAgent):
             "regulatory": lambda: self._safe_research("regulatory", self.regulatory_agent.research_regulatory, risk_description, risk_type)
         }
         
+        batch_pending = None
+        
         with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            # Kontext (z.B. Batch-Scope) an die Threads weitergeben
             future_to_type = {
-                executor.submit(func): research_type 
+                executor.submit(contextvars.copy_context().run, func): research_type 
                 for research_type, func in research_functions.items()
             }
             
@@ -100,10 +105,17 @@ class ResearchAgent(AIAgent):
                 try:
                     results[research_type] = future.result()
                     logger.info(f"Research {research_type} completed successfully")
+                except LLMBatchPending as pending:
+                    # Alle drei Requests einreichen lassen, danach pausieren
+                    batch_pending = pending
+                    logger.info(f"Research {research_type} handed to Batch API")
                 except Exception as e:
                     logger.error(f"Research {research_type} failed: {str(e)}")
                     raise Exception(f"Research {research_type} fehlgeschlagen: {str(e)}")
         
+        if batch_pending is not None:
+            raise batch_pending
+        
         return {
             **results,
             "overall_confidence": "medium",
@@ -126,7 +138,7 @@ class ResearchAgent(AIAgent):
         Raises:
             Exception: Bei Fehlern (kein Fallback, Workflow wird pausiert)
         """
-        with perf_timer(f"Research Agent - {research_name.capitalize()}"):
+        with perf_timer("Research Agent", agent=f"research_{research_name}"):
             return research_func(risk_description, risk_type)
     
     def get_research_methodology(self) -> Dict:
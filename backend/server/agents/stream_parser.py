@@ -0,0 +1,128 @@
+"""
+xrisk - Incremental JSON Field Parser
+Author: Manuel Schott
+
+Incremental parser for streamed OpenAI completions.
+Extracts selected string fields (e.g. title, summary) from a partially
+received JSON document as soon as their value is complete, so that the
+workflow can publish them before the full response has arrived.
+"""
+
+import json
+import re
+from typing import Dict, Iterable
+
+
+class IncrementalJSONFieldParser:
+    """
+    Scans a growing JSON text for completed string values of watched keys.
+
+    The parser does not build a full document - it only looks for
+    `"<key>": "<value>"` pairs (at any nesting level) and emits each watched
+    key once, when the closing quote of its value has been received.
+    The final response is still parsed by the regular agent code path.
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        """
+        Args:
+            fields (Iterable[str]): JSON keys whose string values should be emitted
+        """
+        self.buffer = ''
+        self.emitted: Dict[str, str] = {}
+        self._patterns = {
+            field: re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+            for field in fields
+        }
+        # Position from which a pending field key has to be searched again
+        self._search_from = {field: 0 for field in self._patterns}
+        # Watched keys whose value string is still open: [value start, scan position, escaped]
+        self._open_values = {}
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        """
+        Append a chunk of streamed content and return newly completed fields
+
+        Args:
+            chunk (str): Next content delta from the stream
+
+        Returns:
+            Dict[str, str]: Fields completed by this chunk (empty if none)
+        """
+        if not chunk:
+            return {}
+
+        self.buffer += chunk
+        completed = {}
+
+        for field, pattern in self._patterns.items():
+            if field in self.emitted:
+                continue
+
+            if field not in self._open_values:
+                match = pattern.search(self.buffer, self._search_from[field])
+                if not match:
+                    # Key may be split across chunks - re-scan from where a partial match could start
+                    self._search_from[field] = self._key_resume_offset(self._search_from[field])
+                    continue
+                self._open_values[field] = [match.end(), match.end(), False]
+
+            value_start, scan_from, escaped = self._open_values[field]
+            value_end, scan_from, escaped = self._scan_string(scan_from, escaped)
+            if value_end is None:
+                # Nächster Chunk setzt die Suche nach dem schließenden Quote hier fort
+                self._open_values[field] = [value_start, scan_from, escaped]
+                continue
+            del self._open_values[field]
+
+            try:
+                value = json.loads(self.buffer[value_start - 1:value_end + 1])
+            except json.JSONDecodeError:
+                self._search_from[field] = value_end + 1
+                continue
+
+            self.emitted[field] = value
+            completed[field] = value
+
+        return completed
+
+    def _key_resume_offset(self, previous: int) -> int:
+        """
+        Offset from which an unmatched key has to be searched after the next chunk
+
+        An incomplete `"<key>"<ws>:<ws>` match contains at most two quotes (those of
+        the key) - it starts at one of the last two quotes of the buffer, however much
+        whitespace follows.
+
+        Args:
+            previous (int): Previous search offset
+
+        Returns:
+            int: New search offset
+        """
+        last = self.buffer.rfind('"', previous)
+        if last == -1:
+            return len(self.buffer)
+        second_last = self.buffer.rfind('"', previous, last)
+        return second_last if second_last != -1 else last
+
+    def _scan_string(self, start: int, escaped: bool):
+        """
+        Continue scanning an open JSON string for its closing quote
+
+        Args:
+            start (int): Index to continue from
+            escaped (bool): Whether the previous character was an unconsumed backslash
+
+        Returns:
+            tuple: (index of the closing quote or None, next scan index, escaped)
+        """
+        for index in range(start, len(self.buffer)):
+            char = self.buffer[index]
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                return index, index + 1, False
+        return None, len(self.buffer), escaped
@@ -7,10 +7,44 @@ Validates if a given text describes a valid, insurable risk
 """
 
 import json
-from typing import Dict
+import re
+from typing import Dict, Optional
 from agents.base_agent import AIAgent
 from config import Config
 
+# Wörter mit mindestens zwei Buchstaben (inkl. Umlaute)
+_WORD_PATTERN = re.compile(r'[^\W\d_]{2,}')
+
+
+def prefilter_risk_description(initial_prompt: str, insurance_value: float) -> Optional[Dict]:
+    """
+    Cheap local pre-check of a risk description (no LLM call)
+
+    Only rejects inputs that the ValidationAgent would reject anyway (empty,
+    too short, no word at all, non-positive insurance value). Everything else,
+    including vague terms like "Kamera", is decided by the ValidationAgent as
+    first stage of the async workflow.
+
+    Args:
+        initial_prompt (str): Risk description entered by the user
+        insurance_value (float): Insurance value in EUR
+
+    Returns:
+        Dict | None: Validation result ('valid': False, 'reason') or None if the LLM has to decide
+    """
+    text = (initial_prompt or '').strip()
+    if len(text) < Config.VALIDATION_MIN_PROMPT_CHARS or not _WORD_PATTERN.search(text):
+        return {
+            'valid': False,
+            'reason': "Die Beschreibung ist zu kurz oder unverständlich. Bitte beschreiben Sie das zu versichernde Risiko in einigen Worten."
+        }
+    if insurance_value is None or insurance_value <= 0:
+        return {
+            'valid': False,
+            'reason': "Bitte geben Sie einen Versicherungswert größer als 0 EUR an."
+        }
+    return None
+
 
 class ValidationAgent(AIAgent):
     """Agent verantwortlich für die Validierung von Risikobeschreibungen"""
@@ -23,7 +23,7 @@ load_dotenv()
 if os.path.exists('.env.local'):
     load_dotenv('.env.local')
 
-from logging_config import setup_logger
+from logging_config import setup_logger, set_handler_level
 
 log_dir = os.environ.get('LOG_DIR')
 
@@ -66,6 +66,9 @@ else:
         console_handler.setLevel(logging.INFO)
     app_logger.info("=== xrisk Application Starting ===")
 
+# OpenAI_API Logger: Payloads (gekürzt) nur auf DEBUG - eigenes Level unabhängig von DEBUG_ENABLED
+set_handler_level(logging.getLogger('OpenAI_API'), getattr(logging, Config.LLM_LOG_LEVEL, logging.INFO))
+
 app_logger.info(f"Log Directory: {log_dir if log_dir else 'None (console only)'}")
 app_logger.info(f"Log Level: {'DEBUG' if debug_enabled else 'INFO'}")
 if log_dir:
@@ -107,15 +110,28 @@ app_logger.info(f"Configuring CORS with origins: {Config.CORS_ORIGINS}")
 CORS(app, 
      origins=Config.CORS_ORIGINS, 
      supports_credentials=True,
-     allow_headers=['Content-Type', 'Authorization', 'X-Requested-With'],
+     allow_headers=['Content-Type', 'Authorization', 'X-Requested-With', 'If-None-Match'],
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'],
-     expose_headers=['Content-Type', 'Authorization'],
+     expose_headers=['Content-Type', 'Authorization', 'ETag'],
      always_send=True)  # Always send CORS headers, even for non-CORS requests
 app_logger.info("CORS configured successfully")
 
 app_logger.info("Database initializing...")
 db.init_app(app)
 
+from db_routing import init_db_routing
+init_db_routing(app)
+
+from sql_instrumentation import install_sql_instrumentation
+install_sql_instrumentation(app)
+
+from tracing import install_flask_tracing, install_db_tracing
+install_flask_tracing(app)
+install_db_tracing()
+
+from workflow_status import install_risk_status_tracking
+install_risk_status_tracking()
+
 # Test database connection with detailed error logging
 try:
     with app.app_context():
@@ -580,11 +596,9 @@ def create_app():
             # Re-raise the exception so we can see the full error
             raise
         
-        db.create_all()
-        app_logger.info("Database tables created/verified")
-        
+        # Tabellen und Migrationen versioniert (migrations.py) - bei aktuellem Schema nur eine Abfrage
         from database_setup import migrate_database
-        app_logger.info("Running database migrations...")
+        app_logger.info("Checking database schema version...")
         migrate_database()
     
     app_logger.info("=== xrisk Application Ready ===")
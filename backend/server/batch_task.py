@@ -0,0 +1,75 @@
+"""
+xrisk - LLM Batch Poll Task
+Author: Manuel Schott
+
+Celery Beat task that submits queued OpenAI Batch API requests, polls
+running batch jobs and resumes the workflows paused on their results
+"""
+
+from celery_app import celery_app
+from workflow_dispatch import dispatch_workflow
+import logging
+
+logger = logging.getLogger('celery')
+
+
+@celery_app.task(name='workflow.poll_llm_batches')
+def poll_llm_batches():
+    """
+    Periodic task for the Batch API backend
+    Runs periodically based on LLM_BATCH_POLL_INTERVAL (default: 60 seconds)
+
+    - Submits queued requests as batch jobs
+    - Stores results of finished batch jobs
+    - Resumes workflows whose requests are all finished (in batch mode)
+    - Deletes old finished requests
+    """
+    from config import Config
+
+    if not Config.LLM_BATCH_ENABLED:
+        return {'status': 'disabled'}
+
+    from models import RiskAssessment
+    from app import app
+    from llm_batch import (
+        get_batch_client, submit_queued_requests, collect_finished_batches,
+        purge_old_requests, batch_session
+    )
+    from workflow_task import execute_risk_workflow, resume_from_current_status
+
+    try:
+        with app.app_context():
+            client = get_batch_client()
+            with batch_session() as session:
+                submitted = submit_queued_requests(session, client)
+                ready_risks = collect_finished_batches(session, client)
+                purged = purge_old_requests(session)
+
+            resumed = 0
+            for risk_uuid in ready_risks:
+                risk = RiskAssessment.query.filter_by(risk_uuid=risk_uuid).first()
+                if not risk:
+                    logger.warning(f"[Batch Poll] Risk {risk_uuid} not found - skipping resume")
+                    continue
+
+                # Validierung und Klassifizierung starten im Haupt-Workflow, alle weiteren Status über Resume
+                if risk.status in ('created', 'validated'):
+                    task = dispatch_workflow(
+                        execute_risk_workflow, risk, f"workflow_{risk.risk_uuid}",
+                        kwargs={'execution_mode': 'batch'}, background=True
+                    )
+                else:
+                    task = dispatch_workflow(
+                        resume_from_current_status, risk, f"workflow_resume_{risk.risk_uuid}",
+                        kwargs={'execution_mode': 'batch'}, background=True
+                    )
+                resumed += 1
+                logger.info(f"[Batch Poll] Resuming workflow {risk_uuid} from {risk.status}: {task.id}")
+
+            logger.info(f"[Batch Poll] Submitted {submitted} requests, resumed {resumed} workflows, purged {purged} old requests")
+            return {'submitted': submitted, 'resumed': resumed, 'purged': purged}
+
+    except Exception as e:
+        logger.error(f"[Batch Poll] Error during batch poll: {str(e)}")
+        import traceback
+        logger.error(f"[Batch Poll] Traceback: {traceback.format_exc()}")
@@ -19,7 +19,7 @@ if os.path.exists('.env.local'):
     load_dotenv('.env.local')
 
 from config import Config
-from logging_config import create_rotating_file_handler
+from logging_config import create_rotating_file_handler, attach_handler
 
 logger = logging.getLogger('celery')
 
@@ -43,7 +43,7 @@ def setup_celery_logging():
             # Celery Logger (für alle Celery-Komponenten)
             celery_log_file = os.path.join(log_dir, 'celery.log')
             celery_file_handler = create_rotating_file_handler(celery_log_file)
-            logger.addHandler(celery_file_handler)
+            attach_handler(logger, celery_file_handler)
             logger.info(f"Celery logging configured with daily rotation: {celery_log_file}")
             
         except Exception as e:
@@ -66,7 +66,7 @@ def setup_application_logging_mirror():
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(logging.INFO)
         console_handler.setFormatter(formatter)
-        app_logger.addHandler(console_handler)
+        attach_handler(app_logger, console_handler)
 
         # Optional file handler
         log_dir = os.environ.get('LOG_DIR')
@@ -75,7 +75,7 @@ def setup_application_logging_mirror():
                 os.makedirs(log_dir, exist_ok=True)
                 app_log_file = os.path.join(log_dir, 'app.log')
                 file_handler = create_rotating_file_handler(app_log_file, formatter=formatter)
-                app_logger.addHandler(file_handler)
+                attach_handler(app_logger, file_handler)
                 app_logger.info(f"Celery worker mirrors application logs with daily rotation to: {app_log_file}")
             except Exception as e:
                 logger.error(f"Failed to setup application log mirror: {e}")
@@ -129,7 +129,7 @@ def make_celery():
         'xrisk',
         broker=broker_url,
         backend=backend_url,
-        include=['workflow_task', 'retry_task']  # Import workflow and retry tasks
+        include=['workflow_task', 'retry_task', 'batch_task', 'ledger_task']  # Import workflow, retry, batch and ledger tasks
     )
     
     # Celery configuration
@@ -142,16 +142,21 @@ def make_celery():
         result_serializer='json',
         timezone='UTC',
         enable_utc=True,
-        worker_prefetch_multiplier=1,  # Process one task at a time
+        worker_prefetch_multiplier=1,  # Reserve one task per pool slot (process, greenlet or thread)
         worker_max_tasks_per_child=50,  # Restart worker after 50 tasks (prevent memory leaks)
         broker_use_ssl=broker_use_ssl if broker_use_ssl else None,
         redis_backend_use_ssl=backend_use_ssl if backend_use_ssl else None,
         broker_connection_retry_on_startup=True,
-        task_default_queue='celery',
+        task_default_queue=Config.CELERY_QUEUE_DEFAULT,
+        # Workflow-Tasks werden beim Dispatch explizit geroutet (workflow_dispatch.workflow_queue);
+        # die Routen hier gelten nur für Aufrufe ohne queue=
         task_routes={
-            'workflow.execute_risk_workflow': {'queue': 'celery'},
-            'workflow.resume_after_inquiry': {'queue': 'celery'},
-            'workflow.retry_failed_workflows': {'queue': 'celery'},
+            'workflow.execute_risk_workflow': {'queue': Config.CELERY_QUEUE_HIGH},
+            'workflow.resume_after_inquiry': {'queue': Config.CELERY_QUEUE_HIGH},
+            'workflow.resume_from_current_status': {'queue': Config.CELERY_QUEUE_HIGH},
+            'workflow.retry_failed_workflows': {'queue': Config.CELERY_QUEUE_DEFAULT},
+            'workflow.poll_llm_batches': {'queue': Config.CELERY_QUEUE_DEFAULT},
+            'workflow.purge_llm_ledger': {'queue': Config.CELERY_QUEUE_DEFAULT},
         },
         # Celery Beat Schedule (periodic tasks)
         beat_schedule={
@@ -159,6 +164,14 @@ def make_celery():
                 'task': 'workflow.retry_failed_workflows',
                 'schedule': float(Config.RETRY_CHECK_INTERVAL),  # Configurable interval from .env
             },
+            'poll-llm-batches': {
+                'task': 'workflow.poll_llm_batches',
+                'schedule': float(Config.LLM_BATCH_POLL_INTERVAL),  # No-op unless LLM_BATCH_ENABLED
+            },
+            'purge-llm-ledger': {
+                'task': 'workflow.purge_llm_ledger',
+                'schedule': 3600.0,  # No-op with LLM_LEDGER_RETENTION_DAYS=0
+            },
         },
     )
     
@@ -171,9 +184,53 @@ def make_celery():
 # Create celery app instance
 celery_app = make_celery()
 
+# Trace-Kontext über Celery-Message-Header weiterreichen (No-op ohne TRACING_ENABLED)
+from tracing import install_celery_tracing
+install_celery_tracing()
+
 # Configure Celery logging when the app is created
 @celery_app.on_after_configure.connect
 def setup_celery_logging_on_configure(sender, **kwargs):
     """Setup Celery logging when the app is configured"""
     setup_celery_logging()
 
+
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+
+@worker_init.connect
+def setup_worker_profile_on_init(**kwargs):
+    """Prepare the worker for its pool (gevent: cooperative psycopg2)"""
+    from worker_profile import setup_worker_profile
+    setup_worker_profile()
+
+
+@worker_process_init.connect
+def reset_db_pool_after_fork(**kwargs):
+    """Prefork child: never reuse DB connections inherited from the parent process"""
+    try:
+        from db_pool import dispose_engine_after_fork
+        dispose_engine_after_fork()
+    except Exception as e:
+        logger.error(f"Failed to reset DB pool after fork: {e}")
+
+
+@worker_process_shutdown.connect
+def flush_llm_ledger_on_shutdown(**kwargs):
+    """Write buffered LLM ledger records and metrics before a worker child exits (max_tasks_per_child)"""
+    try:
+        from llm_ledger import flush_llm_ledger
+        written = flush_llm_ledger()
+        if written:
+            logger.info(f"Flushed {written} LLM ledger records on worker shutdown")
+    except Exception as e:
+        logger.error(f"Failed to flush LLM ledger on worker shutdown: {e}")
+    try:
+        from metrics import flush_metrics
+        flush_metrics()
+    except Exception as e:
+        logger.error(f"Failed to flush metrics on worker shutdown: {e}")
+    try:
+        from tracing import flush_traces
+        flush_traces()
+    except Exception as e:
+        logger.error(f"Failed to flush traces on worker shutdown: {e}")
@@ -9,6 +9,8 @@ import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
+from db_pool import current_process_type, engine_options
+
 # Load secrets from Azure Key Vault or .env.local FIRST (before loading .env)
 # This ensures secrets are available when config.py reads environment variables
 try:
@@ -125,16 +127,37 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        'pool_pre_ping': True,
-        'pool_recycle': 300,
-        'pool_size': 5,
-        'max_overflow': 10,
-        'connect_args': {
-            'connect_timeout': 10,
-            'options': '-c statement_timeout=30000'
-        }
-    }
+    # Connection Pool pro Prozess nach Prozesstyp (web/celery/script, siehe db_pool.py) -
+    # gevent/threads Worker brauchen eine Verbindung pro gleichzeitigem Task
+    # (start_celery_worker.sh setzt DB_POOL_SIZE = Concurrency); leer = Profilwert
+    DB_PROCESS_TYPE = current_process_type()
+    DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+    DB_MAX_OVERFLOW = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '300'))  # Sekunden
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', '30000'))  # Millisekunden
+    # PgBouncer im Transaction-Mode; Migrationen laufen dann über DATABASE_DIRECT_URL
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false').lower() in ('true', '1', 'yes', 'on')
+    DATABASE_DIRECT_URL = os.environ.get('DATABASE_DIRECT_URL', '').strip() or None
+    
+    # Schema-Migrationen (migrations.py): max. Wartezeit auf Tabellensperren, danach Abbruch und Retry beim nächsten Start
+    MIGRATION_LOCK_TIMEOUT = int(os.environ.get('MIGRATION_LOCK_TIMEOUT', '5000'))  # Millisekunden
+    
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        DB_PROCESS_TYPE,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        statement_timeout=DB_STATEMENT_TIMEOUT,
+        pgbouncer=DB_PGBOUNCER
+    )
+    
+    # Read Replica für lesende Endpunkte (db_routing.py); nach eigenen Schreibzugriffen
+    # liest ein Client DB_REPLICA_PIN_SECONDS lang vom Primary
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL', '').strip() or None
+    DB_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', '10'))
+    SQLALCHEMY_BINDS = {
+        'replica': {'url': DATABASE_REPLICA_URL, **SQLALCHEMY_ENGINE_OPTIONS}
+    } if DATABASE_REPLICA_URL else {}
     
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     
@@ -205,6 +228,14 @@ class Config:
     CELERY_TASK_TIME_LIMIT = 1800  # 30 minutes max per task
     CELERY_RESULT_EXPIRES = 3600  # Results expire after 1 hour
     
+    # Celery Queues (see workflow_dispatch.py)
+    # Interactive first runs -> HIGH, Kleinrisiken -> FAST, retries/auto-continue/batch resumes -> LOW,
+    # Celery Beat maintenance tasks -> DEFAULT
+    CELERY_QUEUE_HIGH = os.environ.get('CELERY_QUEUE_HIGH', 'workflow_high')
+    CELERY_QUEUE_FAST = os.environ.get('CELERY_QUEUE_FAST', 'workflow_fast')
+    CELERY_QUEUE_LOW = os.environ.get('CELERY_QUEUE_LOW', 'workflow_low')
+    CELERY_QUEUE_DEFAULT = os.environ.get('CELERY_QUEUE_DEFAULT', 'celery')
+    
     OPENAI_MODEL = os.environ.get('OPENAI_MODEL') or 'gpt-5'
     OPENAI_SERVICE_TIER = os.environ.get('OPENAI_SERVICE_TIER') or 'flex'
     OPENAI_TEMPERATURE = float(os.environ.get('OPENAI_TEMPERATURE', '0.7'))
@@ -265,6 +296,23 @@ class Config:
         'combined_analysis_report': os.environ.get('COMBINED_ANALYSIS_REPORT_USE_FLEX', 'false').lower() in ('true', '1', 'yes', 'on')
     }
     
+    # Structured Output (JSON-Schema, strict): Antwort wird in einem Durchlauf geparst,
+    # die Regex-Reparatur bleibt nur als Fallback
+    AGENT_STRUCTURED_OUTPUT = {
+        'inquiry': os.environ.get('INQUIRY_STRUCTURED_OUTPUT', 'true').lower() in ('true', '1', 'yes', 'on'),
+        'analysis': os.environ.get('ANALYSIS_STRUCTURED_OUTPUT', 'true').lower() in ('true', '1', 'yes', 'on'),
+        'report': os.environ.get('REPORT_STRUCTURED_OUTPUT', 'true').lower() in ('true', '1', 'yes', 'on'),
+        'combined_analysis_report': os.environ.get('COMBINED_ANALYSIS_REPORT_STRUCTURED_OUTPUT', 'true').lower() in ('true', '1', 'yes', 'on')
+    }
+    
+    # Streaming (opt-in): Teilergebnisse (Titel, Zusammenfassung) werden während
+    # der Generierung per SSE veröffentlicht
+    AGENT_STREAMING = {
+        'analysis': os.environ.get('ANALYSIS_STREAMING', 'false').lower() in ('true', '1', 'yes', 'on'),
+        'report': os.environ.get('REPORT_STREAMING', 'false').lower() in ('true', '1', 'yes', 'on'),
+        'combined_analysis_report': os.environ.get('COMBINED_ANALYSIS_REPORT_STREAMING', 'false').lower() in ('true', '1', 'yes', 'on')
+    }
+    
     DEBUG_ENABLED = os.environ.get('DEBUG_ENABLED', 'False').lower() in ('true', '1', 'yes', 'on')
     
     API_ENDPOINTS = [
@@ -292,12 +340,73 @@ class Config:
     # Automatic Retry Configuration
     RETRY_CHECK_INTERVAL = int(os.environ.get('RETRY_CHECK_INTERVAL', '300'))  # 5 minutes default
     RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', '3'))  # 3 retries default
+    RETRY_SCAN_BATCH_SIZE = int(os.environ.get('RETRY_SCAN_BATCH_SIZE', '100'))  # Risks pro gesperrtem Batch
+    
+    # Workflow-Lease pro Risk (Heartbeat alle TTL/3) und Enqueue-Dedup (workflow_lease.py, workflow_dispatch.py)
+    WORKFLOW_LEASE_TTL = int(os.environ.get('WORKFLOW_LEASE_TTL', '60'))  # Sekunden
+    WORKFLOW_ENQUEUE_DEDUP_TTL = int(os.environ.get('WORKFLOW_ENQUEUE_DEDUP_TTL', '600'))  # Sekunden
+    
+    # Statusdokumente für pollende Clients und Long-Poll (?wait=) der Status-Endpoints (workflow_status.py)
+    WORKFLOW_STATUS_TTL = int(os.environ.get('WORKFLOW_STATUS_TTL', '3600'))  # Sekunden
+    WORKFLOW_STATUS_MAX_WAIT = int(os.environ.get('WORKFLOW_STATUS_MAX_WAIT', '25'))  # Sekunden
+    
+    # OpenAI Batch API für nicht-interaktive Workflows (Retries, Auto-Continue)
+    LLM_BATCH_ENABLED = os.environ.get('LLM_BATCH_ENABLED', 'false').lower() in ('true', '1', 'yes', 'on')
+    LLM_BATCH_BACKEND = os.environ.get('LLM_BATCH_BACKEND', 'openai').lower()  # openai | fake
+    LLM_BATCH_POLL_INTERVAL = int(os.environ.get('LLM_BATCH_POLL_INTERVAL', '60'))  # Sekunden
+    LLM_BATCH_COMPLETION_WINDOW = os.environ.get('LLM_BATCH_COMPLETION_WINDOW', '24h')
+    LLM_BATCH_MAX_REQUESTS = int(os.environ.get('LLM_BATCH_MAX_REQUESTS', '1000'))
+    LLM_BATCH_RETENTION_DAYS = int(os.environ.get('LLM_BATCH_RETENTION_DAYS', '7'))
+
+    # Metrics (Histogramme aller Prozesse, aggregiert unter /metrics im Prometheus-Format)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('true', '1', 'yes', 'on')
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(LOG_DIR, 'metrics'))  # von App und Worker gemeinsam genutzt
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '10'))  # Sekunden
+    METRICS_STALE_SECONDS = int(os.environ.get('METRICS_STALE_SECONDS', '3600'))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Optional: Bearer-Token für /metrics
+
+    # Distributed Tracing (W3C traceparent über HTTP, Celery-Header und Threads)
+    TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() in ('true', '1', 'yes', 'on')
+    TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', '1.0'))
+    TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', 'file').lower()  # file | otlp
+    TRACING_OTLP_ENDPOINT = os.environ.get('TRACING_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    TRACING_SERVICE_NAME = os.environ.get('TRACING_SERVICE_NAME', 'xrisk')
+
+    # SQL Instrumentation (ohne SQL_INSTRUMENTATION_ENABLED werden keine Listener registriert)
+    SQL_INSTRUMENTATION_ENABLED = os.environ.get('SQL_INSTRUMENTATION_ENABLED', 'false').lower() in ('true', '1', 'yes', 'on')
+    SQL_LOG_TABLES = os.environ.get('SQL_LOG_TABLES', 'risk_assessments')  # Komma-getrennt, '*' = alle
+    SQL_LOG_SAMPLE_RATE = float(os.environ.get('SQL_LOG_SAMPLE_RATE', '1.0'))
+    SQL_LOG_PARAMS = os.environ.get('SQL_LOG_PARAMS', 'false').lower() in ('true', '1', 'yes', 'on')
+    SQL_SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', '500'))  # 0 = aus
+    SQL_EXPLAIN_SLOW = os.environ.get('SQL_EXPLAIN_SLOW', 'false').lower() in ('true', '1', 'yes', 'on')
+    SQL_REQUEST_QUERY_WARN = int(os.environ.get('SQL_REQUEST_QUERY_WARN', '50'))  # 0 = aus
+
+    # LLM Request Logging: Level des OpenAI_API Loggers, Payload-Kürzung und optionaler Trace-Store
+    # (vollständige Prompts/Antworten gzip-komprimiert in LOG_DIR/llm_traces)
+    LLM_LOG_LEVEL = os.environ.get('LLM_LOG_LEVEL', 'INFO').upper()
+    LLM_LOG_PAYLOAD_CHARS = int(os.environ.get('LLM_LOG_PAYLOAD_CHARS', '500'))  # 0 = ungekürzt
+    LLM_TRACE_ENABLED = os.environ.get('LLM_TRACE_ENABLED', 'false').lower() in ('true', '1', 'yes', 'on')
+    LLM_TRACE_SAMPLE_RATE = float(os.environ.get('LLM_TRACE_SAMPLE_RATE', '1.0'))
+    LLM_TRACE_MAX_FILE_MB = int(os.environ.get('LLM_TRACE_MAX_FILE_MB', '50'))
+    LLM_TRACE_MAX_TOTAL_MB = int(os.environ.get('LLM_TRACE_MAX_TOTAL_MB', '500'))
+
+    # LLM Call Ledger (Tokens, Latenz, Tier pro Request - asynchron in Batches geschrieben)
+    LLM_LEDGER_ENABLED = os.environ.get('LLM_LEDGER_ENABLED', 'true').lower() in ('true', '1', 'yes', 'on')
+    LLM_LEDGER_BATCH_SIZE = int(os.environ.get('LLM_LEDGER_BATCH_SIZE', '50'))
+    LLM_LEDGER_FLUSH_INTERVAL = float(os.environ.get('LLM_LEDGER_FLUSH_INTERVAL', '5'))  # Sekunden
+    LLM_LEDGER_MAX_QUEUE = int(os.environ.get('LLM_LEDGER_MAX_QUEUE', '10000'))
+    LLM_LEDGER_RETENTION_DAYS = int(os.environ.get('LLM_LEDGER_RETENTION_DAYS', '90'))  # 0 = unbegrenzt
     
     # Small Risk Threshold Configuration
     # Risks with insurance value <= this amount (in EUR) are considered "small risks"
     # Small risks skip research and use combined analysis/report agent
     SMALL_RISK_THRESHOLD_EUR = float(os.environ.get('SMALL_RISK_THRESHOLD_EUR', '1000.0'))
     
+    # Risk Validation
+    # /workflow/start only runs a local pre-check (empty/too short descriptions are rejected inline),
+    # the ValidationAgent runs as first stage of the async workflow (rejection via status/SSE)
+    VALIDATION_MIN_PROMPT_CHARS = int(os.environ.get('VALIDATION_MIN_PROMPT_CHARS', '3'))
+    
     # OAuth Configuration
     # Google OAuth - Get credentials from https://console.cloud.google.com/
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
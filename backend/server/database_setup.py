@@ -93,191 +93,40 @@ def create_tables():
         return False
 
 def migrate_database():
-    """Run database migrations for schema updates"""
+    """
+    Bring the database schema to the latest version (see migrations.py)
+
+    Raises:
+        Exception: If a migration fails - the app must not start on an outdated schema
+    """
     import logging
-    from sqlalchemy import inspect, text
     
     logger = logging.getLogger('application')
     
     try:
         from app import app, db
+        from migrations import run_migrations
         
         # This function might be called from app.py's create_app() where we're already in app_context
         # Or from main() where we need to create the context
-        def _run_migrations():
-            inspector = inspect(db.engine)
-            
-            # Migration 1: Add processing_since column to risk_assessments
-            if 'risk_assessments' not in inspector.get_table_names():
-                logger.info("Table 'risk_assessments' does not exist yet, skipping migration")
-                print("Table 'risk_assessments' does not exist yet, skipping migration")
-                return True
-            
-            columns = [col['name'] for col in inspector.get_columns('risk_assessments')]
-            
-            # Migration 1: processing_since
-            if 'processing_since' not in columns:
-                logger.info("Running migration: Adding 'processing_since' column...")
-                print("Adding 'processing_since' column to risk_assessments table...")
-                with db.engine.connect() as conn:
-                    conn.execute(text('''
-                        ALTER TABLE risk_assessments 
-                        ADD COLUMN processing_since TIMESTAMP
-                    '''))
-                    conn.commit()
-                logger.info("Migration completed: processing_since column added")
-                print("processing_since column added successfully")
-            else:
-                logger.info("Migration check: processing_since column already exists")
-            
-            # Migration 2: retry_count
-            if 'retry_count' not in columns:
-                logger.info("Running migration: Adding retry mechanism columns...")
-                print("Adding retry mechanism columns to risk_assessments table...")
-                with db.engine.connect() as conn:
-                    conn.execute(text('''
-                        ALTER TABLE risk_assessments 
-                        ADD COLUMN retry_count INTEGER DEFAULT 0 NOT NULL,
-                        ADD COLUMN failed_at TIMESTAMP,
-                        ADD COLUMN failed_reason TEXT,
-                        ADD COLUMN admin_notified BOOLEAN DEFAULT FALSE NOT NULL
-                    '''))
-                    conn.commit()
-                logger.info("Migration completed: retry mechanism columns added")
-                print("Retry mechanism columns added successfully")
-            else:
-                logger.info("Migration check: retry mechanism columns already exist")
-            
-            # Migration 3: Rename inquery -> inquiry
-            if 'inquery' in columns and 'inquiry' not in columns:
-                logger.info("Running migration: Renaming 'inquery' column to 'inquiry'...")
-                print("Renaming column 'inquery' to 'inquiry' in risk_assessments table...")
-                with db.engine.connect() as conn:
-                    # 1. Rename column
-                    conn.execute(text('''
-                        ALTER TABLE risk_assessments RENAME COLUMN inquery TO inquiry
-                    '''))
-                    conn.commit()
-                logger.info("Migration completed: 'inquery' column renamed to 'inquiry'")
-                print("Renamed column 'inquery' to 'inquiry' successfully")
-                columns = [col['name'] for col in inspector.get_columns('risk_assessments')]
-            # Migration 4: Update all status='inquery' to 'inquiry_awaiting_response'
-            # Also clean up any very old status/inconsistencies.
-            with db.engine.connect() as conn:
-                # Only run if status column exists
-                if 'status' in columns:
-                    logger.info("Updating legacy statuses: 'inquery' → 'inquiry_awaiting_response', 'inquired' stays unchanged")
-                    print("Updating legacy risk_assessments statuses in DB...")
-                    conn.execute(text("""
-                        UPDATE risk_assessments SET status='inquiry_awaiting_response' WHERE status='inquery';
-                    """))
-                    conn.commit()
-                    print("Legacy status migration for 'inquery' complete.")
-            
-            # Migration 5: Create users table for authentication
-            if 'users' not in inspector.get_table_names():
-                logger.info("Running migration: Creating 'users' table...")
-                print("Creating 'users' table for authentication...")
-                with db.engine.connect() as conn:
-                    conn.execute(text('''
-                        CREATE TABLE users (
-                            id SERIAL PRIMARY KEY,
-                            user_uuid VARCHAR(36) UNIQUE NOT NULL,
-                            email VARCHAR(255) UNIQUE NOT NULL,
-                            password_hash VARCHAR(255),
-                            name VARCHAR(255),
-                            oauth_provider VARCHAR(50),
-                            oauth_id VARCHAR(255),
-                            is_active BOOLEAN DEFAULT TRUE NOT NULL,
-                            is_verified BOOLEAN DEFAULT FALSE NOT NULL,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
-                            last_login TIMESTAMP,
-                            email_verification_token VARCHAR(100) UNIQUE,
-                            email_verification_token_expires TIMESTAMP,
-                            password_reset_token VARCHAR(100) UNIQUE,
-                            password_reset_token_expires TIMESTAMP
-                        )
-                    '''))
-                    conn.execute(text('''
-                        CREATE INDEX idx_users_email ON users(email)
-                    '''))
-                    conn.execute(text('''
-                        CREATE INDEX idx_users_user_uuid ON users(user_uuid)
-                    '''))
-                    conn.commit()
-                logger.info("Migration completed: users table created")
-                print("Users table created successfully")
-            else:
-                logger.info("Migration check: users table already exists")
-                
-                # Migration 5.1: Add token fields to existing users table if missing
-                user_columns = [col['name'] for col in inspector.get_columns('users')]
-                
-                if 'email_verification_token' not in user_columns:
-                    logger.info("Running migration: Adding email verification token fields...")
-                    print("Adding email verification token fields to users table...")
-                    with db.engine.connect() as conn:
-                        conn.execute(text('''
-                            ALTER TABLE users 
-                            ADD COLUMN email_verification_token VARCHAR(100) UNIQUE,
-                            ADD COLUMN email_verification_token_expires TIMESTAMP
-                        '''))
-                        conn.commit()
-                    logger.info("Migration completed: email verification token fields added")
-                    print("Email verification token fields added successfully")
-                
-                if 'password_reset_token' not in user_columns:
-                    logger.info("Running migration: Adding password reset token fields...")
-                    print("Adding password reset token fields to users table...")
-                    with db.engine.connect() as conn:
-                        conn.execute(text('''
-                            ALTER TABLE users 
-                            ADD COLUMN password_reset_token VARCHAR(100) UNIQUE,
-                            ADD COLUMN password_reset_token_expires TIMESTAMP
-                        '''))
-                        conn.commit()
-                    logger.info("Migration completed: password reset token fields added")
-                    print("Password reset token fields added successfully")
-                
-                # Migration: Add email_verification_token_hash column
-                if 'email_verification_token_hash' not in user_columns:
-                    logger.info("Running migration: Adding email_verification_token_hash column...")
-                    print("Adding email_verification_token_hash column to users table...")
-                    with db.engine.connect() as conn:
-                        conn.execute(text('''
-                            ALTER TABLE users 
-                            ADD COLUMN email_verification_token_hash VARCHAR(64)
-                        '''))
-                        # Create index for faster lookups
-                        conn.execute(text('''
-                            CREATE INDEX IF NOT EXISTS idx_users_email_verification_token_hash 
-                            ON users(email_verification_token_hash)
-                        '''))
-                        conn.commit()
-                    logger.info("Migration completed: email_verification_token_hash column added")
-                    print("email_verification_token_hash column added successfully")
-                else:
-                    logger.info("Migration check: email_verification_token_hash column already exists")
-            
-            return True
-        
         try:
             db.engine
-            return _run_migrations()
+            version = run_migrations(db)
         except RuntimeError:
             # Not in context, create one
             with app.app_context():
-                return _run_migrations()
+                version = run_migrations(db)
+        print(f"Database schema at version {version}")
+        return True
             
     except Exception as e:
         error_msg = f"Migration error: {e}"
         try:
-            logger.warning(error_msg)
+            logger.error(error_msg)
         except:
             pass
         print(error_msg)
-        print("Continuing anyway - this might be okay if it's a new installation")
-        return True  # Don't fail deployment on migration errors
+        raise
 
 def main():
     """Main setup function"""
@@ -310,7 +159,11 @@ def main():
         return
     
     print("\n3. Running migrations...")
-    migrate_database()
+    try:
+        migrate_database()
+    except Exception:
+        print("Database migration failed - aborting setup")
+        sys.exit(1)
     
     print("\nDatabase setup completed successfully!")
     print("\nNext steps:")
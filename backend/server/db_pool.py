@@ -0,0 +1,180 @@
+"""
+xrisk - Database Connection Pools
+Author: Manuel Schott
+
+Connection pool profiles per process type and connection hygiene
+
+- web:    Gunicorn mit gevent (4 Worker x 1000 Verbindungen). Requests halten eine
+          Verbindung nur kurz; SSE-Streams geben ihre vor der Warteschleife zurück
+          (release_db_connection). Kurzer pool_timeout: lieber ein schneller Fehler
+          als tausend wartende Greenlets.
+- celery: Eine Verbindung pro gleichzeitigem Task (start_celery_worker.sh setzt
+          DB_POOL_SIZE = Concurrency für gevent/threads, prefork: 1) plus Overflow
+          für den Lease-Heartbeat. Workflow-Tasks lösen den Risk vor jedem
+          LLM-Aufruf von der Session (detached) und geben die Verbindung zurück.
+- script: database_setup.py, Deploy-Skripte.
+
+Summe über alle Prozesse: web 4 x (10 + 10), Celery Concurrency + Overflow - das
+muss unter max_connections von Postgres (bzw. default_pool_size von PgBouncer) bleiben.
+
+Geforkte Prozesse (Gunicorn mit preload_app, Celery prefork) dürfen die Verbindungen
+des Elternprozesses nicht weiterverwenden: dispose_engine_after_fork() verwirft sie
+im Kind, ohne sie für den Elternprozess zu schließen.
+
+PgBouncer im Transaction-Mode (DB_PGBOUNCER=true): keine Startup-Parameter
+(statement_timeout dann per ALTER ROLE ... SET statement_timeout setzen), und
+Migrationen brauchen Session-Features (Advisory Lock, CREATE INDEX CONCURRENTLY) -
+sie laufen über DATABASE_DIRECT_URL direkt gegen Postgres.
+"""
+
+import logging
+import os
+import sys
+from contextlib import contextmanager
+
+logger = logging.getLogger('application')
+
+PROCESS_TYPES = ('web', 'celery', 'script')
+
+# (pool_size, max_overflow, pool_timeout) je Prozesstyp
+POOL_PROFILES = {
+    'web': (10, 10, 5),
+    'celery': (1, 1, 30),
+    'script': (2, 3, 30),
+}
+
+
+def current_process_type() -> str:
+    """
+    Get the process type for the pool profile
+
+    Returns:
+        str: DB_PROCESS_TYPE if set, otherwise derived from the executable (gunicorn/celery)
+    """
+    process_type = os.environ.get('DB_PROCESS_TYPE', '').lower()
+    if process_type in PROCESS_TYPES:
+        return process_type
+    executable = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if 'gunicorn' in executable:
+        return 'web'
+    if 'celery' in executable:
+        return 'celery'
+    return 'script'
+
+
+def engine_options(process_type: str, pool_size=None, max_overflow=None, pool_recycle: int = 300,
+                   statement_timeout: int = 30000, pgbouncer: bool = False) -> dict:
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS for a process type
+
+    Args:
+        process_type (str): 'web', 'celery' or 'script'
+        pool_size (int): Override of the profile pool size (DB_POOL_SIZE)
+        max_overflow (int): Override of the profile overflow (DB_MAX_OVERFLOW)
+        pool_recycle (int): Seconds after which connections are replaced
+        statement_timeout (int): Statement timeout in milliseconds (not sent through PgBouncer)
+        pgbouncer (bool): Connect through PgBouncer in transaction mode
+
+    Returns:
+        dict: Engine options
+    """
+    profile_size, profile_overflow, pool_timeout = POOL_PROFILES.get(process_type, POOL_PROFILES['script'])
+    if pool_size is None:
+        pool_size = profile_size
+    if max_overflow is None:
+        # Celery gevent/threads: Heartbeats der Leases teilen sich den Overflow
+        max_overflow = max(profile_overflow, pool_size // 4) if process_type == 'celery' else profile_overflow
+
+    connect_args = {'connect_timeout': 10}
+    if not pgbouncer:
+        # PgBouncer lehnt den Startup-Parameter options ab
+        connect_args['options'] = f'-c statement_timeout={statement_timeout}'
+
+    return {
+        'pool_pre_ping': True,
+        'pool_recycle': pool_recycle,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        # LIFO: Verbindungen über dem Grundbedarf bleiben ungenutzt und laufen per pool_recycle aus
+        'pool_use_lifo': True,
+        'connect_args': connect_args
+    }
+
+
+def release_db_connection(session=None) -> bool:
+    """
+    Return the connection of the current session to the pool before a long wait (LLM call, SSE loop)
+
+    Ends the open read transaction without expiring the loaded objects, so their
+    attributes stay usable; the next query checks out a connection again.
+    Pending changes are left alone (they belong to a stage commit).
+
+    Args:
+        session: SQLAlchemy session (default: db.session of the app context)
+
+    Returns:
+        bool: True if a connection was released
+    """
+    if session is None:
+        from models import db
+        session = db.session()
+    if not session.in_transaction() or session.new or session.dirty or session.deleted:
+        return False
+
+    expire_on_commit = session.expire_on_commit
+    session.expire_on_commit = False
+    try:
+        session.commit()
+    except Exception:
+        # Fehlgeschlagene Transaktion (z.B. abgebrochene Abfrage) - Rollback gibt die Verbindung ebenso frei
+        session.rollback()
+    finally:
+        session.expire_on_commit = expire_on_commit
+    return True
+
+
+@contextmanager
+def detached(*instances):
+    """
+    Hold no session state and no connection during a long wait (LLM call)
+
+    The caller loads everything the wait needs beforehand. The instances are
+    expunged after the read transaction has ended - an accidental lazy load during
+    the wait fails (DetachedInstanceError) instead of silently checking out a
+    connection for the rest of the call. On exit (also on errors, for mark_as_failed)
+    they are re-added to the session without a query, so the results are committed
+    through the usual stage transaction (and its lease fencing).
+
+    Args:
+        *instances: Persistent ORM instances (e.g. the RiskAssessment of the workflow)
+    """
+    from models import db
+
+    session = db.session()
+    if session.new or session.dirty or session.deleted:
+        # Ungespeicherte Änderungen gehören zu einem Stage-Commit - Session bleibt angebunden
+        logger.warning("Session has pending changes - keeping it attached during the wait")
+        yield
+        return
+
+    release_db_connection(session)
+    expunged = [instance for instance in instances if instance in session]
+    for instance in expunged:
+        session.expunge(instance)
+    try:
+        yield
+    finally:
+        for instance in expunged:
+            session.add(instance)
+
+
+def dispose_engine_after_fork() -> None:
+    """Drop pooled connections inherited from the parent process (without closing them for the parent)"""
+    from app import app
+    from models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    logger.info(f"Database pool reset after fork (pid {os.getpid()})")
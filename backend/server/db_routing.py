@@ -0,0 +1,128 @@
+"""
+xrisk - Read Replica Routing
+Author: Manuel Schott
+
+Routes read-only endpoints to a read replica (DATABASE_REPLICA_URL)
+
+Endpoints mit @read_replica lesen über die Replica; alles andere - und jeder
+Schreibzugriff (Flush, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE) - läuft über
+den Primary. Ohne DATABASE_REPLICA_URL ist alles ein No-op.
+
+Read-your-writes: Hat ein Request geschrieben, liest derselbe Browser (Flask-Session)
+für DB_REPLICA_PIN_SECONDS nur vom Primary - der Replikationsverzug ist dann sicher
+aufgeholt. Schreibzugriffe der Workflow-Worker sieht die Replica mit kurzem Verzug;
+Endpunkte, die direkt nach einem Workflow-Schritt lesen, nutzen
+read_with_primary_fallback.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+
+from config import Config
+
+logger = logging.getLogger('application')
+
+REPLICA_BIND = 'replica'
+
+_PIN_KEY = 'db_primary_until'
+
+
+def _is_write(clause) -> bool:
+    if clause is None:
+        return False
+    return getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None
+
+
+def _replica_requested() -> bool:
+    return has_request_context() and g.get('db_use_replica', False)
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends reads of @read_replica endpoints to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or _is_write(clause):
+            if has_request_context():
+                g.db_wrote = True
+        elif bind is None and _replica_requested():
+            from models import db
+            replica = db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_enabled() -> bool:
+    return bool(Config.DATABASE_REPLICA_URL)
+
+
+def reads_from_replica() -> bool:
+    """Check if the current request reads from the replica"""
+    return _replica_requested() and replica_enabled()
+
+
+def is_pinned_to_primary() -> bool:
+    """Check if the current browser wrote recently (read-your-writes)"""
+    return flask_session.get(_PIN_KEY, 0) > time.time()
+
+
+def read_replica(view):
+    """
+    Decorator: serve a read-only endpoint from the read replica
+
+    Falls back to the primary while the client is pinned after its own writes.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if replica_enabled() and not is_pinned_to_primary():
+            g.db_use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside a @read_replica endpoint"""
+    previous = g.get('db_use_replica', False)
+    g.db_use_replica = False
+    try:
+        yield
+    finally:
+        g.db_use_replica = previous
+
+
+def read_with_primary_fallback(load, is_current):
+    """
+    Load from the replica and retry on the primary if the replica is behind
+
+    Args:
+        load: Callable returning the loaded object(s)
+        is_current: Callable(result) -> bool, False if the replica has not caught up
+
+    Returns:
+        Result of load()
+    """
+    result = load()
+    if not _replica_requested() or is_current(result):
+        return result
+
+    from models import db
+    # Identity Map leeren, sonst liefert die Session die veralteten Replica-Objekte erneut
+    db.session.expunge_all()
+    with use_primary():
+        logger.info("Replica behind - reading from primary")
+        return load()
+
+
+def init_db_routing(app) -> None:
+    """Pin clients that wrote to the primary for DB_REPLICA_PIN_SECONDS"""
+    @app.after_request
+    def pin_writer_to_primary(response):
+        if replica_enabled() and g.get('db_wrote', False):
+            flask_session[_PIN_KEY] = time.time() + Config.DB_REPLICA_PIN_SECONDS
+        return response
@@ -52,7 +52,13 @@ server_dir = os.path.dirname(__file__)
 if server_dir not in sys.path:
     sys.path.insert(0, server_dir)
 
-from logging_config import create_rotating_file_handler
+from logging_config import create_rotating_file_handler, attach_handler, clear_handlers
+
+def post_fork(server, worker):
+    """Called just after a worker has been forked (preload_app: the master already used the DB)."""
+    from db_pool import dispose_engine_after_fork
+    dispose_engine_after_fork()
+
 
 def post_worker_init(worker):
     """Called just after a worker has initialized the application."""
@@ -66,17 +72,18 @@ def post_worker_init(worker):
         # Setup file logging for access logs in each worker
         gunicorn_logger = logging.getLogger('gunicorn.access')
         # Remove existing handlers to avoid duplicates
-        gunicorn_logger.handlers = []
+        clear_handlers(gunicorn_logger)
         access_handler = create_rotating_file_handler(
             f'{log_dir}/gunicorn_access.log',
             formatter=logging.Formatter('%(message)s')
         )
-        gunicorn_logger.addHandler(access_handler)
+        # Über die Log-Queue: Schreiben und Rotation im Listener-Thread, nicht im Request-Greenlet
+        attach_handler(gunicorn_logger, access_handler)
         
         # Setup file logging for error logs in each worker
         gunicorn_error_logger = logging.getLogger('gunicorn.error')
         # Remove existing handlers to avoid duplicates
-        gunicorn_error_logger.handlers = []
+        clear_handlers(gunicorn_error_logger)
         error_handler = create_rotating_file_handler(
             f'{log_dir}/gunicorn_error.log',
             formatter=logging.Formatter(
@@ -84,7 +91,7 @@ def post_worker_init(worker):
                 datefmt='%Y-%m-%d %H:%M:%S'
             )
         )
-        gunicorn_error_logger.addHandler(error_handler)
+        attach_handler(gunicorn_error_logger, error_handler)
     except (PermissionError, OSError) as e:
         # If file logging fails, continue with stdout/stderr only
         # This prevents worker boot failures
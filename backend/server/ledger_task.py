@@ -0,0 +1,38 @@
+"""
+xrisk - LLM Ledger Retention Task
+Author: Manuel Schott
+
+Celery Beat task that deletes ledger records older than LLM_LEDGER_RETENTION_DAYS
+"""
+
+from celery_app import celery_app
+import logging
+
+logger = logging.getLogger('celery')
+
+
+@celery_app.task(name='workflow.purge_llm_ledger')
+def purge_llm_ledger():
+    """
+    Periodic task for the LLM call ledger
+    Runs hourly; no-op with LLM_LEDGER_RETENTION_DAYS=0
+    """
+    from config import Config
+
+    if Config.LLM_LEDGER_RETENTION_DAYS <= 0:
+        return {'status': 'disabled'}
+
+    from app import app
+    from models import db
+    from llm_ledger import purge_old_records
+
+    try:
+        with app.app_context():
+            purged = purge_old_records(db.session)
+            logger.info(f"[LLM Ledger] Purged {purged} records older than {Config.LLM_LEDGER_RETENTION_DAYS} days")
+            return {'purged': purged}
+
+    except Exception as e:
+        logger.error(f"[LLM Ledger] Error during purge: {str(e)}")
+        import traceback
+        logger.error(f"[LLM Ledger] Traceback: {traceback.format_exc()}")
@@ -0,0 +1,422 @@
+"""
+xrisk - LLM Batch Execution Backend
+Author: Manuel Schott
+
+OpenAI Batch API backend for non-interactive workflows (automatic retries,
+auto-continued risks). Nobody waits for these workflows, so their requests
+are collected into Batch API jobs instead of using the interactive rate limit.
+
+Ablauf:
+1. Der Workflow läuft innerhalb von llm_batch_scope()
+2. AIAgent._make_request() legt den Request als LLMBatchRequest an und wirft
+   LLMBatchPending - der Workflow pausiert ohne als fehlgeschlagen zu gelten
+3. Der Beat-Task poll_llm_batches übermittelt offene Requests, pollt die Jobs
+   und setzt pausierte Workflows fort
+4. Beim Fortsetzen wird der Workflow erneut ausgeführt; identische Requests
+   (gleiche custom_id) liefern nun das gespeicherte Ergebnis
+
+Im LLM-Ledger erscheinen Batch-Requests mit service_tier 'batch', einmal beim
+Einsammeln des Ergebnisses (Replays wiederholen sich bei jedem Fortsetzen).
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from workflow_dispatch import get_redis_client
+
+logger = logging.getLogger('celery')
+
+# Aktiver Batch-Scope des laufenden Workflows (risk_uuid, user_uuid) oder None
+_batch_scope = contextvars.ContextVar('llm_batch_scope', default=None)
+
+# Parameter, die im Batch API Body nicht erlaubt bzw. sinnlos sind
+_UNSUPPORTED_BATCH_PARAMS = ('stream', 'stream_options', 'service_tier')
+
+# Terminale Batch-Status der OpenAI Batch API
+_TERMINAL_BATCH_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Aufbewahrung der Fake-Ergebnisse in Redis (Sekunden)
+_FAKE_BATCH_TTL = 24 * 3600
+
+
+class LLMBatchPending(Exception):
+    """Raised when a request was handed to the Batch API and the workflow has to pause"""
+
+    def __init__(self, risk_uuid: str, custom_id: str):
+        self.risk_uuid = risk_uuid
+        self.custom_id = custom_id
+        super().__init__(f"Batch request {custom_id} pending for risk {risk_uuid}")
+
+
+@contextmanager
+def llm_batch_scope(risk_uuid: str, user_uuid: str):
+    """
+    Route all agent requests of the current context through the Batch API
+
+    Args:
+        risk_uuid (str): Risk UUID of the running workflow
+        user_uuid (str): User UUID of the running workflow
+    """
+    token = _batch_scope.set({'risk_uuid': risk_uuid, 'user_uuid': user_uuid})
+    try:
+        yield
+    finally:
+        _batch_scope.reset(token)
+
+
+def workflow_execution_scope(execution_mode: str, risk_uuid: str, user_uuid: str):
+    """
+    Get the execution scope for a workflow task
+
+    Args:
+        execution_mode (str): 'interactive' or 'batch'
+        risk_uuid (str): Risk UUID
+        user_uuid (str): User UUID
+
+    Returns:
+        Context manager - batch scope only if batch mode is requested and enabled
+    """
+    if execution_mode == 'batch' and Config.LLM_BATCH_ENABLED:
+        return llm_batch_scope(risk_uuid, user_uuid)
+    return nullcontext()
+
+
+def current_batch_scope() -> Optional[Dict]:
+    """Get the active batch scope or None for interactive execution"""
+    return _batch_scope.get()
+
+
+def build_custom_id(risk_uuid: str, agent: str, body: Dict) -> str:
+    """
+    Build a deterministic custom_id for a request
+
+    Gleiche Eingaben ergeben die gleiche ID - dadurch findet der fortgesetzte
+    Workflow das Ergebnis seines ursprünglichen Requests wieder.
+    """
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:24]
+    return f"{risk_uuid}:{agent}:{digest}"
+
+
+def batch_session():
+    """
+    Create an independent session for batch bookkeeping
+
+    Research-Agenten laufen parallel in Threads und teilen sich die
+    Flask-SQLAlchemy Session des Workflows - die Batch-Verwaltung nutzt
+    deshalb eine eigene, kurzlebige Session.
+    """
+    from sqlalchemy.orm import Session
+    from models import db
+    return Session(db.engine, expire_on_commit=False)
+
+
+def submit_or_replay(agent: str, request_params: Dict) -> str:
+    """
+    Return the batch result for a request or enqueue it and pause the workflow
+
+    Args:
+        agent (str): Agent config key (e.g. 'analysis')
+        request_params (Dict): Parameters that would be sent to chat.completions.create
+
+    Returns:
+        str: Response content of the completed batch request
+
+    Raises:
+        LLMBatchPending: If the request is queued or still running
+        Exception: If the batch request failed (the workflow fails as usual)
+    """
+    from models import LLMBatchRequest
+
+    scope = current_batch_scope()
+    body = {k: v for k, v in request_params.items() if k not in _UNSUPPORTED_BATCH_PARAMS}
+    custom_id = build_custom_id(scope['risk_uuid'], agent, body)
+
+    with batch_session() as session:
+        entry = session.query(LLMBatchRequest).filter_by(custom_id=custom_id).first()
+
+        if entry is None:
+            session.add(LLMBatchRequest(
+                custom_id=custom_id,
+                risk_uuid=scope['risk_uuid'],
+                user_uuid=scope['user_uuid'],
+                agent=agent,
+                request_body=body,
+                status='queued'
+            ))
+            try:
+                session.commit()
+            except Exception:
+                # Parallel angelegt (gleiche custom_id) - Ergebnis bleibt identisch
+                session.rollback()
+            logger.info(f"[Batch] Queued {agent} request {custom_id}")
+            raise LLMBatchPending(scope['risk_uuid'], custom_id)
+
+        if entry.status in LLMBatchRequest.PENDING_STATUSES:
+            raise LLMBatchPending(scope['risk_uuid'], custom_id)
+
+        if entry.status == 'failed':
+            error = entry.error
+            # Eintrag entfernen, damit ein späterer Retry neu eingereicht wird
+            session.delete(entry)
+            session.commit()
+            raise Exception(f"OpenAI Batch request failed: {error}")
+
+        logger.info(f"[Batch] Replaying completed {agent} request {custom_id}")
+        return entry.response_content
+
+
+def _placeholder_from_schema(schema: Dict):
+    """Build a minimal value matching a JSON schema (used by the fake client)"""
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        return {key: _placeholder_from_schema(value) for key, value in schema.get('properties', {}).items()}
+    if schema_type == 'array':
+        return []
+    if schema_type in ('number', 'integer'):
+        return 0
+    if schema_type == 'boolean':
+        return False
+    return ''
+
+
+class OpenAIBatchClient:
+    """Batch client using the OpenAI Files and Batches API"""
+
+    def __init__(self, api_key: str = None):
+        import openai
+        self.client = openai.OpenAI(api_key=api_key or Config.OPENAI_API_KEY)
+
+    def submit(self, requests: List[Dict]) -> str:
+        """
+        Upload requests as JSONL and create a batch job
+
+        Args:
+            requests (List[Dict]): Dicts with custom_id and body
+
+        Returns:
+            str: Batch ID
+        """
+        lines = "\n".join(
+            json.dumps({
+                'custom_id': request['custom_id'],
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': request['body']
+            }, ensure_ascii=False)
+            for request in requests
+        )
+        batch_file = self.client.files.create(
+            file=('xrisk_batch.jsonl', lines.encode('utf-8')),
+            purpose='batch'
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window=Config.LLM_BATCH_COMPLETION_WINDOW
+        )
+        return batch.id
+
+    def fetch(self, batch_id: str) -> Tuple[str, Optional[Dict[str, Dict]]]:
+        """
+        Get status and (if finished) results of a batch job
+
+        Returns:
+            Tuple[str, Optional[Dict]]: Batch status and results by custom_id
+                ({'content': ..., 'usage': ...} or {'error': ...}); None while running
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status not in _TERMINAL_BATCH_STATUSES:
+            return batch.status, None
+
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get('response') or {}
+                if response.get('status_code') == 200:
+                    results[item['custom_id']] = {
+                        'content': response['body']['choices'][0]['message']['content'],
+                        'usage': response['body'].get('usage')
+                    }
+                else:
+                    results[item['custom_id']] = {
+                        'error': json.dumps(item.get('error') or response.get('body'), ensure_ascii=False)
+                    }
+        return batch.status, results
+
+
+class FakeBatchClient:
+    """
+    Local fake of the Batch API for tests and development
+
+    Jobs are completed immediately on submit. The responder receives the
+    request body and returns the response content; by default a minimal
+    JSON object matching the requested response_format is returned.
+
+    Die Ergebnisse liegen in Redis, damit poll_llm_batches sie auch in einem
+    anderen Prozess als dem einreichenden findet (Gunicorn-/Celery-Pools).
+    """
+
+    def __init__(self, responder: Callable[[Dict], str] = None):
+        self.responder = responder or self._default_responder
+
+    @staticmethod
+    def _default_responder(body: Dict) -> str:
+        response_format = body.get('response_format') or {}
+        schema = response_format.get('json_schema', {}).get('schema')
+        return json.dumps(_placeholder_from_schema(schema) if schema else {})
+
+    def submit(self, requests: List[Dict]) -> str:
+        batch_id = f"fake_batch_{uuid.uuid4().hex[:12]}"
+        results = {}
+        for request in requests:
+            try:
+                results[request['custom_id']] = {'content': self.responder(request['body'])}
+            except Exception as e:
+                results[request['custom_id']] = {'error': str(e)}
+        get_redis_client().set(self._key(batch_id), json.dumps(results, ensure_ascii=False), ex=_FAKE_BATCH_TTL)
+        return batch_id
+
+    def fetch(self, batch_id: str) -> Tuple[str, Optional[Dict[str, Dict]]]:
+        # Nicht löschen - schlägt das Speichern der Ergebnisse fehl, liefert der nächste Poll sie erneut
+        results = get_redis_client().get(self._key(batch_id))
+        if results is None:
+            return 'expired', {}
+        return 'completed', json.loads(results)
+
+    @staticmethod
+    def _key(batch_id: str) -> str:
+        return f"llm_batch:fake:{batch_id}"
+
+
+def get_batch_client():
+    """Get the configured batch client (LLM_BATCH_BACKEND: openai | fake)"""
+    if Config.LLM_BATCH_BACKEND == 'fake':
+        return FakeBatchClient()
+    return OpenAIBatchClient()
+
+
+def submit_queued_requests(session, client) -> int:
+    """
+    Submit all queued requests as batch jobs (max LLM_BATCH_MAX_REQUESTS per job)
+
+    Returns:
+        int: Number of submitted requests
+    """
+    from models import LLMBatchRequest
+
+    queued = session.query(LLMBatchRequest).filter(
+        LLMBatchRequest.status == 'queued'
+    ).order_by(LLMBatchRequest.id).all()
+
+    submitted = 0
+    chunk_size = max(1, Config.LLM_BATCH_MAX_REQUESTS)
+    for start in range(0, len(queued), chunk_size):
+        chunk = queued[start:start + chunk_size]
+        batch_id = client.submit([
+            {'custom_id': entry.custom_id, 'body': entry.request_body}
+            for entry in chunk
+        ])
+        now = datetime.now(timezone.utc)
+        for entry in chunk:
+            entry.status = 'submitted'
+            entry.batch_id = batch_id
+            entry.submitted_at = now
+        session.commit()
+        submitted += len(chunk)
+        logger.info(f"[Batch] Submitted batch {batch_id} with {len(chunk)} requests")
+
+    return submitted
+
+
+def _record_batch_call(entry, result: Optional[Dict], now: datetime) -> None:
+    """Record a finished batch request in the LLM ledger (tier 'batch', latency = time since enqueue)"""
+    from llm_ledger import llm_ledger_scope, record_llm_call
+
+    created_at = entry.created_at
+    if created_at is not None and created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    usage = (result or {}).get('usage') or {}
+    details = usage.get('prompt_tokens_details') or {}
+    with llm_ledger_scope(entry.risk_uuid):
+        record_llm_call(
+            entry.agent, (entry.request_body or {}).get('model', ''), 'batch',
+            (now - created_at).total_seconds() * 1000 if created_at else 0,
+            {
+                'prompt_tokens': usage.get('prompt_tokens') or 0,
+                'completion_tokens': usage.get('completion_tokens') or 0,
+                'total_tokens': usage.get('total_tokens') or 0,
+                'cached_tokens': details.get('cached_tokens') or 0
+            },
+            success=entry.status == 'completed'
+        )
+
+
+def collect_finished_batches(session, client) -> List[str]:
+    """
+    Poll submitted batch jobs and store their results
+
+    Returns:
+        List[str]: Risk UUIDs whose pending requests are all finished now
+    """
+    from models import LLMBatchRequest
+
+    batch_ids = [row[0] for row in session.query(LLMBatchRequest.batch_id).filter(
+        LLMBatchRequest.status == 'submitted'
+    ).distinct().all()]
+
+    touched_risks = set()
+    for batch_id in batch_ids:
+        try:
+            batch_status, results = client.fetch(batch_id)
+        except Exception as e:
+            logger.error(f"[Batch] Failed to poll batch {batch_id}: {str(e)}")
+            continue
+        if results is None:
+            logger.debug(f"[Batch] Batch {batch_id} still {batch_status}")
+            continue
+
+        now = datetime.now(timezone.utc)
+        entries = session.query(LLMBatchRequest).filter_by(batch_id=batch_id, status='submitted').all()
+        for entry in entries:
+            result = results.get(entry.custom_id)
+            if result and 'content' in result:
+                entry.status = 'completed'
+                entry.response_content = result['content']
+            else:
+                entry.status = 'failed'
+                entry.error = (result or {}).get('error') or f"Batch {batch_id} finished with status {batch_status} without result"
+            entry.completed_at = now
+            _record_batch_call(entry, result, now)
+            touched_risks.add(entry.risk_uuid)
+        session.commit()
+        logger.info(f"[Batch] Batch {batch_id} finished ({batch_status}) - {len(entries)} requests updated")
+
+    return [risk_uuid for risk_uuid in touched_risks if not session.query(LLMBatchRequest).filter(
+        LLMBatchRequest.risk_uuid == risk_uuid,
+        LLMBatchRequest.status.in_(LLMBatchRequest.PENDING_STATUSES)
+    ).first()]
+
+
+def purge_old_requests(session) -> int:
+    """Delete finished requests older than LLM_BATCH_RETENTION_DAYS"""
+    from models import LLMBatchRequest
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=Config.LLM_BATCH_RETENTION_DAYS)
+    deleted = session.query(LLMBatchRequest).filter(
+        LLMBatchRequest.status.in_(('completed', 'failed')),
+        LLMBatchRequest.completed_at < cutoff
+    ).delete(synchronize_session=False)
+    session.commit()
+    return deleted
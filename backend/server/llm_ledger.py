@@ -0,0 +1,398 @@
+"""
+xrisk - LLM Call Ledger
+Author: Manuel Schott
+
+Persistent per-call ledger for OpenAI requests (risk, agent, model, tier,
+latency, tokens, cached tokens, retries). Records are collected in memory and
+written asynchronously in batches by a background thread, so that the agent
+request path never waits for the database.
+
+The aggregated view (per stage / per model percentiles) is the basis for
+deciding where prompt caching, model downgrades or flex tiers pay off.
+"""
+
+import atexit
+import contextvars
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from config import Config
+from metrics import observe
+
+logger = logging.getLogger('application')
+
+# Workflow-Kontext der laufenden Agent-Requests (risk_uuid) oder None
+_ledger_context = contextvars.ContextVar('llm_ledger_context', default=None)
+
+# Agent-Config-Key -> Workflow-Stufe (Research-Agenten laufen als eine Stufe)
+STAGE_BY_AGENT = {
+    'validation': 'validation',
+    'classification': 'classification',
+    'inquiry': 'inquiry',
+    'research': 'research',
+    'research_current': 'research',
+    'research_historical': 'research',
+    'research_regulatory': 'research',
+    'analysis': 'analysis',
+    'report': 'report',
+    'combined_analysis_report': 'analysis_report'
+}
+
+# Perzentile der Aggregat-API
+LEDGER_PERCENTILES = (50, 90, 95, 99)
+
+# Zeilen pro DELETE beim Aufräumen (purge_old_records)
+LEDGER_PURGE_BATCH_SIZE = 5000
+
+
+@contextmanager
+def llm_ledger_scope(risk_uuid: str):
+    """
+    Attribute all agent requests of the current context to a workflow
+
+    Args:
+        risk_uuid (str): Risk UUID of the running workflow
+    """
+    token = _ledger_context.set({'risk_uuid': risk_uuid})
+    try:
+        yield
+    finally:
+        _ledger_context.reset(token)
+
+
+def current_ledger_context() -> Optional[Dict]:
+    """Get the ledger context of the running workflow or None"""
+    return _ledger_context.get()
+
+
+class LLMLedgerWriter:
+    """
+    Background writer for ledger records
+
+    Records are buffered in a bounded queue and inserted with one
+    executemany statement per batch (LLM_LEDGER_BATCH_SIZE records or
+    LLM_LEDGER_FLUSH_INTERVAL seconds, whichever comes first).
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._engine = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def record(self, entry: Dict) -> None:
+        """
+        Enqueue a ledger record (never blocks, drops the record if the queue is full)
+
+        Args:
+            entry (Dict): Column values of LLMCallRecord
+        """
+        if self._engine is None:
+            try:
+                from models import db
+                self._engine = db.engine
+            except Exception as e:
+                # Ohne App-Context (z.B. Skripte) gibt es keine Engine
+                logger.debug(f"[LLM Ledger] No database engine available, record dropped: {e}")
+                return
+
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"[LLM Ledger] Queue full - dropped {self.dropped} records so far")
+            return
+
+        self._ensure_thread()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='llm-ledger-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch(block=True)
+            if batch:
+                self._write(batch)
+
+    def _take_batch(self, block: bool) -> List[Dict]:
+        """Collect up to batch_size records (waiting at most flush_interval for the first one)"""
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch: List[Dict]) -> None:
+        from models import LLMCallRecord
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(LLMCallRecord.__table__.insert(), batch)
+        except Exception as e:
+            # Ledger-Daten sind Telemetrie - Fehler dürfen Workflows nie beeinflussen
+            logger.error(f"[LLM Ledger] Failed to write {len(batch)} records: {str(e)}")
+
+    def flush(self) -> int:
+        """
+        Synchronously write all queued records (used at process shutdown)
+
+        Returns:
+            int: Number of records handed to the database
+        """
+        if self._engine is None:
+            return 0
+        written = 0
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                return written
+            self._write(batch)
+            written += len(batch)
+
+
+_writer = LLMLedgerWriter(
+    batch_size=Config.LLM_LEDGER_BATCH_SIZE,
+    flush_interval=Config.LLM_LEDGER_FLUSH_INTERVAL,
+    max_queue=Config.LLM_LEDGER_MAX_QUEUE
+)
+
+
+def record_llm_call(agent: str, model: str, service_tier: Optional[str], latency_ms: int,
+                    usage: Optional[Dict], retries: int = 0, success: bool = True) -> None:
+    """
+    Record one OpenAI request in the ledger and the latency histogram
+
+    Args:
+        agent (str): Agent config key (e.g. 'analysis')
+        model (str): Model used for the request
+        service_tier (str): Effective service tier (None for default)
+        latency_ms (int): Wall clock time of the request incl. retries
+        usage (Dict): Token usage as returned by AIAgent._usage_to_dict
+        retries (int): Number of retries (flex fallback)
+        success (bool): False if the request finally failed
+    """
+    observe('xrisk_llm_request_duration_seconds', latency_ms / 1000.0,
+            stage=STAGE_BY_AGENT.get(agent, agent), agent=agent, model=model,
+            tier=service_tier or 'default', outcome='success' if success else 'error')
+
+    if not Config.LLM_LEDGER_ENABLED:
+        return
+
+    usage = usage or {}
+    context = current_ledger_context() or {}
+    _writer.record({
+        'risk_uuid': context.get('risk_uuid'),
+        'stage': STAGE_BY_AGENT.get(agent, agent),
+        'agent': agent,
+        'model': model,
+        'service_tier': service_tier,
+        'latency_ms': int(latency_ms),
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+        'total_tokens': usage.get('total_tokens', 0),
+        'cached_tokens': usage.get('cached_tokens', 0),
+        'retries': retries,
+        'success': success,
+        'created_at': datetime.now(timezone.utc)
+    })
+
+
+def flush_llm_ledger() -> int:
+    """Write all buffered ledger records synchronously"""
+    return _writer.flush()
+
+
+def purge_old_records(session, batch_size: int = LEDGER_PURGE_BATCH_SIZE) -> int:
+    """
+    Delete ledger records older than LLM_LEDGER_RETENTION_DAYS
+
+    Deletes in batches of batch_size rows with a commit after each batch,
+    so row locks and WAL per transaction stay small.
+
+    Args:
+        session: SQLAlchemy session
+        batch_size (int): Rows per DELETE statement
+
+    Returns:
+        int: Number of deleted records
+    """
+    from sqlalchemy import delete, select
+    from models import LLMCallRecord
+
+    if Config.LLM_LEDGER_RETENTION_DAYS <= 0:
+        return 0
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=Config.LLM_LEDGER_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        # Index ix_llm_call_ledger_created_at
+        batch_ids = select(LLMCallRecord.id).where(LLMCallRecord.created_at < cutoff).limit(batch_size)
+        result = session.execute(delete(LLMCallRecord).where(LLMCallRecord.id.in_(batch_ids.scalar_subquery())))
+        session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+atexit.register(flush_llm_ledger)
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Percentiles with linear interpolation (same as percentile_cont in PostgreSQL)"""
+    if not values:
+        return {f"p{p}": None for p in LEDGER_PERCENTILES}
+    ordered = sorted(values)
+    result = {}
+    for p in LEDGER_PERCENTILES:
+        position = p / 100 * (len(ordered) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        result[f"p{p}"] = round(ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower), 1)
+    return result
+
+
+def _summary(calls: int, failed: int, retries: int, prompt_tokens: int, completion_tokens: int,
+             cached_tokens: int, percentiles: Dict[str, Dict]) -> Dict:
+    return {
+        'calls': calls,
+        'failed': failed,
+        'retries': retries,
+        'latency_ms': percentiles['latency_ms'],
+        'prompt_tokens': percentiles['prompt_tokens'],
+        'completion_tokens': percentiles['completion_tokens'],
+        'total_prompt_tokens': prompt_tokens,
+        'total_completion_tokens': completion_tokens,
+        'total_cached_tokens': cached_tokens,
+        'cache_hit_rate': round(cached_tokens / prompt_tokens, 4) if prompt_tokens else None
+    }
+
+
+_PERCENTILE_FIELDS = ('latency_ms', 'prompt_tokens', 'completion_tokens')
+
+# grouping(stage, model, service_tier) -> Abschnitt der Antwort (Bit gesetzt = nicht gruppiert)
+_GROUPING_SECTIONS = {0b111: 'total', 0b011: 'by_stage', 0b101: 'by_model', 0b000: 'by_stage_model_tier'}
+
+
+def _group_key(section: str, row) -> Optional[str]:
+    if section == 'by_stage':
+        return row.stage
+    if section == 'by_model':
+        return row.model
+    if section == 'by_stage_model_tier':
+        return f"{row.stage}/{row.model}/{row.service_tier or 'default'}"
+    return None
+
+
+def _aggregate_postgres(session, since: datetime) -> Dict:
+    """One GROUPING SETS query - percentiles and sums are computed by the database"""
+    from sqlalchemy import func, select, text, tuple_
+    from models import LLMCallRecord as record
+
+    percentile_columns = [
+        func.percentile_cont(p / 100).within_group(getattr(record, field)).label(f"{field}_p{p}")
+        for field in _PERCENTILE_FIELDS for p in LEDGER_PERCENTILES
+    ]
+    statement = select(
+        func.grouping(record.stage, record.model, record.service_tier).label('grouping'),
+        record.stage, record.model, record.service_tier,
+        func.count().label('calls'),
+        func.count().filter(record.success.is_(False)).label('failed'),
+        func.coalesce(func.sum(record.retries), 0).label('retries'),
+        func.coalesce(func.sum(record.prompt_tokens), 0).label('prompt_tokens'),
+        func.coalesce(func.sum(record.completion_tokens), 0).label('completion_tokens'),
+        func.coalesce(func.sum(record.cached_tokens), 0).label('cached_tokens'),
+        *percentile_columns
+    ).where(record.created_at >= since).group_by(func.grouping_sets(
+        text('()'), tuple_(record.stage), tuple_(record.model),
+        tuple_(record.stage, record.model, record.service_tier)
+    ))
+
+    sections = {section: {} for section in _GROUPING_SECTIONS.values()}
+    for row in session.execute(statement):
+        section = _GROUPING_SECTIONS[row.grouping]
+        percentiles = {
+            field: {f"p{p}": (round(value, 1) if (value := getattr(row, f"{field}_p{p}")) is not None else None)
+                    for p in LEDGER_PERCENTILES}
+            for field in _PERCENTILE_FIELDS
+        }
+        sections[section][_group_key(section, row)] = _summary(
+            row.calls, row.failed, int(row.retries), int(row.prompt_tokens),
+            int(row.completion_tokens), int(row.cached_tokens), percentiles
+        )
+    return sections
+
+
+def _aggregate_in_python(session, since: datetime) -> Dict:
+    """Fallback for SQLite (no percentile_cont / GROUPING SETS)"""
+    from models import LLMCallRecord
+
+    rows = session.query(
+        LLMCallRecord.stage, LLMCallRecord.model, LLMCallRecord.service_tier,
+        LLMCallRecord.latency_ms, LLMCallRecord.prompt_tokens, LLMCallRecord.completion_tokens,
+        LLMCallRecord.cached_tokens, LLMCallRecord.retries, LLMCallRecord.success
+    ).filter(LLMCallRecord.created_at >= since).all()
+
+    groups = {section: {} for section in _GROUPING_SECTIONS.values()}
+    for row in rows:
+        for section in groups:
+            groups[section].setdefault(_group_key(section, row), []).append(row)
+    groups['total'].setdefault(None, [])
+
+    return {
+        section: {
+            key: _summary(
+                len(group), sum(1 for row in group if not row.success), sum(row.retries for row in group),
+                sum(row.prompt_tokens for row in group), sum(row.completion_tokens for row in group),
+                sum(row.cached_tokens for row in group),
+                {field: _percentiles([getattr(row, field) for row in group]) for field in _PERCENTILE_FIELDS}
+            )
+            for key, group in by_key.items()
+        }
+        for section, by_key in groups.items()
+    }
+
+
+def aggregate_ledger(since_hours: int = 24) -> Dict:
+    """
+    Aggregate ledger records per stage and per model
+
+    Args:
+        since_hours (int): Time window in hours
+
+    Returns:
+        Dict: Window, totals and percentile summaries by stage, model and stage/model
+    """
+    from models import db
+
+    since = datetime.now(timezone.utc) - timedelta(hours=since_hours)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        sections = _aggregate_postgres(db.session, since)
+    else:
+        sections = _aggregate_in_python(db.session, since)
+
+    empty = {field: _percentiles([]) for field in _PERCENTILE_FIELDS}
+    return {
+        'since': since.isoformat(),
+        'window_hours': since_hours,
+        'total': sections['total'].get(None) or _summary(0, 0, 0, 0, 0, 0, empty),
+        'by_stage': dict(sorted(sections['by_stage'].items())),
+        'by_model': dict(sorted(sections['by_model'].items())),
+        'by_stage_model_tier': dict(sorted(sections['by_stage_model_tier'].items())),
+        'dropped_records': _writer.dropped
+    }
@@ -0,0 +1,187 @@
+"""
+xrisk - LLM Trace Store
+Author: Manuel Schott
+
+Helpers for cheap request logging in AIAgent._make_request and an optional
+trace store for full prompts/responses.
+
+Das normale Log enthält nur noch Metadaten und gekürzte Payloads. Vollständige
+Prompts und Antworten landen - nur wenn LLM_TRACE_ENABLED gesetzt ist - als
+gzip-komprimiertes JSONL in LOG_DIR/llm_traces. Jeder Prozess schreibt eigene
+Dateien (PID im Namen - Appends mehrerer Prozesse würden gzip-Member
+verschränken). Die Dateien werden pro Tag bzw. bei Erreichen von
+LLM_TRACE_MAX_FILE_MB fortgesetzt, die ältesten Dateien aller Prozesse werden
+gelöscht sobald LLM_TRACE_MAX_TOTAL_MB überschritten ist.
+"""
+
+import gzip
+import json
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger('OpenAI_API')
+
+_TRACE_FILE_PREFIX = 'llm-trace-'
+_TRACE_FILE_SUFFIX = '.jsonl.gz'
+
+
+class TruncatedText:
+    """
+    Lazily truncated text for log arguments
+
+    Wird erst beim Formatieren des Log-Records gekürzt - ist das Log-Level
+    deaktiviert, entstehen keine Kosten.
+    """
+
+    __slots__ = ('text', 'limit')
+
+    def __init__(self, text, limit: int = None):
+        self.text = text
+        self.limit = Config.LLM_LOG_PAYLOAD_CHARS if limit is None else limit
+
+    def __str__(self):
+        return truncate(self.text, self.limit)
+
+
+def truncate(text, limit: int) -> str:
+    """
+    Truncate text for logging
+
+    Args:
+        text: Text (or any object) to truncate
+        limit (int): Maximum number of characters (0 = unlimited)
+
+    Returns:
+        str: Text, shortened with a marker of the omitted length
+    """
+    text = text if isinstance(text, str) else str(text)
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [+{len(text) - limit} chars]"
+
+
+class LLMTraceStore:
+    """Size-capped, gzip-compressed JSONL store for full LLM prompts and responses"""
+
+    def __init__(self, directory: str, max_file_bytes: int, max_total_bytes: int):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self._lock = threading.Lock()
+        self._day = None
+        self._pid = None
+        self._part = 0
+
+    def _current_path(self) -> str:
+        day = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        # Nach einem Fork schreibt das Kind in eigene Dateien
+        pid = os.getpid()
+        if day != self._day or pid != self._pid:
+            self._day, self._pid, self._part = day, pid, 0
+        while True:
+            path = os.path.join(self.directory, f"{_TRACE_FILE_PREFIX}{day}.{pid}.{self._part}{_TRACE_FILE_SUFFIX}")
+            if not os.path.exists(path) or os.path.getsize(path) < self.max_file_bytes:
+                return path
+            self._part += 1
+
+    def _trace_files(self) -> List[Tuple[str, os.stat_result]]:
+        """Trace files of all processes, oldest (last modified) first"""
+        files = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(_TRACE_FILE_PREFIX) and name.endswith(_TRACE_FILE_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                files.append((path, os.stat(path)))
+            except FileNotFoundError:
+                # Von einem anderen Prozess gerade gelöscht
+                continue
+        return sorted(files, key=lambda item: item[1].st_mtime)
+
+    def _enforce_total_size(self, keep: str) -> None:
+        files = self._trace_files()
+        total = sum(stat.st_size for _, stat in files)
+        for path, stat in files:
+            if total <= self.max_total_bytes:
+                break
+            if path == keep:
+                continue
+            total -= stat.st_size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def write(self, entry: Dict) -> None:
+        """
+        Append one trace entry (each append is a separate gzip member)
+
+        Args:
+            entry (Dict): JSON-serializable trace entry
+        """
+        line = (json.dumps(entry, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._current_path()
+            is_new_file = not os.path.exists(path)
+            with gzip.open(path, 'ab') as f:
+                f.write(line)
+            if is_new_file:
+                self._enforce_total_size(keep=path)
+
+
+_trace_store: Optional[LLMTraceStore] = None
+
+
+def _get_trace_store() -> LLMTraceStore:
+    global _trace_store
+    if _trace_store is None:
+        _trace_store = LLMTraceStore(
+            directory=os.path.join(Config.LOG_DIR, 'llm_traces'),
+            max_file_bytes=Config.LLM_TRACE_MAX_FILE_MB * 1024 * 1024,
+            max_total_bytes=Config.LLM_TRACE_MAX_TOTAL_MB * 1024 * 1024
+        )
+    return _trace_store
+
+
+def should_trace() -> bool:
+    """Check if the current request should be written to the trace store (enabled + sampling)"""
+    if not Config.LLM_TRACE_ENABLED:
+        return False
+    return Config.LLM_TRACE_SAMPLE_RATE >= 1.0 or random.random() < Config.LLM_TRACE_SAMPLE_RATE
+
+
+def write_trace(request_id: str, agent: str, request_params: Dict, response_content: Optional[str] = None,
+                error: Optional[str] = None, duration: Optional[float] = None, usage: Optional[Dict] = None) -> None:
+    """
+    Write a full prompt/response pair to the trace store
+
+    Args:
+        request_id (str): Local request ID (also used in the regular log)
+        agent (str): Agent config key
+        request_params (Dict): Parameters sent to chat.completions.create
+        response_content (str): Response content (None on error)
+        error (str): Error message if the request failed
+        duration (float): Duration in seconds
+        usage (Dict): Token usage
+    """
+    try:
+        _get_trace_store().write({
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'request_id': request_id,
+            'agent': agent,
+            'request': request_params,
+            'response': response_content,
+            'error': error,
+            'duration_s': duration,
+            'usage': usage
+        })
+    except Exception as e:
+        # Traces sind Diagnose-Daten - Fehler dürfen den Request nie beeinflussen
+        logger.warning("[%s] Failed to write LLM trace: %s", request_id, e)
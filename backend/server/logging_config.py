@@ -3,27 +3,336 @@ xrisk - Zentrale Logging-Konfiguration
 Author: Manuel Schott
 
 Zentrale Konfiguration für alle Logger mit einheitlicher Rotation und Komprimierung
+
+Nicht-blockierende Pipeline: Logger erhalten nur einen QueueHandler (Emit = Enqueue),
+ein Listener-Thread pro Prozess übernimmt Formatierung, Datei-Schreiben und Rotation.
+Die gzip-Komprimierung rotierter Dateien läuft zusätzlich in einem eigenen Thread,
+damit der Listener nicht blockiert.
+Unter gevent (monkey.patch_all in gunicorn.conf.py) wären threading.Thread und
+queue.Queue nur Greenlets bzw. Greenlet-Queues - Datei-I/O liefe auf dem Hub. Listener
+und Komprimierung laufen dort deshalb auf echten OS-Threads (ungepatchtes _thread),
+die Queue ist eine C-SimpleQueue mit OS-Locks.
+Die Queue ist begrenzt (LOG_QUEUE_SIZE) - bei Überlauf werden Records verworfen
+und gezählt statt den emittierenden Thread bzw. Greenlet zu blockieren.
 """
 
 import os
 import gzip
+import queue
+import _queue
+import atexit
 import shutil
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import threading
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+
+# Werden ohne Config gelesen - logging_config wird auch von gunicorn.conf.py importiert
+LOG_QUEUE_ENABLED = os.environ.get('LOG_QUEUE_ENABLED', 'true').lower() in ('true', '1', 'yes', 'on')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+
+
+def _gevent_patched() -> bool:
+    """Check if the current process runs with gevent monkey-patching (gunicorn gevent workers)"""
+    try:
+        from gevent import monkey
+        return monkey.is_module_patched('threading')
+    except ImportError:
+        return False
+
+
+def _native_thread_api():
+    """Unpatched (start_new_thread, allocate_lock, RLock) of the _thread module"""
+    from gevent import monkey
+    return (
+        monkey.get_original('_thread', 'start_new_thread'),
+        monkey.get_original('_thread', 'allocate_lock'),
+        monkey.get_original('_thread', 'RLock')
+    )
+
+
+def _run_in_background(func, *args):
+    """
+    Run a blocking function outside the calling thread/greenlet
+
+    Unter gevent wäre ein threading.Thread nur ein Greenlet - Datei-I/O würde
+    den Hub blockieren. Dort wird deshalb ein echter OS-Thread gestartet (auch
+    aus dem Listener-Thread heraus, der keinen eigenen Hub hat).
+    """
+    if _gevent_patched():
+        start_new_thread, _, _ = _native_thread_api()
+        start_new_thread(func, args)
+    else:
+        threading.Thread(target=func, args=args, name='log-compress', daemon=True).start()
+
+
+def _compress_file(path):
+    try:
+        with open(path, 'rb') as f_in:
+            with gzip.open(f'{path}.gz', 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        os.remove(path)
+    except Exception as e:
+        import sys
+        print(f"Warning: Could not compress rotated log file {path}: {e}", file=sys.stderr)
 
 
 def gzip_rotator(source, dest):
     """
     Komprimiert rotierte Log-Dateien mit gzip
     
+    Die Datei wird nur umbenannt (schnell), die Komprimierung läuft im Hintergrund.
+    
     Args:
         source: Pfad zur zu komprimierenden Datei
         dest: Ziel-Pfad (ohne .gz Extension)
     """
-    with open(source, 'rb') as f_in:
-        with gzip.open(f'{dest}.gz', 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-    os.remove(source)
+    os.rename(source, dest)
+    _run_in_background(_compress_file, dest)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler for a bounded queue that never blocks
+
+    Jeder Ziel-Logger hat eine eigene Instanz (route = Logger-Name), alle teilen
+    sich die Queue des Prozesses. Der Listener verteilt die Records anhand der
+    Route auf die Datei-/Console-Handler des Loggers - auch für Records von
+    Child-Loggern (z.B. celery.app.trace), die über Propagation ankommen.
+    """
+
+    def __init__(self, pipeline, route: str):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.route = route
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.log_route = self.route
+        return record
+
+    def enqueue(self, record):
+        self.pipeline.ensure_started()
+        try:
+            self.pipeline.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+
+class _NativeQueue:
+    """
+    Bounded, non-blocking-on-put queue for the gevent case
+
+    C-SimpleQueue mit OS-Locks: Greenlets stellen ein, der Listener auf dem
+    OS-Thread wartet blockierend, ohne den Hub zu berühren. Die Grenze wird
+    ohne Lock geprüft - geringe Überschreitung bei Gleichzeitigkeit ist unkritisch.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._queue = _queue.SimpleQueue()
+
+    def put_nowait(self, item):
+        if self.maxsize > 0 and self._queue.qsize() >= self.maxsize:
+            raise queue.Full
+        self._queue.put_nowait(item)
+
+    def get(self, block=True, timeout=None):
+        return self._queue.get(block, timeout)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+
+class _NativeThreadListener(QueueListener):
+    """QueueListener on a real OS thread (under gevent threading.Thread would be a greenlet)"""
+
+    def start(self):
+        start_new_thread, allocate_lock, _ = _native_thread_api()
+        self._done = allocate_lock()
+        self._done.acquire()
+
+        def run():
+            try:
+                self._monitor()
+            finally:
+                self._done.release()
+
+        start_new_thread(run, ())
+
+    def stop(self, timeout: float = 5.0):
+        self.enqueue_sentinel()
+        self._done.acquire(timeout=timeout)
+
+
+class _RoutingHandler(logging.Handler):
+    """Listener-side handler that dispatches records to the handlers of their route"""
+
+    def __init__(self, pipeline):
+        super().__init__()
+        self.pipeline = pipeline
+        self._reported_drops = 0
+
+    def handle(self, record):
+        handlers = self.pipeline.routes.get(getattr(record, 'log_route', record.name), ())
+        self._report_drops(handlers)
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+    def _report_drops(self, handlers):
+        dropped = self.pipeline.dropped
+        if dropped == self._reported_drops or not handlers:
+            return
+        notice = logging.LogRecord(
+            'logging_config', logging.WARNING, __file__, 0,
+            'Log queue full - %d records dropped so far (LOG_QUEUE_SIZE=%d)',
+            (dropped, self.pipeline.queue.maxsize), None
+        )
+        self._reported_drops = dropped
+        for handler in handlers:
+            handler.handle(notice)
+
+
+class LogPipeline:
+    """Per-process queue + listener thread for all file and console log handlers"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.routes = {}
+        self.dropped = 0
+        self.queue_handlers = {}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.native = _gevent_patched()
+        self.queue = _NativeQueue(self.maxsize) if self.native else queue.Queue(maxsize=self.maxsize)
+        self.listener = None
+        for handler in self.queue_handlers.values():
+            handler.queue = self.queue
+
+    def ensure_started(self):
+        """Start the listener lazily (also after fork - threads do not survive fork)"""
+        if self.listener is not None:
+            return
+        with self._lock:
+            if self.listener is None:
+                if self.native != _gevent_patched():
+                    # Monkey-Patching erst nach dem Import (z.B. Celery gevent-Pool) - Queue ist noch leer
+                    self._reset()
+                if self.native:
+                    self._use_native_locks()
+                    listener = _NativeThreadListener(self.queue, _RoutingHandler(self))
+                else:
+                    listener = QueueListener(self.queue, _RoutingHandler(self))
+                listener.start()
+                self.listener = listener
+
+    def _use_native_locks(self):
+        """Handler locks created after patching are gevent locks - the listener thread needs OS locks"""
+        _, _, native_rlock = _native_thread_api()
+        for handlers in self.routes.values():
+            for handler in handlers:
+                handler.lock = native_rlock()
+
+    def after_fork(self):
+        """Forked children (gunicorn preload, celery prefork) get a fresh queue and listener"""
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self._reset()
+
+    def stop(self):
+        """Flush all queued records (called at process exit)"""
+        listener, self.listener = self.listener, None
+        if listener is None:
+            return
+        try:
+            listener.stop()
+        except queue.Full:
+            # Kein Platz für das Stop-Signal - Listener ist Daemon-Thread und endet mit dem Prozess
+            pass
+
+    def attach(self, logger: logging.Logger, handler: logging.Handler):
+        """Route records of `logger` through the queue to `handler`"""
+        route = logger.name
+        handlers = self.routes.setdefault(route, [])
+        # Doppeltes Setup (z.B. on_after_configure) darf keine doppelten Zeilen erzeugen
+        filename = getattr(handler, 'baseFilename', None)
+        if filename and any(getattr(h, 'baseFilename', None) == filename for h in handlers):
+            handler.close()
+            return
+        if self.native and self.listener is not None:
+            _, _, native_rlock = _native_thread_api()
+            handler.lock = native_rlock()
+        handlers.append(handler)
+
+        queue_handler = self.queue_handlers.get(route)
+        if queue_handler is None:
+            queue_handler = DroppingQueueHandler(self, route)
+            self.queue_handlers[route] = queue_handler
+        if queue_handler not in logger.handlers:
+            logger.addHandler(queue_handler)
+
+    def detach_all(self, logger: logging.Logger):
+        """Remove all routed handlers of `logger`"""
+        for handler in self.routes.pop(logger.name, []):
+            handler.close()
+        queue_handler = self.queue_handlers.get(logger.name)
+        if queue_handler in logger.handlers:
+            logger.removeHandler(queue_handler)
+
+
+_pipeline = LogPipeline(LOG_QUEUE_SIZE)
+atexit.register(_pipeline.stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_pipeline.after_fork)
+
+
+def attach_handler(logger: logging.Logger, handler: logging.Handler) -> None:
+    """
+    Attach a handler to a logger via the non-blocking queue pipeline
+    
+    Mit LOG_QUEUE_ENABLED=false wird der Handler wie bisher direkt angehängt.
+    
+    Args:
+        logger: Ziel-Logger
+        handler: Datei- oder Console-Handler (wird im Listener-Thread ausgeführt)
+    """
+    if not LOG_QUEUE_ENABLED:
+        logger.addHandler(handler)
+        return
+    _pipeline.attach(logger, handler)
+
+
+def clear_handlers(logger: logging.Logger) -> None:
+    """Remove all direct and queued handlers of a logger"""
+    _pipeline.detach_all(logger)
+    logger.handlers.clear()
+
+
+def set_handler_level(logger: logging.Logger, level: int) -> None:
+    """Set the level of a logger and all of its direct and queued handlers"""
+    logger.setLevel(level)
+    for handler in list(logger.handlers) + _pipeline.routes.get(logger.name, []):
+        handler.setLevel(level)
+
+
+def get_logging_stats() -> dict:
+    """
+    Get statistics of the logging pipeline of this process
+    
+    Returns:
+        dict: queue size/capacity, dropped records and routed loggers
+    """
+    return {
+        'enabled': LOG_QUEUE_ENABLED,
+        'queue_size': _pipeline.queue.qsize(),
+        'queue_capacity': _pipeline.queue.maxsize,
+        'dropped': _pipeline.dropped,
+        'listener_running': _pipeline.listener is not None,
+        'routes': {route: len(handlers) for route, handlers in _pipeline.routes.items()}
+    }
 
 
 def create_rotating_file_handler(
@@ -101,7 +410,7 @@ def setup_logger(
     
     logger = logging.getLogger(logger_name)
     logger.setLevel(level)
-    logger.handlers.clear()
+    clear_handlers(logger)
     
     # Standard-Formatter
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -111,7 +420,7 @@ def setup_logger(
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(level)
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        attach_handler(logger, console_handler)
     
     # File Handler (mit Rotation)
     if log_dir:
@@ -123,7 +432,7 @@ def setup_logger(
                 level=level,
                 formatter=formatter
             )
-            logger.addHandler(file_handler)
+            attach_handler(logger, file_handler)
             logger.info(f"Logger '{logger_name}' configured with daily rotation: {log_file_path}")
         except Exception as e:
             if console_output:
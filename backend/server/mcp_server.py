@@ -19,6 +19,7 @@ from models import (
     ContextWetter, ContextWetterCurrent, ContextWetterHistorical, ContextWetterRegulatory,
     ContextSicherheit, ContextSicherheitCurrent, ContextSicherheitHistorical, ContextSicherheitRegulatory
 )
+from db_routing import read_replica
 import logging
 import json
 from typing import List, Dict, Any, Optional
@@ -351,6 +352,7 @@ def store_context(table_name: str):
 # ============================================================================
 
 @mcp_bp.route('/context/<table_name>/get/<int:context_id>', methods=['GET'])
+@read_replica
 def get_context(table_name: str, context_id: int):
     """
     Ruft spezifischen Kontext anhand der ID ab
@@ -417,6 +419,7 @@ def get_context(table_name: str, context_id: int):
         return handle_mcp_error(e)
 
 @mcp_bp.route('/context/<table_name>/list', methods=['GET'])
+@read_replica
 def list_contexts(table_name: str):
     """
     Listet alle Kontexte einer Tabelle auf (mit Pagination)
@@ -532,6 +535,7 @@ def list_contexts(table_name: str):
 # ============================================================================
 
 @mcp_bp.route('/context/<table_name>/search', methods=['POST'])
+@read_replica
 def search_context(table_name: str):
     """
     Sucht Kontexte nach Tags
@@ -644,6 +648,7 @@ def search_context(table_name: str):
         return handle_mcp_error(e)
 
 @mcp_bp.route('/context/search', methods=['POST'])
+@read_replica
 def search_all_contexts():
     """
     Sucht in allen Kontext-Tabellen nach Tags
@@ -706,6 +711,7 @@ def search_all_contexts():
 # ============================================================================
 
 @mcp_bp.route('/tags', methods=['GET'])
+@read_replica
 def list_tags():
     """
     Listet alle verfügbaren Tags auf
@@ -933,6 +939,7 @@ def batch_store_context(table_name: str):
 # ============================================================================
 
 @mcp_bp.route('/stats', methods=['GET'])
+@read_replica
 def get_stats():
     """
     Gibt Statistiken über alle Kontext-Tabellen zurück
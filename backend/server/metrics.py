@@ -0,0 +1,220 @@
+"""
+xrisk - Metrics
+Author: Manuel Schott
+
+Low-overhead in-process histograms with a multiprocess-safe Prometheus collector
+
+Jeder Prozess (Gunicorn-Worker, Celery-Worker-Child) hält seine Histogramme im
+Speicher. Ein Hintergrund-Thread schreibt sie alle METRICS_FLUSH_INTERVAL Sekunden
+als JSON-Snapshot nach METRICS_DIR (Standard: LOG_DIR/metrics - von App- und
+Worker-Container gemeinsam genutzt). Der /metrics Endpoint summiert alle Snapshots
+und liefert das Prometheus Text-Format.
+
+Snapshots beendeter Prozesse bleiben bis METRICS_STALE_SECONDS erhalten, damit
+Zähler bei Worker-Neustarts (max_requests, max_tasks_per_child) nicht springen.
+"""
+
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Tuple
+
+from config import Config
+
+logger = logging.getLogger('application')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_HELP = {
+    'xrisk_operation_duration_seconds': 'Duration of instrumented operations (perf_timer)',
+    'xrisk_llm_request_duration_seconds': 'Duration of OpenAI requests incl. retries',
+}
+
+
+class HistogramRegistry:
+    """Thread-safe in-process histograms keyed by metric name and label set"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, Tuple], list] = {}
+
+    def observe(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [Bucket-Zähler (nicht kumulativ, letzter = +Inf), Summe, Anzahl]
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[key] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'series': [
+                    {'name': name, 'labels': dict(labels), 'counts': list(data[0]), 'sum': data[1], 'count': data[2]}
+                    for (name, labels), data in self._series.items()
+                ]
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+_registry = HistogramRegistry()
+
+
+class _SnapshotWriter:
+    """Background thread writing the registry of this process to METRICS_DIR"""
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(Config.METRICS_DIR, f"{socket.gethostname()}-{os.getpid()}.json")
+
+    def ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+                self._thread.start()
+
+    def after_fork(self) -> None:
+        # Threads überleben fork nicht; Werte des Elternprozesses nicht doppelt zählen
+        self._thread = None
+        self._lock = threading.Lock()
+        _registry.reset()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(Config.METRICS_FLUSH_INTERVAL)
+            self.write()
+
+    def write(self) -> None:
+        snapshot = _registry.snapshot()
+        if not snapshot['series']:
+            return
+        try:
+            os.makedirs(Config.METRICS_DIR, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"[Metrics] Could not write snapshot: {e}")
+
+
+_writer = _SnapshotWriter()
+atexit.register(_writer.write)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_writer.after_fork)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """
+    Record a value (seconds) in a histogram
+
+    Args:
+        name (str): Metric name (e.g. 'xrisk_operation_duration_seconds')
+        value (float): Observed value in seconds
+        **labels: Label values (keep cardinality low - no UUIDs)
+    """
+    if not Config.METRICS_ENABLED:
+        return
+    _registry.observe(name, value, labels)
+    _writer.ensure_started()
+
+
+def flush_metrics() -> None:
+    """Write the snapshot of this process immediately (e.g. before a worker child exits)"""
+    _writer.write()
+
+
+def _load_snapshots() -> list:
+    """Load all snapshots, deleting those of processes that stopped long ago"""
+    snapshots = []
+    if not os.path.isdir(Config.METRICS_DIR):
+        return snapshots
+    now = time.time()
+    for name in os.listdir(Config.METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(Config.METRICS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > Config.METRICS_STALE_SECONDS:
+                os.remove(path)
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # Datei wird gerade ersetzt oder wurde bereits entfernt
+            continue
+    return snapshots
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    parts = []
+    for key, value in sorted(labels.items()):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def render_prometheus() -> str:
+    """
+    Aggregate the snapshots of all processes into Prometheus text format
+
+    Returns:
+        str: Exposition text (text/plain; version=0.0.4)
+    """
+    # Eigenen Prozess aktuell halten, damit ein Scrape sofort die neuesten Werte sieht
+    _writer.write()
+
+    merged: Dict[Tuple[str, Tuple], dict] = {}
+    for snapshot in _load_snapshots():
+        buckets = tuple(snapshot.get('buckets', ()))
+        for series in snapshot.get('series', []):
+            key = (series['name'], tuple(sorted(series['labels'].items())))
+            entry = merged.get(key)
+            if entry is None:
+                entry = {'buckets': buckets, 'counts': [0] * len(series['counts']), 'sum': 0.0, 'count': 0}
+                merged[key] = entry
+            if entry['buckets'] != buckets:
+                # Bucket-Konfiguration geändert - alte Snapshots nicht mischen
+                continue
+            entry['counts'] = [a + b for a, b in zip(entry['counts'], series['counts'])]
+            entry['sum'] += series['sum']
+            entry['count'] += series['count']
+
+    lines = []
+    seen_names = set()
+    for (name, labels), entry in sorted(merged.items()):
+        if name not in seen_names:
+            seen_names.add(name)
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+        label_dict = dict(labels)
+        cumulative = 0
+        for bound, count in zip(list(entry['buckets']) + ['+Inf'], entry['counts']):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels({**label_dict, 'le': str(bound)})} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(label_dict)} {entry['sum']}")
+        lines.append(f"{name}_count{_format_labels(label_dict)} {entry['count']}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,498 @@
+"""
+xrisk - Schema Migrations
+Author: Manuel Schott
+
+Versioned schema migrations (run from create_app() and database_setup.py)
+
+Jede Migration hat eine Versionsnummer; angewendete Versionen stehen in der
+Tabelle schema_version. Ist die Datenbank aktuell, kostet der Start genau eine
+Abfrage (SELECT max(version)) - kein Inspector, kein create_all().
+
+Ist die Datenbank veraltet, migriert genau ein Prozess: Die übrigen Gunicorn-/
+Celery-Prozesse warten auf den Advisory Lock und finden danach die aktuelle
+Version vor.
+
+- Transaktionale Migrationen laufen zusammen mit ihrem schema_version-Eintrag
+  in einer Transaktion, mit MIGRATION_LOCK_TIMEOUT: Statt hinter langen Abfragen
+  zu warten (und dabei alle Zugriffe auf die Tabelle zu blockieren), schlagen sie
+  fehl und werden beim nächsten Start wiederholt.
+- concurrent=True: CREATE INDEX CONCURRENTLY blockiert keine Schreibzugriffe,
+  darf aber nicht in einer Transaktion laufen (AUTOCOMMIT). Ein abgebrochener
+  Build hinterlässt einen ungültigen Index, der vor dem nächsten Versuch entfernt wird.
+- batched=True: Die Migration steuert ihre Transaktionen selbst - kurze DDL-Schritte
+  mit lock_timeout (bei Lock-Konflikten mehrfach versucht) und Backfills in Batches
+  von MIGRATION_BATCH_SIZE Zeilen statt eines Tabellen-Rewrites unter ACCESS EXCLUSIVE.
+
+Alle Migrationen sind idempotent (Datenbanken von vor schema_version durchlaufen
+sie einmal als No-op). Neue Tabellen legt create_all() an, das vor ausstehenden
+Migrationen läuft - ein neues Model braucht deshalb eine (ggf. leere) Migration.
+"""
+
+import logging
+import time
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateIndex
+
+from config import Config
+
+logger = logging.getLogger('application')
+
+# pg_advisory_lock-Schlüssel für Schema-Migrationen (beliebig, aber fest)
+MIGRATION_LOCK_KEY = 727_001
+
+# Sekunden zwischen zwei Versuchen, den Migrations-Lock zu bekommen
+MIGRATION_LOCK_POLL_INTERVAL = 2.0
+
+# Zeilen pro Backfill-Transaktion (batched-Migrationen)
+MIGRATION_BATCH_SIZE = 5000
+
+# Versuche für kurze DDL-Schritte, deren Lock nicht innerhalb von MIGRATION_LOCK_TIMEOUT frei wird
+MIGRATION_LOCK_ATTEMPTS = 5
+
+# SQLSTATE lock_not_available (lock_timeout abgelaufen)
+_LOCK_NOT_AVAILABLE = '55P03'
+
+
+class Migration:
+    """One schema migration step"""
+
+    def __init__(self, version: int, description: str, apply, concurrent: bool = False, batched: bool = False):
+        self.version = version
+        self.description = description
+        self.apply = apply
+        self.concurrent = concurrent
+        self.batched = batched
+
+
+def _columns(conn, table: str) -> list:
+    return [column['name'] for column in inspect(conn).get_columns(table)]
+
+
+def _add_processing_since(conn):
+    if 'processing_since' not in _columns(conn, 'risk_assessments'):
+        conn.execute(text('ALTER TABLE risk_assessments ADD COLUMN processing_since TIMESTAMP'))
+
+
+def _add_retry_columns(conn):
+    if 'retry_count' not in _columns(conn, 'risk_assessments'):
+        conn.execute(text('''
+            ALTER TABLE risk_assessments
+            ADD COLUMN retry_count INTEGER DEFAULT 0 NOT NULL,
+            ADD COLUMN failed_at TIMESTAMP,
+            ADD COLUMN failed_reason TEXT,
+            ADD COLUMN admin_notified BOOLEAN DEFAULT FALSE NOT NULL
+        '''))
+
+
+def _rename_inquery(conn):
+    columns = _columns(conn, 'risk_assessments')
+    if 'inquery' in columns and 'inquiry' not in columns:
+        conn.execute(text('ALTER TABLE risk_assessments RENAME COLUMN inquery TO inquiry'))
+
+
+def _update_legacy_statuses(conn):
+    conn.execute(text("UPDATE risk_assessments SET status='inquiry_awaiting_response' WHERE status='inquery'"))
+
+
+def _add_user_token_columns(conn):
+    # Die Tabelle selbst legt create_all() an; ältere users-Tabellen bekommen die Token-Felder
+    user_columns = _columns(conn, 'users')
+    if 'email_verification_token' not in user_columns:
+        conn.execute(text('''
+            ALTER TABLE users
+            ADD COLUMN email_verification_token VARCHAR(100) UNIQUE,
+            ADD COLUMN email_verification_token_expires TIMESTAMP
+        '''))
+    if 'password_reset_token' not in user_columns:
+        conn.execute(text('''
+            ALTER TABLE users
+            ADD COLUMN password_reset_token VARCHAR(100) UNIQUE,
+            ADD COLUMN password_reset_token_expires TIMESTAMP
+        '''))
+    if 'email_verification_token_hash' not in user_columns:
+        conn.execute(text('ALTER TABLE users ADD COLUMN email_verification_token_hash VARCHAR(64)'))
+        conn.execute(text('''
+            CREATE INDEX IF NOT EXISTS idx_users_email_verification_token_hash
+            ON users(email_verification_token_hash)
+        '''))
+
+
+def _add_lease_columns(conn):
+    if 'lease_token' not in _columns(conn, 'risk_assessments'):
+        conn.execute(text('''
+            ALTER TABLE risk_assessments
+            ADD COLUMN lease_owner VARCHAR(100),
+            ADD COLUMN lease_token BIGINT DEFAULT 0 NOT NULL,
+            ADD COLUMN lease_expires_at TIMESTAMP
+        '''))
+
+
+def _create_index_concurrently(conn, index) -> None:
+    """
+    Create a model index with CREATE INDEX CONCURRENTLY (AUTOCOMMIT connection)
+
+    Args:
+        conn: Connection in AUTOCOMMIT mode
+        index: sqlalchemy.Index of a model table
+    """
+    valid = conn.execute(text('''
+        SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name
+    '''), {'name': index.name}).scalar()
+    if valid:
+        return
+    if valid is False:
+        # Überbleibsel eines abgebrochenen CONCURRENTLY-Builds
+        logger.warning(f"Dropping invalid index {index.name} before rebuilding it")
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index.name}'))
+
+    create_index = str(CreateIndex(index).compile(dialect=conn.dialect))
+    create_index = create_index.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS', 1)
+    conn.execute(text(create_index))
+    logger.info(f"Index {index.name} created")
+
+
+def _create_retry_indexes(conn):
+    from models import RiskAssessment
+    for index in RiskAssessment.__table__.indexes:
+        if index.name in ('ix_risk_assessments_retry_failed', 'ix_risk_assessments_retry_pending'):
+            _create_index_concurrently(conn, index)
+
+
+def _set_toast_tuple_target(conn):
+    # Wirkt auf neu geschriebene Zeilen; bestehende werden beim nächsten Update umgelagert
+    reloptions = conn.execute(text(
+        "SELECT reloptions FROM pg_class WHERE relname = 'risk_assessments'"
+    )).scalar() or []
+    if not any(option.startswith('toast_tuple_target=') for option in reloptions):
+        conn.execute(text('ALTER TABLE risk_assessments SET (toast_tuple_target = 256)'))
+
+
+def _short_ddl(conn, statements) -> None:
+    """
+    Run DDL in a short transaction with lock_timeout, retrying when the lock is not granted
+
+    Args:
+        conn: Connection without an open transaction
+        statements: Callable executing the statements on conn
+    """
+    for attempt in range(1, MIGRATION_LOCK_ATTEMPTS + 1):
+        try:
+            with conn.begin():
+                conn.execute(text(f"SET LOCAL lock_timeout = {int(Config.MIGRATION_LOCK_TIMEOUT)}"))
+                statements()
+            return
+        except OperationalError as e:
+            if getattr(e.orig, 'pgcode', None) != _LOCK_NOT_AVAILABLE or attempt == MIGRATION_LOCK_ATTEMPTS:
+                raise
+            logger.warning(f"Lock not granted within {Config.MIGRATION_LOCK_TIMEOUT} ms (attempt {attempt}) - retrying")
+            time.sleep(attempt)
+
+
+def _backfill(conn, assignments: str) -> None:
+    """
+    UPDATE risk_assessments SET <assignments> in id batches (one short transaction each)
+
+    Args:
+        conn: Connection without an open transaction
+        assignments (str): SET clause
+    """
+    with conn.begin():
+        bounds = conn.execute(text('SELECT min(id), max(id) FROM risk_assessments')).first()
+    if bounds[0] is None:
+        return
+    first_id, last_id = bounds
+    for batch_start in range(first_id, last_id + 1, MIGRATION_BATCH_SIZE):
+        with conn.begin():
+            conn.execute(text(f'UPDATE risk_assessments SET {assignments} WHERE id >= :start AND id < :end'),
+                         {'start': batch_start, 'end': batch_start + MIGRATION_BATCH_SIZE})
+    logger.info(f"Backfilled risk_assessments up to id {last_id}")
+
+
+def _install_row_trigger(conn, name: str, body: str) -> None:
+    """(Re)create a BEFORE INSERT OR UPDATE row trigger on risk_assessments"""
+    conn.exec_driver_sql(
+        f"CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$ BEGIN {body} RETURN NEW; END $$ LANGUAGE plpgsql"
+    )
+    conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name} ON risk_assessments")
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER {name} BEFORE INSERT OR UPDATE ON risk_assessments FOR EACH ROW EXECUTE FUNCTION {name}()"
+    )
+
+
+def _convert_payloads_to_jsonb(conn):
+    """
+    JSONB payloads and the derived analysis/report columns - without a table rewrite
+
+    ALTER COLUMN ... TYPE JSONB und ADD COLUMN ... GENERATED ... STORED schreiben die
+    ganze Tabelle unter ACCESS EXCLUSIVE neu. Stattdessen:
+    1. JSONB-Schattenspalten ({name}_jsonb) mit Sync-Trigger, Backfill in Batches,
+       dann Tausch (DROP/RENAME, nur Katalog) in einer kurzen Transaktion.
+    2. Abgeleitete Spalten als normale Spalten, gepflegt vom Trigger
+       risk_assessments_derived_fields (dieselben Ausdrücke wie Computed im Model),
+       Backfill in Batches (_sync_derived_columns).
+    Neue Datenbanken bekommen über create_all() echte Generated Columns; das ORM
+    behandelt beide gleich (Computed-Spalten werden nie geschrieben).
+    """
+    payload_columns = ('inquiry', 'research_current', 'research_historical',
+                       'research_regulatory', 'analysis', 'report')
+    with conn.begin():
+        json_columns = [row[0] for row in conn.execute(text('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = 'risk_assessments' AND data_type = 'json'
+        ''')) if row[0] in payload_columns]
+        columns = _columns(conn, 'risk_assessments')
+
+    if json_columns:
+        shadows = {name: f'{name}_jsonb' for name in json_columns}
+        missing_shadows = [shadow for shadow in shadows.values() if shadow not in columns]
+
+        def add_shadows():
+            if missing_shadows:
+                conn.execute(text('ALTER TABLE risk_assessments ' + ', '.join(
+                    f'ADD COLUMN {shadow} JSONB' for shadow in missing_shadows
+                )))
+            # Schreibzugriffe während des Backfills halten die Schattenspalten aktuell
+            _install_row_trigger(conn, 'risk_assessments_jsonb_sync', ' '.join(
+                f'NEW.{shadow} := NEW.{name}::jsonb;' for name, shadow in shadows.items()
+            ))
+
+        def swap():
+            conn.exec_driver_sql('DROP TRIGGER IF EXISTS risk_assessments_jsonb_sync ON risk_assessments')
+            conn.exec_driver_sql('DROP FUNCTION IF EXISTS risk_assessments_jsonb_sync()')
+            conn.execute(text('ALTER TABLE risk_assessments ' + ', '.join(
+                f'DROP COLUMN {name}' for name in shadows
+            )))
+            for name, shadow in shadows.items():
+                conn.execute(text(f'ALTER TABLE risk_assessments RENAME COLUMN {shadow} TO {name}'))
+
+        _short_ddl(conn, add_shadows)
+        _backfill(conn, ', '.join(f'{shadow} = {name}::jsonb' for name, shadow in shadows.items()))
+        _short_ddl(conn, swap)
+        logger.info(f"Converted {', '.join(json_columns)} to JSONB")
+
+    _sync_derived_columns(conn)
+
+
+def _sync_derived_columns(conn, obsolete: tuple = ()) -> None:
+    """
+    Bring the derived columns of risk_assessments in line with the Computed columns of the model
+
+    Fehlende Spalten werden als normale Spalten angelegt und - zusammen mit den bereits
+    per Trigger gepflegten - von risk_assessments_derived_fields berechnet (kein Rewrite).
+    Echte Generated Columns (aus create_all) bleiben unverändert.
+
+    Args:
+        conn: Connection without an open transaction
+        obsolete (tuple): Derived columns the model no longer has (dropped, catalog only)
+    """
+    from models import RiskAssessment
+
+    with conn.begin():
+        generated = {row[0]: row[1] for row in conn.execute(text('''
+            SELECT column_name, is_generated FROM information_schema.columns
+            WHERE table_name = 'risk_assessments'
+        '''))}
+    computed = [column for column in RiskAssessment.__table__.columns if column.computed is not None]
+    missing = [column for column in computed if column.name not in generated]
+    maintained = [column for column in computed if generated.get(column.name, 'NEVER') == 'NEVER']
+    dropped = [name for name in obsolete if name in generated]
+    if not missing and not dropped:
+        return
+
+    def alter():
+        conn.execute(text('ALTER TABLE risk_assessments ' + ', '.join(
+            [f'DROP COLUMN {name}' for name in dropped] +
+            [f'ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}' for column in missing]
+        )))
+        if maintained:
+            _install_row_trigger(conn, 'risk_assessments_derived_fields', (
+                f"SELECT {', '.join(str(column.computed.sqltext) for column in maintained)} "
+                f"INTO {', '.join(f'NEW.{column.name}' for column in maintained)} "
+                f"FROM (SELECT NEW.*) AS risk;"
+            ))
+        else:
+            conn.exec_driver_sql('DROP TRIGGER IF EXISTS risk_assessments_derived_fields ON risk_assessments')
+            conn.exec_driver_sql('DROP FUNCTION IF EXISTS risk_assessments_derived_fields()')
+
+    _short_ddl(conn, alter)
+    if dropped:
+        logger.info(f"Dropped derived columns {', '.join(dropped)}")
+    if missing:
+        _backfill(conn, ', '.join(f'{column.name} = {column.computed.sqltext}' for column in missing))
+        logger.info(f"Added derived columns {', '.join(column.name for column in missing)}")
+
+
+def _replace_report_title(conn):
+    # report ->> 'title' ist praktisch immer NULL - der angezeigte Titel steht in analysis.title
+    _sync_derived_columns(conn, obsolete=('report_title',))
+
+
+def _create_risk_indexes(conn):
+    # Alle in RiskAssessment.__table_args__ deklarierten Indizes (siehe deploy/check_query_plans.py)
+    from models import RiskAssessment
+    for index in RiskAssessment.__table__.indexes:
+        _create_index_concurrently(conn, index)
+
+
+MIGRATIONS = [
+    Migration(1, 'risk_assessments.processing_since', _add_processing_since),
+    Migration(2, 'retry mechanism columns', _add_retry_columns),
+    Migration(3, 'rename inquery -> inquiry', _rename_inquery),
+    Migration(4, "legacy status 'inquery' -> 'inquiry_awaiting_response'", _update_legacy_statuses),
+    Migration(5, 'users token columns', _add_user_token_columns),
+    Migration(6, 'workflow lease columns', _add_lease_columns),
+    Migration(7, 'partial indexes for the retry scans', _create_retry_indexes, concurrent=True),
+    Migration(8, 'toast_tuple_target for risk payloads', _set_toast_tuple_target),
+    Migration(9, 'JSONB payloads and generated analysis/report columns', _convert_payloads_to_jsonb, batched=True),
+    Migration(10, 'risk_assessments access path indexes', _create_risk_indexes, concurrent=True),
+    Migration(11, 'analysis_title replaces report_title', _replace_report_title, batched=True),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_schema_version(conn) -> int:
+    """
+    Get the applied schema version (the single query of the fast path)
+
+    Returns:
+        int: Highest applied version, 0 if schema_version does not exist yet
+    """
+    try:
+        return conn.execute(text('SELECT max(version) FROM schema_version')).scalar() or 0
+    except ProgrammingError:
+        conn.rollback()
+        return 0
+
+
+def _apply(conn, migration: Migration) -> None:
+    record = text('INSERT INTO schema_version (version, description) VALUES (:version, :description)')
+    params = {'version': migration.version, 'description': migration.description}
+
+    if migration.batched:
+        migration.apply(conn)
+        with conn.begin():
+            conn.execute(record, params)
+        return
+
+    if migration.concurrent:
+        conn.execution_options(isolation_level='AUTOCOMMIT')
+        try:
+            migration.apply(conn)
+            conn.execute(record, params)
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.execution_options(isolation_level=conn.default_isolation_level)
+        return
+
+    with conn.begin():
+        conn.execute(text(f"SET LOCAL lock_timeout = {int(Config.MIGRATION_LOCK_TIMEOUT)}"))
+        migration.apply(conn)
+        conn.execute(record, params)
+
+
+def run_migrations(db) -> int:
+    """
+    Bring the database schema to LATEST_VERSION (requires an app context)
+
+    Args:
+        db: Flask-SQLAlchemy instance
+
+    Returns:
+        int: Schema version after the run
+
+    Raises:
+        Exception: If a migration fails (applied versions stay recorded)
+    """
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        # Lokale Entwicklung ohne Postgres: nur Tabellen anlegen
+        db.create_all()
+        return LATEST_VERSION
+
+    with engine.connect() as conn:
+        version = current_schema_version(conn)
+        conn.rollback()
+    if version >= LATEST_VERSION:
+        logger.info(f"Database schema is current (version {version})")
+        return version
+
+    direct_engine = _direct_engine()
+    try:
+        return _migrate(db, direct_engine or engine, version)
+    finally:
+        if direct_engine is not None:
+            direct_engine.dispose()
+
+
+def _direct_engine():
+    """
+    Engine with a direct Postgres connection for migrations behind PgBouncer
+
+    Advisory lock, SET statement_timeout and CREATE INDEX CONCURRENTLY need a session,
+    which PgBouncer in transaction mode does not provide.
+
+    Returns:
+        Engine for DATABASE_DIRECT_URL or None (use the app engine)
+    """
+    if not Config.DATABASE_DIRECT_URL:
+        if Config.DB_PGBOUNCER:
+            logger.warning("DB_PGBOUNCER is set but DATABASE_DIRECT_URL is not - migrating through PgBouncer")
+        return None
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+    return create_engine(Config.DATABASE_DIRECT_URL, poolclass=NullPool, connect_args={'connect_timeout': 10})
+
+
+def _migrate(db, engine, version: int) -> int:
+    """Run the pending migrations under the advisory lock"""
+    with engine.connect() as conn:
+        # Migrationen dürfen länger dauern als das statement_timeout des Pools
+        conn.execute(text('SET statement_timeout = 0'))
+        # Nicht in pg_advisory_lock blockieren: der wartende SELECT hält einen Snapshot,
+        # auf den CREATE INDEX CONCURRENTLY des Lock-Inhabers warten würde (Deadlock).
+        # pg_try_advisory_lock kehrt sofort zurück, geschlafen wird außerhalb der Transaktion.
+        while True:
+            acquired = conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY}).scalar()
+            conn.commit()
+            if acquired:
+                break
+            logger.info("Waiting for the schema migration lock...")
+            time.sleep(MIGRATION_LOCK_POLL_INTERVAL)
+        try:
+            # Ein anderer Prozess kann während des Wartens migriert haben
+            version = current_schema_version(conn)
+            conn.commit()
+            if version >= LATEST_VERSION:
+                logger.info(f"Database schema was migrated by another process (version {version})")
+                return version
+
+            db.metadata.create_all(bind=conn)
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+                )
+            '''))
+            conn.commit()
+
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+                logger.info(f"Running migration {migration.version}: {migration.description}...")
+                start_time = time.perf_counter()
+                _apply(conn, migration)
+                version = migration.version
+                logger.info(f"Migration {migration.version} completed in {time.perf_counter() - start_time:.1f}s")
+            return version
+        finally:
+            if conn.in_transaction():
+                conn.rollback()
+            conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            conn.execute(text('RESET statement_timeout'))
+            conn.commit()
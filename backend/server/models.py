@@ -9,19 +9,22 @@ Core database models for risk assessment system
 # prevent pyright from reporting missing imports by context_models star import
 
 from flask_sqlalchemy import SQLAlchemy
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 import uuid
 import logging
 import json
 import secrets
 import hashlib
-from sqlalchemy import event
 from sqlalchemy.ext.mutable import MutableDict, MutableList
-from sqlalchemy.engine import Engine
+from sqlalchemy.orm import deferred, undefer_group
+from sqlalchemy.dialects.postgresql import JSONB
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from config import Config
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 logger = logging.getLogger('celery')
 
 from context_models import *  # noqa: F403, E402 - full import required; import after db to avoid circular imports
@@ -182,9 +185,90 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.email}>'
 
+# Risk-Payloads: JSONB in PostgreSQL (abfragbar, GIN-indizierbar), JSON als Fallback (SQLite für Tests)
+JSONPayload = db.JSON().with_variant(JSONB(), 'postgresql')
+_IS_POSTGRES = (Config.SQLALCHEMY_DATABASE_URI or '').startswith('postgresql')
+
+
+def _json_number_column(column, key):
+    """Stored generated column with a numeric payload field (NULL if the field is not a number)"""
+    if _IS_POSTGRES:
+        expression = (f"CASE WHEN jsonb_typeof({column} -> '{key}') = 'number' "
+                      f"THEN ({column} ->> '{key}')::double precision END")
+    else:
+        expression = (f"CASE WHEN json_type({column}, '$.{key}') IN ('integer', 'real') "
+                      f"THEN json_extract({column}, '$.{key}') END")
+    return db.Column(db.Float, db.Computed(expression, persisted=True), nullable=True)
+
+
+def _json_text_column(column, key):
+    """Stored generated column with a text payload field"""
+    if _IS_POSTGRES:
+        expression = f"{column} ->> '{key}'"
+    else:
+        expression = f"json_extract({column}, '$.{key}')"
+    return db.Column(db.Text, db.Computed(expression, persisted=True), nullable=True)
+
+
+class StageTransaction:
+    """Pending unit of work of RiskAssessment.stage_transaction"""
+    
+    def __init__(self):
+        self._callbacks = []
+    
+    def after_commit(self, callback, *args, **kwargs):
+        """Run callback(*args, **kwargs) once the stage has been committed (skipped on rollback)"""
+        self._callbacks.append((callback, args, kwargs))
+    
+    def run_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for callback, args, kwargs in callbacks:
+            callback(*args, **kwargs)
+
 class RiskAssessment(db.Model):
     __tablename__ = 'risk_assessments'
     
+    # Status, aus denen retry_failed_workflows einen Workflow startet oder fortsetzt
+    RETRY_SCAN_STATUSES = ('created', 'validated', 'inquired', 'researched', 'analyzed')
+    
+    # Partielle Indizes für retry_failed_workflows - enthalten nur die wenigen Kandidaten,
+    # nicht die Millionen abgeschlossener Risks (Migration 7 in migrations.py)
+    __table_args__ = (
+        db.Index(
+            'ix_risk_assessments_retry_failed', 'id',
+            postgresql_where=db.text("failed_at IS NOT NULL AND admin_notified = false")
+        ),
+        db.Index(
+            'ix_risk_assessments_retry_pending', 'id',
+            postgresql_where=db.text(
+                "failed_at IS NULL AND processing_since IS NULL "
+                "AND status IN ('created', 'validated', 'inquired', 'researched', 'analyzed')"
+            )
+        ),
+        # Zugriffspfade (Migration 10; get_by_uuids nutzt den Unique-Index auf risk_uuid):
+        # eigene Risks nach Erstellung sortiert, Marktplatz-Standardsortierung, Abfragen nach Status
+        db.Index('ix_risk_assessments_user_created', 'user_uuid', 'creation_date'),
+        db.Index(
+            'ix_risk_assessments_available_created', 'creation_date',
+            postgresql_where=db.text("status = 'available'")
+        ),
+        db.Index('ix_risk_assessments_status_created', 'status', 'creation_date'),
+        # Marktplatz: freigegebene Risks nach Kennzahlen filtern/sortieren (Migration 9/10)
+        db.Index(
+            'ix_risk_assessments_available_probability', 'analysis_probability',
+            postgresql_where=db.text("status = 'available'")
+        ),
+        db.Index(
+            'ix_risk_assessments_available_expected_damage', 'analysis_expected_damage',
+            postgresql_where=db.text("status = 'available'")
+        ),
+        # Containment-Abfragen auf Analyse-Felder (analysis @> '{...}') für Dashboards
+        db.Index(
+            'ix_risk_assessments_analysis_gin', 'analysis',
+            postgresql_using='gin', postgresql_ops={'analysis': 'jsonb_path_ops'}
+        ),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     creation_date = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     last_updated = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
@@ -196,17 +280,30 @@ class RiskAssessment(db.Model):
     end_date = db.Column(db.Date, nullable=True)
     insurance_value = db.Column(db.Float, nullable=True)
     risk_type = db.Column(db.String(100), nullable=True)
-    inquiry = db.Column(MutableList.as_mutable(db.JSON), nullable=True)
-    research_current = db.Column(MutableDict.as_mutable(db.JSON), nullable=True)
-    research_historical = db.Column(MutableDict.as_mutable(db.JSON), nullable=True)
-    research_regulatory = db.Column(MutableDict.as_mutable(db.JSON), nullable=True)
-    analysis = db.Column(MutableDict.as_mutable(db.JSON), nullable=True)
-    report = db.Column(MutableDict.as_mutable(db.JSON), nullable=True)
+    # Payloads werden erst beim Zugriff geladen (ein SELECT pro Gruppe), damit Status-Abfragen,
+    # Lease und Retry-Scans schmale Zeilen lesen; in Postgres liegen sie außerhalb der Zeile
+    # im TOAST-Speicher (toast_tuple_target, Migration 8) und werden bei Updates nicht mitkopiert
+    inquiry = deferred(db.Column(MutableList.as_mutable(JSONPayload), nullable=True), group='inquiry')
+    research_current = deferred(db.Column(MutableDict.as_mutable(JSONPayload), nullable=True), group='payload')
+    research_historical = deferred(db.Column(MutableDict.as_mutable(JSONPayload), nullable=True), group='payload')
+    research_regulatory = deferred(db.Column(MutableDict.as_mutable(JSONPayload), nullable=True), group='payload')
+    analysis = deferred(db.Column(MutableDict.as_mutable(JSONPayload), nullable=True), group='payload')
+    report = deferred(db.Column(MutableDict.as_mutable(JSONPayload), nullable=True), group='payload')
+    # Von der Datenbank aus analysis berechnet (nur lesen) - für Filter, Sortierung und Indizes
+    analysis_probability = _json_number_column('analysis', 'probability_percentage')
+    analysis_expected_damage = _json_number_column('analysis', 'expected_damage')
+    analysis_max_damage_pml = _json_number_column('analysis', 'max_damage_pml')
+    # Titel setzt der AnalysisAgent (analysis.title) - der Report hat kein eigenes Titelfeld
+    analysis_title = _json_text_column('analysis', 'title')
     processing_since = db.Column(db.DateTime, nullable=True)
     retry_count = db.Column(db.Integer, default=0, nullable=False)
     failed_at = db.Column(db.DateTime, nullable=True)
     failed_reason = db.Column(db.Text, nullable=True)
     admin_notified = db.Column(db.Boolean, default=False, nullable=False)
+    # Workflow-Lease (workflow_lease.py): laufender Task, Fencing-Token, Ablaufzeit
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_token = db.Column(db.BigInteger, default=0, nullable=False)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
     
     def __init__(self, user_uuid, initial_prompt, start_date=None, end_date=None, insurance_value=None):
         self.user_uuid = user_uuid
@@ -242,10 +339,52 @@ class RiskAssessment(db.Model):
             'admin_notified': self.admin_notified
         }
     
+    @contextmanager
+    def stage_transaction(self):
+        """
+        Unit of work for one workflow stage
+        
+        Inside the block the helpers below (update_status, mark_as_failed,
+        reset_retry_state, ...) only stage their changes; field updates, status
+        transition and lock handling are written with a single commit at the end.
+        Callbacks registered with after_commit (e.g. event publishing) run only
+        once that commit has succeeded. Nested blocks join the outer transaction.
+        
+        Usage:
+            with risk.stage_transaction() as stage:
+                risk.analysis = analysis_result
+                risk.update_status('analyzed')
+                stage.after_commit(update_and_publish, task, meta={...})
+        
+        Yields:
+            StageTransaction: Collects the after-commit callbacks
+        """
+        current = getattr(self, '_stage', None)
+        if current is not None:
+            yield current
+            return
+        
+        stage = StageTransaction()
+        self._stage = stage
+        try:
+            yield stage
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        finally:
+            self._stage = None
+        stage.run_callbacks()
+    
+    def _commit(self):
+        """Commit unless a stage_transaction is collecting the changes"""
+        if getattr(self, '_stage', None) is None:
+            db.session.commit()
+    
     def update_status(self, new_status):
         self.status = new_status
         self.last_updated = datetime.now(timezone.utc)
-        db.session.commit()
+        self._commit()
     
     def is_processing(self):
         """
@@ -284,12 +423,12 @@ class RiskAssessment(db.Model):
     def set_processing_lock(self):
         """Set processing lock to prevent duplicate requests"""
         self.processing_since = datetime.now(timezone.utc)
-        db.session.commit()
+        self._commit()
     
     def clear_processing_lock(self):
         """Clear processing lock after completion or error"""
         self.processing_since = None
-        db.session.commit()
+        self._commit()
     
     def get_processing_elapsed_seconds(self):
         """Get elapsed seconds since processing started"""
@@ -306,8 +445,8 @@ class RiskAssessment(db.Model):
         """Mark risk as failed for retry mechanism"""
         self.failed_at = datetime.now(timezone.utc)
         self.failed_reason = reason
-        self.clear_processing_lock()
-        db.session.commit()
+        self.processing_since = None
+        self._commit()
     
     def can_retry(self, max_retries=3):
         """Check if workflow can be retried"""
@@ -316,13 +455,13 @@ class RiskAssessment(db.Model):
     def increment_retry(self):
         """Increment retry counter"""
         self.retry_count += 1
-        db.session.commit()
+        self._commit()
     
     def clear_failed_status(self):
         """Clear failed status after successful retry"""
         self.failed_at = None
         self.failed_reason = None
-        db.session.commit()
+        self._commit()
     
     def reset_retry_state(self):
         """Reset all retry-related fields after successful completion"""
@@ -330,35 +469,95 @@ class RiskAssessment(db.Model):
         self.failed_at = None
         self.failed_reason = None
         self.admin_notified = False
-        db.session.commit()
+        self._commit()
+
+    @classmethod
+    def query_with_payloads(cls):
+        """Query that loads the deferred payload columns with the row (for to_dict over many risks)"""
+        return cls.query.options(undefer_group('inquiry'), undefer_group('payload'))
 
     @classmethod
     def get_by_uuids(cls, user_uuid, risk_uuid):
         """Fetch a single risk by user and risk UUIDs"""
         return cls.query.filter_by(user_uuid=user_uuid, risk_uuid=risk_uuid).first()
 
+    @classmethod
+    def get_accessible(cls, risk_uuid, user_uuids, refresh=False):
+        """
+        Fetch a single risk owned by any of the given users in one query
+        (risk_uuid is unique, so at most one row matches)
+
+        Args:
+            risk_uuid (str): Risk UUID
+            user_uuids (list): Accepted owners (e.g. logged-in user and DEFAULT_ANONYMOUS_USER_UUID)
+            refresh (bool): Overwrite the attributes of an instance already in the session
+
+        Returns:
+            RiskAssessment or None
+        """
+        query = cls.query.filter(cls.risk_uuid == risk_uuid, cls.user_uuid.in_(list(user_uuids)))
+        if refresh:
+            query = query.execution_options(populate_existing=True)
+        return query.first()
+
     @classmethod
     def get_by_status(cls, status):
-        """Fetch all risks with a given status"""
-        return cls.query.filter_by(status=status).all()
+        """Fetch all risks with a given status (newest first, index ix_risk_assessments_status_created)"""
+        return cls.query.filter_by(status=status).order_by(cls.creation_date.desc()).all()
+
+    @classmethod
+    def lease_free(cls, now):
+        """Filter for risks whose workflow lease no running task holds"""
+        return db.or_(cls.lease_expires_at.is_(None), cls.lease_expires_at < now)
 
     @classmethod
-    def get_failed_risks(cls, max_retries=3):
+    def pending_risks_query(cls, now):
         """
-        Get all failed risks that can be retried
+        Query for risks the retry scan starts or auto-continues
+        (matches the partial index ix_risk_assessments_retry_pending)
+        
+        Shared by retry_failed_workflows and deploy/check_query_plans.py.
         
         Args:
-            max_retries: Maximum retry attempts (default: 3)
+            now (datetime): Reference time for the lease check
         
         Returns:
-            List of RiskAssessment objects that can be retried
+            Query of not failed, not processing RiskAssessments in RETRY_SCAN_STATUSES without
+            active lease (excluding workflows waiting for Batch API results - the batch poll resumes them)
         """
+        waiting_for_batch = db.session.query(LLMBatchRequest.id).filter(
+            LLMBatchRequest.risk_uuid == cls.risk_uuid,
+            LLMBatchRequest.status.in_(LLMBatchRequest.PENDING_STATUSES)
+        ).exists()
         return cls.query.filter(
+            cls.failed_at.is_(None),
+            cls.processing_since.is_(None),
+            cls.status.in_(cls.RETRY_SCAN_STATUSES),
+            cls.lease_free(now),
+            ~waiting_for_batch
+        )
+
+    @classmethod
+    def failed_risks_query(cls, now=None):
+        """
+        Query for failed risks that still need a retry or an admin notification
+        (matches the partial index ix_risk_assessments_retry_failed)
+        
+        Args:
+            now (datetime): Reference time - if given, risks with an active lease are excluded
+        
+        Returns:
+            Query of failed, not yet notified RiskAssessments (excluding those waiting for inquiry responses)
+        """
+        query = cls.query.filter(
             cls.failed_at.isnot(None),
-            cls.retry_count < max_retries,
             cls.admin_notified == False,
-            cls.status != 'inquiry'
-        ).all()
+            cls.processing_since.is_(None),
+            cls.status != 'inquiry_awaiting_response'
+        )
+        if now is not None:
+            query = query.filter(cls.lease_free(now))
+        return query
 
     def is_accepted(self):
         """Check if this risk has been accepted by any user"""
@@ -433,13 +632,67 @@ class RiskAcceptance(db.Model):
         return f'<RiskAcceptance risk_uuid={self.risk_uuid} user_uuid={self.user_uuid}>'
 
 
-@event.listens_for(Engine, "before_cursor_execute")
-def _log_sql_for_risk_assessment(_conn, _cursor, statement, parameters, _context, _executemany):
-    try:
-        stmt_l = statement.lower()
-        if ' risk_assessments ' in stmt_l or ' risk_assessments\n' in stmt_l or ' risk_assessments(' in stmt_l or ' risk_assessments.' in stmt_l or 'into risk_assessments' in stmt_l or 'update risk_assessments' in stmt_l or 'delete from risk_assessments' in stmt_l:
-            logger.info(f"[SQL] {statement} | params={parameters}")
-    except Exception as e:
-        logger.warning(f"[SQL] logging failed: {e}")
+class LLMBatchRequest(db.Model):
+    """
+    OpenAI Batch API request of a non-interactive workflow
+    
+    Status flow: queued -> submitted -> completed | failed
+    The workflow is paused while requests are queued/submitted and replays
+    the completed results when it is resumed (lookup by custom_id).
+    """
+    __tablename__ = 'llm_batch_requests'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    custom_id = db.Column(db.String(128), unique=True, nullable=False, index=True)
+    risk_uuid = db.Column(db.String(36), nullable=False, index=True)
+    user_uuid = db.Column(db.String(36), nullable=False)
+    agent = db.Column(db.String(50), nullable=False)
+    request_body = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    batch_id = db.Column(db.String(100), nullable=True, index=True)
+    response_content = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    submitted_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    PENDING_STATUSES = ('queued', 'submitted')
+    
+    @classmethod
+    def has_pending(cls, risk_uuid):
+        """Check if a workflow is waiting for batch results"""
+        return cls.query.filter(
+            cls.risk_uuid == risk_uuid,
+            cls.status.in_(cls.PENDING_STATUSES)
+        ).first() is not None
+    
+    def __repr__(self):
+        return f'<LLMBatchRequest {self.custom_id} status={self.status}>'
+
+
+class LLMCallRecord(db.Model):
+    """
+    Ledger entry for a single OpenAI request (written asynchronously by llm_ledger)
+
+    Basis für Kosten-/Latenzauswertungen pro Workflow-Stufe und Modell.
+    """
+    __tablename__ = 'llm_call_ledger'
+
+    id = db.Column(db.Integer, primary_key=True)
+    risk_uuid = db.Column(db.String(36), nullable=True, index=True)
+    stage = db.Column(db.String(50), nullable=False, index=True)
+    agent = db.Column(db.String(50), nullable=False)
+    model = db.Column(db.String(100), nullable=False, index=True)
+    service_tier = db.Column(db.String(20), nullable=True)
+    latency_ms = db.Column(db.Integer, nullable=False)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    total_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cached_tokens = db.Column(db.Integer, nullable=False, default=0)
+    retries = db.Column(db.Integer, nullable=False, default=0)
+    success = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<LLMCallRecord {self.stage}/{self.model} {self.latency_ms}ms>'
 
-_ = _log_sql_for_risk_assessment
@@ -2,48 +2,58 @@
 Performance Logger - Zeitmessung für wichtige Funktionen
 Author: Manuel Schott
 
-Loggt Start/End-Zeiten und Dauer nur wenn DEBUG_ENABLED=True
+Misst immer (Histogramm xrisk_operation_duration_seconds, siehe metrics.py, und
+ein Tracing-Span pro Operation, siehe tracing.py), loggt Start/End-Zeiten und
+Dauer aber nur wenn DEBUG_ENABLED=True
 """
 
 import logging
 import time
 from contextlib import contextmanager
 from config import Config
+from metrics import observe
+from tracing import start_span, end_span
 
 logger = logging.getLogger('application')
 
 
 @contextmanager
-def perf_timer(operation_name):
+def perf_timer(operation_name, context=None, **labels):
     """
-    Context Manager für Performance-Logging.
-    Loggt Start, End und Dauer nur wenn DEBUG_ENABLED=True.
-    
+    Context Manager für Performance-Messung und -Logging.
+    Die Dauer wird immer im Histogramm erfasst (Labels: operation, outcome und
+    zusätzliche Labels wie stage/agent/model). Log-Zeilen nur wenn DEBUG_ENABLED=True.
+
+    Args:
+        operation_name (str): Stabiler Name der Operation (wird als Label verwendet)
+        context (str): Optionaler Kontext nur für das Log, z.B. risk_uuid (kein Label!)
+        **labels: Zusätzliche Labels mit niedriger Kardinalität
+
     Usage:
-        with perf_timer("Workflow Execution"):
+        with perf_timer("Analysis Step", risk_uuid, stage='analysis'):
             # Code hier
             pass
     """
-    # Nur im Debug-Modus loggen
-    if not Config.DEBUG_ENABLED:
-        yield
-        return
-    
-    start_time = time.time()
-    logger.info(f"[PERF] START: {operation_name}")
-    
+    log_name = f"{operation_name} [{context}]" if context else operation_name
+    debug = Config.DEBUG_ENABLED
+
+    active_span = start_span(operation_name, context=context, **labels)
+    start_time = time.perf_counter()
+    if debug:
+        logger.info(f"[PERF] START: {log_name}")
+
     try:
         yield
-        
-        # End-Zeit und Dauer
-        end_time = time.time()
-        duration = end_time - start_time
-        logger.info(f"[PERF] END: {operation_name} - Duration: {duration:.2f}s")
-        
     except Exception as e:
-        # Bei Fehler auch loggen
-        end_time = time.time()
-        duration = end_time - start_time
-        logger.error(f"[PERF] FAILED: {operation_name} - Duration: {duration:.2f}s - Error: {str(e)}")
+        duration = time.perf_counter() - start_time
+        end_span(active_span, e)
+        observe('xrisk_operation_duration_seconds', duration, operation=operation_name, outcome='error', **labels)
+        if debug:
+            logger.error(f"[PERF] FAILED: {log_name} - Duration: {duration:.2f}s - Error: {str(e)}")
         raise
 
+    duration = time.perf_counter() - start_time
+    end_span(active_span)
+    observe('xrisk_operation_duration_seconds', duration, operation=operation_name, outcome='success', **labels)
+    if debug:
+        logger.info(f"[PERF] END: {log_name} - Duration: {duration:.2f}s")
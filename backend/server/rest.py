@@ -5,10 +5,14 @@ Author: Manuel Schott
 REST API endpoints that are not part of specific blueprints
 """
 
-from flask import Blueprint, jsonify, request
+import math
+
+from flask import Blueprint, jsonify, request, Response
 from flask_login import login_required, current_user
 from models import RiskAssessment, RiskAcceptance, db
+from db_routing import read_replica
 from datetime import datetime, timezone
+from sqlalchemy import or_
 
 rest_bp = Blueprint('rest', __name__)
 
@@ -42,8 +46,46 @@ def health():
     })
 
 
+@rest_bp.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics endpoint
+    ---
+    tags:
+      - Health
+    summary: Prometheus metrics
+    description: |
+      Latenz-Histogramme aller Gunicorn- und Celery-Prozesse (perf_timer und
+      OpenAI-Requests) im Prometheus Text-Format. Ist METRICS_TOKEN gesetzt,
+      wird ein passender Bearer-Token erwartet.
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Metrics in Prometheus text format
+      401:
+        description: Missing or invalid token
+      404:
+        description: Metrics disabled
+    """
+    from config import Config
+    from metrics import render_prometheus
+    import hmac
+    
+    if not Config.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics disabled'}), 404
+    
+    if Config.METRICS_TOKEN:
+        auth_header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth_header, f"Bearer {Config.METRICS_TOKEN}"):
+            return jsonify({'error': 'Authentication required'}), 401
+    
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 @rest_bp.route('/api/risks', methods=['GET'])
 @login_required
+@read_replica
 def get_risks():
     """
     Get all risks that the current user can access
@@ -54,8 +96,42 @@ def get_risks():
     description: |
       Returns all risks that belong to the current user OR risks that are available (status='available') 
       and not yet signed (status != 'signed').
+      Marketplace listings can be filtered and sorted by the analysis figures (evaluated in SQL).
     security:
       - sessionAuth: []
+    parameters:
+      - in: query
+        name: scope
+        type: string
+        enum: [all, own, available]
+        default: all
+        description: Own risks, available (marketplace) risks or both
+      - in: query
+        name: q
+        type: string
+        description: Case-insensitive search in the report title
+      - in: query
+        name: min_probability
+        type: number
+        description: Minimum probability in percent (analysis)
+      - in: query
+        name: max_probability
+        type: number
+        description: Maximum probability in percent (analysis)
+      - in: query
+        name: max_expected_damage
+        type: number
+        description: Maximum expected damage in EUR (analysis)
+      - in: query
+        name: sort
+        type: string
+        enum: [created, probability, expected_damage, max_damage]
+        default: created
+      - in: query
+        name: order
+        type: string
+        enum: [asc, desc]
+        default: desc
     produces:
       - application/json
     responses:
@@ -68,6 +144,8 @@ def get_risks():
               type: array
               items:
                 type: object
+      400:
+        description: Invalid filter or sort parameter
       401:
         description: Not authenticated
     """
@@ -78,17 +156,56 @@ def get_risks():
     
     # Get all risks that:
     # 1. Belong to the current user, OR
-    # 2. Are available (status='available') and not yet signed (status != 'signed')
-    all_risks = RiskAssessment.query.all()
+    # 2. Are available (status='available', i.e. released and not yet signed)
+    # Filtered in SQL - payloads are only loaded for the returned risks
+    scopes = {
+        'all': or_(RiskAssessment.user_uuid == user_uuid, RiskAssessment.status == 'available'),
+        'own': RiskAssessment.user_uuid == user_uuid,
+        'available': RiskAssessment.status == 'available'
+    }
+    sort_columns = {
+        'created': RiskAssessment.creation_date,
+        'probability': RiskAssessment.analysis_probability,
+        'expected_damage': RiskAssessment.analysis_expected_damage,
+        'max_damage': RiskAssessment.analysis_max_damage_pml
+    }
+    scope = request.args.get('scope', 'all')
+    sort = request.args.get('sort', 'created')
+    order = request.args.get('order', 'desc')
+    if scope not in scopes or sort not in sort_columns or order not in ('asc', 'desc'):
+        return jsonify({'error': 'Invalid scope, sort or order parameter'}), 400
+    
+    query = RiskAssessment.query_with_payloads().filter(scopes[scope])
+    
+    # Filter auf den generierten Analyse-Spalten (indiziert für status='available')
+    numeric_filters = (
+        ('min_probability', lambda value: RiskAssessment.analysis_probability >= value),
+        ('max_probability', lambda value: RiskAssessment.analysis_probability <= value),
+        ('max_expected_damage', lambda value: RiskAssessment.analysis_expected_damage <= value)
+    )
+    for name, condition in numeric_filters:
+        value = request.args.get(name)
+        if value is None:
+            continue
+        try:
+            number = float(value)
+        except ValueError:
+            return jsonify({'error': f'Invalid number for {name}'}), 400
+        if not math.isfinite(number):
+            return jsonify({'error': f'Invalid number for {name}'}), 400
+        query = query.filter(condition(number))
     
-    accessible_risks = []
-    for risk in all_risks:
-        # User's own risks
-        if risk.user_uuid == user_uuid:
-            accessible_risks.append(risk)
-        # Available risks that haven't been signed yet
-        elif risk.is_released() and not risk.is_signed():
-            accessible_risks.append(risk)
+    search = request.args.get('q', '').strip()
+    if search:
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(RiskAssessment.analysis_title.ilike(f"%{escaped}%", escape='\\'))
+    
+    sort_column = sort_columns[sort]
+    sort_order = sort_column.asc() if order == 'asc' else sort_column.desc()
+    if sort != 'created':
+        # Nur die generierten Spalten sind nullable - creation_date bleibt in Index-Reihenfolge
+        sort_order = sort_order.nulls_last()
+    accessible_risks = query.order_by(sort_order, RiskAssessment.id).all()
     
     return jsonify({
         'risks': [risk.to_dict() for risk in accessible_risks]
@@ -97,6 +214,7 @@ def get_risks():
 
 @rest_bp.route('/api/risks/<risk_uuid>', methods=['GET'])
 @login_required
+@read_replica
 def get_risk(risk_uuid):
     """
     Get a specific risk by UUID
@@ -132,7 +250,7 @@ def get_risk(risk_uuid):
     
     user_uuid = current_user.user_uuid
     
-    risk = RiskAssessment.query.filter_by(risk_uuid=risk_uuid).first()
+    risk = RiskAssessment.query_with_payloads().filter_by(risk_uuid=risk_uuid).first()
     if not risk:
         return jsonify({'error': 'Risk not found'}), 404
     
@@ -312,3 +430,48 @@ def delete_risk(risk_uuid):
     db.session.commit()
     
     return jsonify({'message': 'Risk deleted successfully'}), 200
+
+
+@rest_bp.route('/api/llm-ledger/stats', methods=['GET'])
+@login_required
+def get_llm_ledger_stats():
+    """
+    Aggregated LLM call ledger (admin only)
+    ---
+    tags:
+      - Monitoring
+    summary: LLM cost and latency percentiles
+    description: |
+      Aggregates the per-call LLM ledger per workflow stage, per model and per
+      stage/model/service tier: call counts, failures, retries, latency and token
+      percentiles (p50/p90/p95/p99) and the prompt cache hit rate.
+    security:
+      - sessionAuth: []
+    parameters:
+      - name: hours
+        in: query
+        type: integer
+        default: 24
+        description: Time window in hours (max. 720)
+    produces:
+      - application/json
+    responses:
+      200:
+        description: Aggregated ledger statistics
+      401:
+        description: Not authenticated
+      403:
+        description: Access denied - admin only
+    """
+    from config import Config
+    from llm_ledger import aggregate_ledger
+    
+    if (current_user.email or '').lower() != (Config.ADMIN_EMAIL or '').lower():
+        return jsonify({'error': 'Access denied - admin only'}), 403
+    
+    try:
+        hours = min(max(int(request.args.get('hours', 24)), 1), 720)
+    except ValueError:
+        return jsonify({'error': 'Invalid parameter: hours'}), 400
+    
+    return jsonify(aggregate_ledger(since_hours=hours)), 200
@@ -6,133 +6,147 @@ Celery Beat task that runs periodically to retry failed workflows
 """
 
 from celery_app import celery_app
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import and_, or_
+from workflow_dispatch import dispatch_workflow
 import logging
 
 logger = logging.getLogger('celery')
 
 
+def _claim_batches(query):
+    """
+    Claim scan results in bounded batches with FOR UPDATE SKIP LOCKED
+    
+    Keyset pagination over id; every batch is its own transaction (committed after
+    the caller has processed it). Rows locked by another beat instance are skipped,
+    so parallel retry checks never handle the same risk at the same time.
+    Only the columns needed for dispatching are loaded (no JSON columns).
+    
+    Args:
+        query: RiskAssessment query with the scan filters
+        
+    Yields:
+        list: Locked RiskAssessment rows (load_only)
+    """
+    from models import RiskAssessment, db
+    from sqlalchemy.orm import load_only
+    from config import Config
+    
+    batch_size = Config.RETRY_SCAN_BATCH_SIZE
+    last_id = 0
+    while True:
+        batch = query.filter(RiskAssessment.id > last_id).options(load_only(
+            RiskAssessment.id, RiskAssessment.risk_uuid, RiskAssessment.user_uuid,
+            RiskAssessment.status, RiskAssessment.insurance_value, RiskAssessment.retry_count,
+            RiskAssessment.lease_owner, RiskAssessment.lease_expires_at
+        )).order_by(RiskAssessment.id).limit(batch_size).with_for_update(
+            skip_locked=True, of=RiskAssessment
+        ).all()
+        if not batch:
+            db.session.commit()
+            return
+        last_id = batch[-1].id
+        yield batch
+        db.session.commit()
+        if len(batch) < batch_size:
+            return
+
+
 @celery_app.task(name='workflow.retry_failed_workflows')
 def retry_failed_workflows():
     """
     Periodic task that retries failed workflows
     Runs periodically based on RETRY_CHECK_INTERVAL (default: 5 minutes)
     
-    - Finds failed workflows older than RETRY_MIN_AGE
+    - Auto-continues stalled and starts created/validated workflows
+    - Retries failed workflows up to RETRY_MAX_ATTEMPTS times
     - Excludes workflows waiting for user input (status='inquiry_awaiting_response')
-    - Retries up to RETRY_MAX_ATTEMPTS times
     - Sends admin email after max retries reached
+    
+    The scans use partial indexes and claim rows in batches (see _claim_batches),
+    the tasks of a batch are enqueued over one producer connection.
     """
     from models import RiskAssessment, db
     from app import app
-    from workflow_task import execute_risk_workflow
+    from workflow_task import execute_risk_workflow, resume_from_current_status
     from config import Config
-    import os
     
     logger.info("[Retry Task] Starting periodic retry check...")
-    logger.info(f"[Retry Task] Config - Max Attempts: {Config.RETRY_MAX_ATTEMPTS}")
+    logger.info(f"[Retry Task] Config - Max Attempts: {Config.RETRY_MAX_ATTEMPTS}, Batch Size: {Config.RETRY_SCAN_BATCH_SIZE}")
     
+    stalled_count = validated_count = failed_count = 0
     try:
         with app.app_context():
+            now = datetime.now(timezone.utc)
+            # Ohne aktive Lease und ohne offene Batch-Requests (Plan geprüft von deploy/check_query_plans.py)
+            pending = RiskAssessment.pending_risks_query(now)
+            
             # 1) Resume stalled workflows that should auto-continue (inquired/researched/analyzed, not processing, not failed)
-            from models import RiskAssessment
-            stalled_risks = RiskAssessment.query.filter(
-                RiskAssessment.status.in_(['inquired', 'researched', 'analyzed']),
-                RiskAssessment.processing_since.is_(None),
-                RiskAssessment.failed_at.is_(None)
-            ).all()
-            if stalled_risks:
-                logger.info(f"[Retry Task] Found {len(stalled_risks)} stalled workflows to auto-continue")
-                from workflow_task import resume_from_current_status
-                queue_name = 'celery'
-                for risk in stalled_risks:
-                    logger.info(f"[Retry Task] Auto-continuing stalled workflow {risk.risk_uuid} from {risk.status}")
-                    task = resume_from_current_status.apply_async(
-                        args=[risk.risk_uuid, risk.user_uuid],
-                        task_id=f"workflow_resume_{risk.risk_uuid}",
-                        queue=queue_name
-                    )
-                    logger.info(f"[Retry Task] Resume task queued: {task.id}")
+            stalled = pending.filter(RiskAssessment.status.in_(['inquired', 'researched', 'analyzed']))
+            for batch in _claim_batches(stalled):
+                logger.info(f"[Retry Task] Auto-continuing {len(batch)} stalled workflows")
+                with celery_app.producer_or_acquire() as producer:
+                    for risk in batch:
+                        task = dispatch_workflow(
+                            resume_from_current_status, risk, f"workflow_resume_{risk.risk_uuid}",
+                            kwargs={'execution_mode': 'batch'}, background=True, producer=producer
+                        )
+                        logger.info(f"[Retry Task] Resume task queued for {risk.risk_uuid} from {risk.status}: {task.id}")
+                stalled_count += len(batch)
 
             # 2) Start validated-but-not-started risks automatically
-            validated_risks = RiskAssessment.query.filter(
+            #    (plus created risks whose start task got lost - validation is the first workflow stage;
+            #    fresh ones are skipped, their start task may still be waiting in the queue)
+            created_cutoff = now - timedelta(seconds=Config.RETRY_CHECK_INTERVAL)
+            startable = pending.filter(or_(
                 RiskAssessment.status == 'validated',
-                RiskAssessment.processing_since.is_(None),
-                RiskAssessment.failed_at.is_(None)
-            ).all()
-            if validated_risks:
-                logger.info(f"[Retry Task] Found {len(validated_risks)} validated risks to start")
-                from workflow_task import execute_risk_workflow
-                queue_name = 'celery'
-                for risk in validated_risks:
-                    logger.info(f"[Retry Task] Starting workflow for validated risk {risk.risk_uuid}")
-                    task = execute_risk_workflow.apply_async(
-                        args=[risk.risk_uuid, risk.user_uuid],
-                        task_id=f"workflow_{risk.risk_uuid}",
-                        queue=queue_name
-                    )
-                    logger.info(f"[Retry Task] Started task: {task.id}")
-
-            # 3) Find all failed risks that can be retried
-            failed_risks = RiskAssessment.get_failed_risks(
-                max_retries=Config.RETRY_MAX_ATTEMPTS
-            )
-            
-            logger.info(f"[Retry Task] Found {len(failed_risks)} failed workflows eligible for retry")
-            
-            for risk in failed_risks:
-                # Check if workflow is already processing (automatic retry might be running)
-                if risk.processing_since:
-                    elapsed = risk.get_processing_elapsed_seconds()
-                    logger.info(f"[Retry Task] Skipping {risk.risk_uuid} - already processing for {elapsed}s")
-                    continue
-                
-                # Ensure timezone-aware arithmetic: treat DB-stored naive datetimes as UTC
-                failed_at = risk.failed_at
-                if failed_at is None:
-                    # Shouldn't happen for failed risks, but guard anyway
-                    logger.warning(f"[Retry Task] Risk {risk.risk_uuid} has no failed_at; skipping")
-                    continue
-                if failed_at.tzinfo is None:
-                    failed_at = failed_at.replace(tzinfo=timezone.utc)
-                failed_age = int((datetime.now(timezone.utc) - failed_at).total_seconds())
-                logger.info(f"[Retry Task] Processing risk {risk.risk_uuid} - Retry {risk.retry_count + 1}/{Config.RETRY_MAX_ATTEMPTS}, Failed {failed_age}s ago, Status: {risk.status}")
-                
-                # Check if max retries reached
-                if risk.retry_count >= Config.RETRY_MAX_ATTEMPTS:
-                    logger.warning(f"[Retry Task] Risk {risk.risk_uuid} exceeded max retries ({Config.RETRY_MAX_ATTEMPTS}), sending admin notification")
-                    send_admin_notification(risk)
-                    risk.admin_notified = True
-                    db.session.commit()
-                    continue
-                
-                # Double-check: Don't retry inquiry status (should already be filtered by query)
-                if risk.status == 'inquiry_awaiting_response':
-                    logger.info(f"[Retry Task] Skipping {risk.risk_uuid} - waiting for user inquiry response")
-                    continue
-                
-                # Increment retry counter
-                risk.increment_retry()
-                
-                # Determine queue
-                queue_name = 'celery'
-                
-                # Restart workflow from current status
-                logger.info(f"[Retry Task] Restarting workflow for {risk.risk_uuid} from status {risk.status}")
-                
-                # Clear failed status
-                risk.clear_failed_status()
+                and_(RiskAssessment.status == 'created', RiskAssessment.creation_date < created_cutoff)
+            ))
+            for batch in _claim_batches(startable):
+                logger.info(f"[Retry Task] Starting {len(batch)} created/validated risks")
+                with celery_app.producer_or_acquire() as producer:
+                    for risk in batch:
+                        task = dispatch_workflow(
+                            execute_risk_workflow, risk, f"workflow_{risk.risk_uuid}",
+                            kwargs={'execution_mode': 'batch'}, background=True, producer=producer
+                        )
+                        logger.info(f"[Retry Task] Started task for {risk.status} risk {risk.risk_uuid}: {task.id}")
+                validated_count += len(batch)
+
+            # 3) Retry failed risks (or notify admins once the retries are exhausted)
+            failed = RiskAssessment.failed_risks_query(now)
+            for batch in _claim_batches(failed):
+                retries = []
+                for risk in batch:
+                    if risk.retry_count >= Config.RETRY_MAX_ATTEMPTS:
+                        logger.warning(f"[Retry Task] Risk {risk.risk_uuid} exceeded max retries ({Config.RETRY_MAX_ATTEMPTS}), sending admin notification")
+                        send_admin_notification(risk)
+                        risk.admin_notified = True
+                        continue
+                    
+                    logger.info(f"[Retry Task] Restarting workflow for {risk.risk_uuid} from status {risk.status} - Retry {risk.retry_count + 1}/{Config.RETRY_MAX_ATTEMPTS}")
+                    # Retry-Zähler erhöhen und Failed-Status löschen (ein UPDATE pro Risk beim Commit des Batches)
+                    risk.retry_count += 1
+                    risk.failed_at = None
+                    risk.failed_reason = None
+                    retries.append(risk)
                 
-                # Start new workflow task
-                task = execute_risk_workflow.apply_async(
-                    args=[risk.risk_uuid, risk.user_uuid],
-                    task_id=f"workflow_retry_{risk.risk_uuid}_{risk.retry_count}",
-                    queue=queue_name
-                )
+                # Vor dem Enqueue flushen - ein schon gestarteter Task wartet beim Lease auf den Commit (Zeilensperre)
+                db.session.flush()
                 
-                logger.info(f"[Retry Task] Workflow restarted: {task.id} on queue {queue_name}")
+                # Start new workflow tasks (non-interactive - runs via Batch API if enabled;
+                # retries never compete with interactive users)
+                with celery_app.producer_or_acquire() as producer:
+                    for risk in retries:
+                        task = dispatch_workflow(
+                            execute_risk_workflow, risk, f"workflow_retry_{risk.risk_uuid}_{risk.retry_count}",
+                            kwargs={'execution_mode': 'batch'}, background=True, producer=producer
+                        )
+                        logger.info(f"[Retry Task] Workflow restarted: {task.id}")
+                failed_count += len(batch)
             
-            logger.info(f"[Retry Task] Retry check complete - processed {len(failed_risks)} failed, {len(stalled_risks)} stalled, {len(validated_risks)} validated risks")
+            logger.info(f"[Retry Task] Retry check complete - processed {failed_count} failed, {stalled_count} stalled, {validated_count} validated risks")
             
     except Exception as e:
         logger.error(f"[Retry Task] Error during retry check: {str(e)}")
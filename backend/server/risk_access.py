@@ -0,0 +1,96 @@
+"""
+xrisk - Risk Access
+Author: Manuel Schott
+
+Access resolution for risks addressed by risk_uuid
+
+Ein Risk ist für den Aufrufer sichtbar, wenn er dem eingeloggten Nutzer oder dem
+anonymen Nutzer (DEFAULT_ANONYMOUS_USER_UUID) gehört. resolve_risk_access lädt ihn
+mit einer Abfrage (risk_uuid + user_uuid IN (...)) statt nacheinander mit beiden
+UUIDs und merkt sich das Ergebnis pro Request in g - eine Statusabfrage kostet so
+einen DB-Roundtrip. check_risk_access liefert die einheitlichen Fehlerantworten.
+"""
+
+import logging
+
+from flask import g, jsonify
+from flask_login import current_user
+
+from models import RiskAssessment
+from workflow_task import DEFAULT_ANONYMOUS_USER_UUID
+
+logger = logging.getLogger('application')
+
+
+def accessible_user_uuids() -> list:
+    """
+    Get the owners whose risks the current caller may access
+
+    Returns:
+        list: Logged-in user UUID (if any) and DEFAULT_ANONYMOUS_USER_UUID
+    """
+    if current_user.is_authenticated:
+        return [current_user.user_uuid, DEFAULT_ANONYMOUS_USER_UUID]
+    return [DEFAULT_ANONYMOUS_USER_UUID]
+
+
+def resolve_risk_access(risk_uuid: str, refresh: bool = False):
+    """
+    Load the risk for the current caller (memoized per request)
+
+    Args:
+        risk_uuid (str): Risk UUID
+        refresh (bool): Query again and refresh the loaded attributes
+                        (SSE loops, reads after read_with_primary_fallback cleared the session)
+
+    Returns:
+        RiskAssessment or None if the risk does not exist or belongs to another user
+    """
+    user_uuids = accessible_user_uuids()
+    cache = g.setdefault('risk_access', {})
+    key = (risk_uuid, tuple(user_uuids))
+    if refresh or key not in cache:
+        risk = RiskAssessment.get_accessible(risk_uuid, user_uuids, refresh=refresh)
+        if risk:
+            owner = 'DEFAULT_ANONYMOUS_USER_UUID' if risk.user_uuid == DEFAULT_ANONYMOUS_USER_UUID else f"logged-in user UUID {risk.user_uuid}"
+            logger.info(f"Found risk {risk_uuid} with {owner}")
+        cache[key] = risk
+    return cache[key]
+
+
+def check_risk_access(risk, action: str, login_message: str):
+    """
+    Check that the current caller may access a risk
+
+    Logged-in users may access their own and anonymous risks; anonymous callers
+    only anonymous risks.
+
+    Args:
+        risk: RiskAssessment instance or None
+        action (str): Action for the log lines (e.g. 'Status check')
+        login_message (str): Message of the login_required response
+
+    Returns:
+        tuple: (response, status code) if access is denied, otherwise None
+    """
+    if not risk:
+        return jsonify({'error': 'Risk assessment not found'}), 404
+
+    if current_user.is_authenticated:
+        if risk.user_uuid != current_user.user_uuid and risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
+            logger.warning(f"{action} attempt by wrong user: {current_user.user_uuid} tried to access risk {risk.risk_uuid} owned by {risk.user_uuid}")
+            return jsonify({
+                'error': 'not_found',
+                'message': 'Risikoeintrag nicht gefunden.',
+                'suggest_logout': True
+            }), 404
+    elif risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
+        logger.info(f"{action} attempt for non-anonymous risk {risk.risk_uuid} without login")
+        return jsonify({
+            'error': 'login_required',
+            'message': login_message,
+            'requires_login': True,
+            'user_uuid': risk.user_uuid
+        }), 401
+
+    return None
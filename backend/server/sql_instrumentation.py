@@ -0,0 +1,211 @@
+"""
+xrisk - SQL Instrumentation
+Author: Manuel Schott
+
+Configurable SQL instrumentation (replaces the per-statement risk_assessments logger)
+
+- Tabellen-Filter (SQL_LOG_TABLES) werden einmal als Regex kompiliert, das
+  Ergebnis pro Statement-Text gecacht
+- Sampling der geloggten Statements (SQL_LOG_SAMPLE_RATE), Parameter nur mit SQL_LOG_PARAMS
+- Slow-Query-Schwelle (SQL_SLOW_QUERY_MS) mit optionalem EXPLAIN (SQL_EXPLAIN_SLOW)
+- Query-Zähler pro Flask-Request (Server-Timing Header, Warnung ab SQL_REQUEST_QUERY_WARN)
+
+Mit SQL_INSTRUMENTATION_ENABLED=false werden keine Event-Listener registriert.
+"""
+
+import contextvars
+import logging
+import random
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger('application')
+
+# Query-Statistik des laufenden Requests bzw. Kontexts oder None
+_query_stats = contextvars.ContextVar('sql_query_stats', default=None)
+
+# Statement-Text -> Tabellen-Treffer (Statements wiederholen sich, Regex nur einmal pro Text)
+_MATCH_CACHE_SIZE = 2048
+_match_cache: Dict[str, bool] = {}
+
+# Statement-Text -> Zeitpunkt des letzten EXPLAIN (max. ein EXPLAIN pro Statement und Intervall)
+_EXPLAIN_INTERVAL_SECONDS = 600
+_explained: Dict[str, float] = {}
+
+_table_pattern: Optional[re.Pattern] = None
+_installed = False
+
+
+def _compile_table_pattern(tables: str) -> Optional[re.Pattern]:
+    """
+    Compile the table filter into a single regex
+
+    Args:
+        tables (str): Comma-separated table names ('*' = all tables, '' = none)
+
+    Returns:
+        re.Pattern | None: Pattern matching statements on these tables
+    """
+    names = [name.strip() for name in tables.split(',') if name.strip()]
+    if not names:
+        return None
+    if '*' in names:
+        return re.compile(r'.', re.DOTALL)
+    alternatives = '|'.join(re.escape(name) for name in names)
+    return re.compile(r'\b(?:from|into|update|join)\s+"?(?:' + alternatives + r')\b', re.IGNORECASE)
+
+
+def _matches_tables(statement: str) -> bool:
+    if _table_pattern is None:
+        return False
+    matched = _match_cache.get(statement)
+    if matched is None:
+        matched = _table_pattern.search(statement) is not None
+        if len(_match_cache) >= _MATCH_CACHE_SIZE:
+            _match_cache.clear()
+        _match_cache[statement] = matched
+    return matched
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        # Am Execution-Context statt in conn.info: after_cursor_execute feuert bei Fehlern nicht,
+        # die Startzeit verfällt dann mit dem Context statt sich auf der Pool-Verbindung anzusammeln
+        context._xrisk_start = time.perf_counter()
+
+    if _matches_tables(statement) and (Config.SQL_LOG_SAMPLE_RATE >= 1.0 or random.random() < Config.SQL_LOG_SAMPLE_RATE):
+        if Config.SQL_LOG_PARAMS:
+            logger.info("[SQL] %s | params=%s", statement, parameters)
+        else:
+            logger.info("[SQL] %s", statement)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_xrisk_start', None)
+    if start is None:
+        return
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    stats = _query_stats.get()
+    if stats is not None:
+        stats['count'] += 1
+        stats['total_ms'] += duration_ms
+
+    if Config.SQL_SLOW_QUERY_MS and duration_ms >= Config.SQL_SLOW_QUERY_MS:
+        if stats is not None:
+            stats['slow'] += 1
+        logger.warning("[SQL] Slow query (%.1f ms): %s", duration_ms, statement[:2000])
+        if Config.SQL_EXPLAIN_SLOW and not executemany:
+            _explain(conn, statement, parameters)
+
+
+def _explain(conn, statement: str, parameters) -> None:
+    """Log the query plan of a slow SELECT (plain EXPLAIN - the statement is not executed again)"""
+    if conn.dialect.name != 'postgresql' or not statement.lstrip()[:6].lower() == 'select':
+        return
+    now = time.monotonic()
+    if now - _explained.get(statement, 0) < _EXPLAIN_INTERVAL_SECONDS:
+        return
+    _explained[statement] = now
+
+    try:
+        # Eigener DBAPI-Cursor - der Cursor des eigentlichen Statements bleibt unberührt
+        explain_cursor = conn.connection.cursor()
+        # Ein fehlschlagendes EXPLAIN bricht sonst die offene Transaktion des Aufrufers ab
+        # (InFailedSqlTransaction beim nächsten Statement) - im Savepoint wird nur er zurückgerollt
+        use_savepoint = not getattr(conn.connection.dbapi_connection, 'autocommit', False)
+        try:
+            if use_savepoint:
+                explain_cursor.execute('SAVEPOINT xrisk_explain')
+            try:
+                explain_cursor.execute('EXPLAIN ' + statement, parameters)
+                plan = '\n'.join(row[0] for row in explain_cursor.fetchall())
+            except Exception:
+                if use_savepoint:
+                    explain_cursor.execute('ROLLBACK TO SAVEPOINT xrisk_explain')
+                raise
+            if use_savepoint:
+                explain_cursor.execute('RELEASE SAVEPOINT xrisk_explain')
+        finally:
+            explain_cursor.close()
+        logger.warning("[SQL] Plan of slow query:\n%s", plan)
+    except Exception as e:
+        logger.warning("[SQL] EXPLAIN of slow query failed: %s", e)
+
+
+@contextmanager
+def query_counter():
+    """
+    Count SQL statements executed in the current context (e.g. a Celery task)
+
+    Yields:
+        Dict: count, total_ms and slow - updated while the block runs
+    """
+    stats = {'count': 0, 'total_ms': 0.0, 'slow': 0}
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+def _start_request_counter():
+    _query_stats.set({'count': 0, 'total_ms': 0.0, 'slow': 0})
+
+
+def _finish_request_counter(response):
+    stats = _query_stats.get()
+    if stats is None:
+        return response
+    _query_stats.set(None)
+
+    response.headers.add(
+        'Server-Timing', f'db;dur={stats["total_ms"]:.1f};desc="{stats["count"]} queries"'
+    )
+    if Config.SQL_REQUEST_QUERY_WARN and stats['count'] >= Config.SQL_REQUEST_QUERY_WARN:
+        from flask import request
+        logger.warning(
+            "[SQL] %s %s executed %d queries (%.1f ms, %d slow)",
+            request.method, request.path, stats['count'], stats['total_ms'], stats['slow']
+        )
+    return response
+
+
+def install_sql_instrumentation(app=None) -> bool:
+    """
+    Register the SQL event listeners (process-wide) and the per-request counters
+
+    Args:
+        app: Optional Flask app for per-request query counters
+
+    Returns:
+        bool: True if instrumentation is active
+    """
+    global _table_pattern, _installed
+
+    if not Config.SQL_INSTRUMENTATION_ENABLED:
+        return False
+
+    if not _installed:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        _table_pattern = _compile_table_pattern(Config.SQL_LOG_TABLES)
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _installed = True
+        logger.info(
+            "SQL instrumentation enabled (tables=%s, sample_rate=%s, slow_query_ms=%s, explain=%s)",
+            Config.SQL_LOG_TABLES or '-', Config.SQL_LOG_SAMPLE_RATE,
+            Config.SQL_SLOW_QUERY_MS, Config.SQL_EXPLAIN_SLOW
+        )
+
+    if app is not None:
+        app.before_request(_start_request_counter)
+        app.after_request(_finish_request_counter)
+
+    return True
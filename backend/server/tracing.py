@@ -0,0 +1,414 @@
+"""
+xrisk - Distributed Tracing
+Author: Manuel Schott
+
+Lightweight tracing for the workflow path Flask request -> Celery task ->
+research threads -> OpenAI calls, without an SDK dependency.
+
+- Trace-Kontext als W3C traceparent: HTTP-Header eingehend, Celery-Message-Header
+  beim Publish, Threads über contextvars (copy_context in ResearchAgent)
+- Spans: HTTP-Request, Celery-Task, perf_timer-Operationen (Workflow-Stufen),
+  OpenAI-Calls, DB-Commits und Redis-Publishes
+- Export im Hintergrund-Thread in Batches: JSONL-Datei (LOG_DIR/traces) oder
+  OTLP/HTTP JSON an einen Collector (TRACING_OTLP_ENDPOINT)
+
+Mit TRACING_ENABLED=false liefert span() einen No-op und es werden keine Hooks registriert.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger('application')
+
+# Aktiver Span-Kontext: {'trace_id', 'span_id', 'sampled'} oder None
+_current_span = contextvars.ContextVar('tracing_current_span', default=None)
+
+_EXPORT_BATCH_SIZE = 200
+_EXPORT_INTERVAL_SECONDS = 5.0
+
+# OTLP Status-Codes
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+class Span:
+    """A single timed operation of a trace"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'sampled', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'error', '_token')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 kind: str, attributes: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = _STATUS_OK
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = _STATUS_ERROR
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'service': Config.TRACING_SERVICE_NAME,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'status': 'error' if self.status == _STATUS_ERROR else 'ok',
+            'error': self.error,
+            'attributes': self.attributes
+        }
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled"""
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def record_error(self, error: BaseException) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+# --- Kontext-Propagation (W3C traceparent) -------------------------------------------
+
+def format_traceparent() -> Optional[str]:
+    """Get the traceparent header value of the active span (None if no trace is active)"""
+    current = _current_span.get()
+    if current is None:
+        return None
+    flags = '01' if current['sampled'] else '00'
+    return f"00-{current['trace_id']}-{current['span_id']}-{flags}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Dict]:
+    """
+    Parse a W3C traceparent header
+
+    Returns:
+        Dict | None: trace_id, span_id and sampled flag or None if invalid
+    """
+    if not value:
+        return None
+    parts = value.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return {'trace_id': parts[1], 'span_id': parts[2], 'sampled': sampled}
+
+
+# --- Spans ---------------------------------------------------------------------------
+
+def start_span(name: str, kind: str = 'internal', **attributes):
+    """
+    Start a span as child of the active span and make it the active span
+
+    Must be finished with end_span() in the same context. Prefer span() where possible.
+
+    Returns:
+        Span | _NoopSpan
+    """
+    if not Config.TRACING_ENABLED:
+        return _NOOP_SPAN
+
+    parent = _current_span.get()
+    if parent is None:
+        sampled = Config.TRACING_SAMPLE_RATE >= 1.0 or random.random() < Config.TRACING_SAMPLE_RATE
+        trace_id, parent_id = os.urandom(16).hex(), None
+    else:
+        sampled = parent['sampled']
+        trace_id, parent_id = parent['trace_id'], parent['span_id']
+
+    # Auch nicht gesampelte Spans setzen den Kontext, damit Kind-Prozesse nicht neu würfeln
+    new_span = Span(name, trace_id, parent_id, sampled, kind, attributes)
+    new_span._token = _current_span.set({'trace_id': trace_id, 'span_id': new_span.span_id, 'sampled': sampled})
+    return new_span
+
+
+def end_span(active_span, error: Optional[BaseException] = None) -> None:
+    """Finish a span started with start_span() and restore its parent as active span"""
+    if not isinstance(active_span, Span):
+        return
+    if error is not None:
+        active_span.record_error(error)
+    active_span.end_ns = time.time_ns()
+    if active_span._token is not None:
+        try:
+            _current_span.reset(active_span._token)
+        except ValueError:
+            # Token stammt aus einem anderen Kontext (z.B. Signal-Handler)
+            _current_span.set(None)
+        active_span._token = None
+    if active_span.sampled:
+        _exporter.export(active_span.to_dict())
+
+
+@contextmanager
+def span(name: str, kind: str = 'internal', **attributes):
+    """
+    Trace a block of code
+
+    Usage:
+        with span('openai.chat.completions', model=model) as s:
+            s.set_attribute('tokens', 123)
+    """
+    if not Config.TRACING_ENABLED:
+        yield _NOOP_SPAN
+        return
+
+    active_span = start_span(name, kind, **attributes)
+    try:
+        yield active_span
+    except BaseException as e:
+        end_span(active_span, e)
+        raise
+    end_span(active_span)
+
+
+# --- Export --------------------------------------------------------------------------
+
+class _SpanExporter:
+    """Batches finished spans and exports them from a background thread"""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, span_dict: Dict) -> None:
+        try:
+            self._queue.put_nowait(span_dict)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                    self._thread.start()
+
+    def _take_batch(self, block: bool) -> list:
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=_EXPORT_INTERVAL_SECONDS))
+            while len(batch) < _EXPORT_BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch(block=True)
+            if batch:
+                self._write(batch)
+
+    def flush(self) -> None:
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch: list) -> None:
+        try:
+            if Config.TRACING_EXPORTER == 'otlp':
+                _export_otlp(batch)
+            else:
+                _export_file(batch)
+        except Exception as e:
+            logger.warning(f"[Tracing] Failed to export {len(batch)} spans: {e}")
+
+
+def _export_file(batch: list) -> None:
+    trace_dir = os.path.join(Config.LOG_DIR, 'traces')
+    os.makedirs(trace_dir, exist_ok=True)
+    path = os.path.join(trace_dir, f"spans-{time.strftime('%Y-%m-%d')}-{os.getpid()}.jsonl")
+    with open(path, 'a', encoding='utf-8') as f:
+        for span_dict in batch:
+            f.write(json.dumps(span_dict, default=str) + '\n')
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _export_otlp(batch: list) -> None:
+    """Send spans to an OTLP/HTTP collector (JSON encoding)"""
+    import requests
+
+    kinds = {'internal': 1, 'server': 2, 'client': 3, 'producer': 4, 'consumer': 5}
+    spans = []
+    for s in batch:
+        otlp_span = {
+            'traceId': s['trace_id'],
+            'spanId': s['span_id'],
+            'name': s['name'],
+            'kind': kinds.get(s['kind'], 1),
+            'startTimeUnixNano': str(s['start_ns']),
+            'endTimeUnixNano': str(s['end_ns']),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in s['attributes'].items() if v is not None],
+            'status': {'code': _STATUS_ERROR if s['status'] == 'error' else _STATUS_OK, 'message': s['error'] or ''}
+        }
+        if s['parent_id']:
+            otlp_span['parentSpanId'] = s['parent_id']
+        spans.append(otlp_span)
+
+    payload = {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': Config.TRACING_SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': 'xrisk.tracing'}, 'spans': spans}]
+    }]}
+    response = requests.post(Config.TRACING_OTLP_ENDPOINT, json=payload, timeout=5)
+    response.raise_for_status()
+
+
+_exporter = _SpanExporter()
+atexit.register(_exporter.flush)
+
+
+def flush_traces() -> None:
+    """Export all finished spans synchronously (e.g. before a worker child exits)"""
+    _exporter.flush()
+
+
+# --- Integrationen -------------------------------------------------------------------
+
+def install_flask_tracing(app) -> None:
+    """Trace every HTTP request and continue incoming traceparent headers"""
+    if not Config.TRACING_ENABLED:
+        return
+
+    from flask import request, g
+
+    @app.before_request
+    def _start_request_span():
+        # Immer setzen (auch None) - Threads werden zwischen Requests wiederverwendet
+        g._trace_token = _current_span.set(parse_traceparent(request.headers.get('traceparent')))
+        g._trace_span = start_span(f"HTTP {request.method} {request.path}", kind='server',
+                                   **{'http.method': request.method, 'http.target': request.path})
+
+    @app.after_request
+    def _annotate_request_span(response):
+        active_span = g.get('_trace_span')
+        if active_span is not None:
+            active_span.set_attribute('http.status_code', response.status_code)
+            traceparent = format_traceparent()
+            if traceparent:
+                response.headers['traceparent'] = traceparent
+        return response
+
+    @app.teardown_request
+    def _end_request_span(error=None):
+        active_span = g.pop('_trace_span', None)
+        if active_span is not None:
+            end_span(active_span, error)
+        token = g.pop('_trace_token', None)
+        if token is not None:
+            _current_span.reset(token)
+
+
+def install_celery_tracing() -> None:
+    """Propagate the trace context through Celery message headers and trace each task"""
+    if not Config.TRACING_ENABLED:
+        return
+
+    from celery.signals import before_task_publish, task_prerun, task_postrun
+
+    task_spans = {}
+
+    @before_task_publish.connect(weak=False)
+    def _inject_traceparent(headers=None, **kwargs):
+        traceparent = format_traceparent()
+        if traceparent and headers is not None:
+            headers['traceparent'] = traceparent
+
+    @task_prerun.connect(weak=False)
+    def _start_task_span(task_id=None, task=None, **kwargs):
+        traceparent = task.request.get('traceparent') if task is not None else None
+        parent = parse_traceparent(traceparent)
+        # Jeder Task startet mit leerem Kontext - sonst erbt er den Span des vorherigen Tasks
+        token = _current_span.set(parent)
+        task_spans[task_id] = (token, start_span(f"celery {task.name}", kind='consumer',
+                                                 **{'celery.task_id': task_id}))
+
+    @task_postrun.connect(weak=False)
+    def _end_task_span(task_id=None, state=None, **kwargs):
+        entry = task_spans.pop(task_id, None)
+        if entry is None:
+            return
+        token, active_span = entry
+        if isinstance(active_span, Span):
+            active_span.set_attribute('celery.state', state)
+            if state == 'FAILURE':
+                active_span.status = _STATUS_ERROR
+        end_span(active_span)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            _current_span.set(None)
+
+
+def install_db_tracing() -> None:
+    """Trace session commits (flush + COMMIT) of all SQLAlchemy sessions"""
+    if not Config.TRACING_ENABLED:
+        return
+
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    @event.listens_for(Session, 'before_commit')
+    def _start_commit_span(session):
+        session.info['trace_commit_span'] = start_span('db.commit', kind='client')
+
+    @event.listens_for(Session, 'after_commit')
+    def _end_commit_span(session):
+        end_span(session.info.pop('trace_commit_span', None))
+
+    @event.listens_for(Session, 'after_rollback')
+    def _end_rolled_back_span(session):
+        active_span = session.info.pop('trace_commit_span', None)
+        if isinstance(active_span, Span):
+            active_span.status = _STATUS_ERROR
+            active_span.error = 'rollback'
+        end_span(active_span)
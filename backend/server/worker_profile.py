@@ -0,0 +1,103 @@
+"""
+xrisk - Celery Worker Profiles
+Author: Manuel Schott
+
+Worker profiles for the Celery pools (selected by start_celery_worker.sh)
+
+- prefork: ein Task pro Prozess (Standard, CPU-lastige oder nicht thread-sichere Arbeit)
+- gevent:  viele Tasks pro Prozess als Greenlets - für die I/O-lastigen Agent-Stufen,
+           die fast nur auf OpenAI warten. Celery patcht beim Start mit -P gevent;
+           psycopg2 wird hier über einen Wait-Callback kooperativ gemacht.
+- threads: viele Tasks pro Prozess als Threads (ohne Monkey-Patching). Celery
+           unterstützt hier keine Time-Limits (CELERY_TASK_TIME_LIMIT greift nicht).
+
+Pro Task gibt es einen eigenen Flask-App-Context und damit eine eigene
+SQLAlchemy-Session (Flask-SQLAlchemy scoped die Session auf den App-Context,
+dieser liegt in contextvars und ist pro Greenlet/Thread getrennt), siehe
+workflow_task.workflow_app_context.
+"""
+
+import logging
+import os
+import sys
+
+logger = logging.getLogger('celery')
+
+WORKER_POOLS = ('prefork', 'gevent', 'threads')
+
+_psycopg_green = False
+
+
+def current_worker_pool() -> str:
+    """
+    Get the Celery pool of this worker process
+
+    Returns:
+        str: 'prefork', 'gevent' or 'threads' (CELERY_WORKER_POOL, set by start_celery_worker.sh)
+    """
+    pool = os.environ.get('CELERY_WORKER_POOL', 'prefork').lower()
+    return pool if pool in WORKER_POOLS else 'prefork'
+
+
+def is_gevent_patched() -> bool:
+    """Check if gevent has monkey-patched the socket module in this process"""
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+
+def _gevent_wait_callback(conn, timeout=None):
+    """Wait for a psycopg2 connection cooperatively (yields to other greenlets)"""
+    from psycopg2 import extensions, OperationalError
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def make_psycopg_green() -> bool:
+    """
+    Make psycopg2 cooperative under gevent (otherwise every query blocks all greenlets of the process)
+
+    Returns:
+        bool: True if the wait callback is installed
+    """
+    global _psycopg_green
+
+    if _psycopg_green:
+        return True
+    if not is_gevent_patched():
+        return False
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return False
+
+    extensions.set_wait_callback(_gevent_wait_callback)
+    _psycopg_green = True
+    logger.info("psycopg2 wait callback installed for gevent")
+    return True
+
+
+def setup_worker_profile() -> str:
+    """
+    Prepare the worker process for its Celery pool (worker_init signal)
+
+    Returns:
+        str: Active pool
+    """
+    pool = current_worker_pool()
+    if pool == 'gevent':
+        if not make_psycopg_green():
+            logger.warning("CELERY_WORKER_POOL=gevent but gevent is not active - start the worker with -P gevent")
+    logger.info(f"Celery worker profile: {pool}")
+    return pool
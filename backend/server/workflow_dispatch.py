@@ -0,0 +1,198 @@
+"""
+xrisk - Workflow Dispatch
+Author: Manuel Schott
+
+Queue routing for workflow tasks
+
+- CELERY_QUEUE_HIGH: interaktive Erstläufe und Fortsetzungen nach Nutzeraktionen
+  (Start, Inquiry-Antworten, Login)
+- CELERY_QUEUE_FAST: Kleinrisiken (insurance_value <= SMALL_RISK_THRESHOLD_EUR),
+  die ohne Recherche über den kombinierten Analyse-/Report-Agenten laufen
+- CELERY_QUEUE_LOW: Retries, Auto-Continue und Fortsetzungen nach Batch-API-Ergebnissen
+- CELERY_QUEUE_DEFAULT: Wartungs-Tasks (Celery Beat)
+
+Jede Queue kann von einem eigenen Worker-Pool bedient werden
+(CELERY_WORKER_POOLS in start_celery_worker.sh), damit Hintergrundarbeit
+interaktive Nutzer nicht verdrängt.
+
+Deduplizierung beim Enqueue (dispatch_workflow): Pro Risk wird höchstens ein
+Workflow-Task eingereiht - nicht, solange ein Task den Lease hält
+(workflow_lease.py), und nicht, solange bereits ein Task in der Queue wartet
+(Redis-Marker workflow:queued:{risk_uuid}, SET NX mit WORKFLOW_ENQUEUE_DEDUP_TTL).
+"""
+
+import logging
+import ssl
+from datetime import datetime, timezone
+
+import redis
+
+from config import Config
+
+logger = logging.getLogger('application')
+
+_redis_pool = None
+
+
+def is_small_risk(insurance_value) -> bool:
+    """
+    Check if a risk is a Kleinrisiko (combined analysis/report agent, no research)
+
+    Args:
+        insurance_value: Insurance value in EUR (may be None)
+
+    Returns:
+        bool: True if insurance_value <= SMALL_RISK_THRESHOLD_EUR
+    """
+    try:
+        return insurance_value is not None and float(insurance_value) <= Config.SMALL_RISK_THRESHOLD_EUR
+    except (TypeError, ValueError):
+        return False
+
+
+def workflow_queue(insurance_value=None, background: bool = False) -> str:
+    """
+    Select the Celery queue for a workflow task
+
+    Args:
+        insurance_value: Insurance value of the risk (Kleinrisiken use the fast lane)
+        background (bool): True for retries, auto-continues and batch resumes
+
+    Returns:
+        str: Queue name
+    """
+    if background:
+        return Config.CELERY_QUEUE_LOW
+    if is_small_risk(insurance_value):
+        return Config.CELERY_QUEUE_FAST
+    return Config.CELERY_QUEUE_HIGH
+
+
+def get_redis_client():
+    """
+    Redis client on a process-wide connection pool (shared by all requests/tasks/greenlets of the process)
+    
+    redis-py resets the pool automatically in forked children.
+    """
+    global _redis_pool
+    if _redis_pool is None:
+        if Config.REDIS_URL.startswith('rediss://'):
+            _redis_pool = redis.ConnectionPool.from_url(
+                Config.REDIS_URL,
+                ssl_cert_reqs=ssl.CERT_NONE,
+                decode_responses=True
+            )
+        else:
+            _redis_pool = redis.ConnectionPool.from_url(
+                Config.REDIS_URL,
+                decode_responses=True
+            )
+    return redis.Redis(connection_pool=_redis_pool)
+
+
+def _enqueue_marker_key(risk_uuid: str) -> str:
+    return f"workflow:queued:{risk_uuid}"
+
+
+def clear_enqueue_marker(risk_uuid: str, task_id: str = None) -> None:
+    """
+    Remove the enqueue marker of a risk (the queued task has started or was revoked)
+
+    Args:
+        risk_uuid (str): Risk UUID
+        task_id (str): Only remove the marker if it belongs to this task (None: always)
+    """
+    try:
+        redis_client = get_redis_client()
+        key = _enqueue_marker_key(risk_uuid)
+        if task_id is None or redis_client.get(key) == task_id:
+            redis_client.delete(key)
+    except Exception as e:
+        # Marker läuft nach WORKFLOW_ENQUEUE_DEDUP_TTL von selbst ab
+        logger.warning(f"Could not clear enqueue marker for {risk_uuid}: {e}")
+
+
+def risk_uuid_from_task_id(task_id: str):
+    """
+    Extract the risk UUID from a workflow task id
+
+    Args:
+        task_id (str): workflow_{uuid}, workflow_resume_{uuid} or workflow_retry_{uuid}_{n}
+
+    Returns:
+        str: Risk UUID or None for other task ids
+    """
+    for prefix in ('workflow_resume_', 'workflow_retry_', 'workflow_'):
+        if task_id.startswith(prefix):
+            rest = task_id[len(prefix):]
+            return rest.rsplit('_', 1)[0] if prefix == 'workflow_retry_' else rest
+    return None
+
+
+def has_active_lease(risk) -> bool:
+    """
+    Check if a workflow task currently holds the lease of a risk
+
+    Args:
+        risk: RiskAssessment instance
+
+    Returns:
+        bool: True if lease_expires_at lies in the future
+    """
+    expires_at = risk.lease_expires_at
+    if expires_at is None:
+        return False
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at > datetime.now(timezone.utc)
+
+
+def dispatch_workflow(task, risk, task_id: str, args=None, kwargs=None, background: bool = False, producer=None):
+    """
+    Enqueue a workflow task for a risk unless one is already running or queued
+
+    Args:
+        task: Celery task (execute_risk_workflow, resume_workflow_after_inquiry, resume_from_current_status)
+        risk: RiskAssessment instance
+        task_id (str): Celery task id
+        args (list): Task args (default: [risk_uuid, user_uuid])
+        kwargs (dict): Task kwargs
+        background (bool): True for retries, auto-continues and batch resumes (see workflow_queue)
+        producer: Shared Kombu producer for grouped enqueues (celery_app.producer_or_acquire())
+
+    Returns:
+        AsyncResult: The new task or the already running/queued one
+    """
+    from celery.result import AsyncResult
+    from celery_app import celery_app
+
+    if has_active_lease(risk):
+        logger.info(f"Workflow for {risk.risk_uuid} already running ({risk.lease_owner}) - not enqueuing {task_id}")
+        return AsyncResult(risk.lease_owner, app=celery_app)
+
+    try:
+        redis_client = get_redis_client()
+        key = _enqueue_marker_key(risk.risk_uuid)
+        if not redis_client.set(key, task_id, nx=True, ex=Config.WORKFLOW_ENQUEUE_DEDUP_TTL):
+            queued_id = redis_client.get(key)
+            if queued_id:
+                logger.info(f"Workflow for {risk.risk_uuid} already queued ({queued_id}) - not enqueuing {task_id}")
+                return AsyncResult(queued_id, app=celery_app)
+            # Marker ist zwischenzeitlich abgelaufen
+            redis_client.set(key, task_id, ex=Config.WORKFLOW_ENQUEUE_DEDUP_TTL)
+    except redis.RedisError as e:
+        # Ohne Redis-Marker einreihen - der Lease verhindert trotzdem parallele Ausführung
+        logger.warning(f"Enqueue dedup unavailable for {risk.risk_uuid}: {e}")
+
+    try:
+        return task.apply_async(
+            args=args if args is not None else [risk.risk_uuid, risk.user_uuid],
+            kwargs=kwargs or {},
+            task_id=task_id,
+            queue=workflow_queue(risk.insurance_value, background=background),
+            producer=producer
+        )
+    except Exception:
+        # Nicht eingereiht - der Marker würde sonst bis zum TTL alle weiteren Dispatches verschlucken
+        clear_enqueue_marker(risk.risk_uuid, task_id)
+        raise
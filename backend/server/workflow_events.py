@@ -11,8 +11,8 @@ from flask_login import current_user
 from celery.result import AsyncResult
 from celery_app import celery_app
 from config import Config
-from models import RiskAssessment
-from workflow_task import DEFAULT_ANONYMOUS_USER_UUID
+from db_pool import release_db_connection
+from risk_access import resolve_risk_access
 import redis
 import json
 import logging
@@ -208,9 +208,7 @@ def stream_workflow_updates(task_id):
                 
                 if risk_uuid:
                     try:
-                        risk = RiskAssessment.get_by_uuids(current_user.user_uuid, risk_uuid)
-                        if not risk:
-                            risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
+                        risk = resolve_risk_access(risk_uuid, refresh=True)
                         
                         if risk:
                             logger.info(f"[SSE] Task {task_id} has login_required but user is now logged in. Using risk status: {risk.status}")
@@ -238,6 +236,10 @@ def stream_workflow_updates(task_id):
             }
             yield f"data: {json.dumps(initial_data)}\n\n"
             
+            # Der Stream kann Minuten offen bleiben - keine DB-Verbindung festhalten
+            # (stream_with_context hält Request- und App-Context und damit die Session bis zum Ende)
+            release_db_connection()
+            
             last_heartbeat = time.time()
             heartbeat_interval = 25
             while True:
@@ -283,9 +285,7 @@ def stream_workflow_updates(task_id):
                             risk_uuid = event_data.get('risk_uuid') or (event_data.get('meta', {}).get('risk_uuid') if isinstance(event_data.get('meta'), dict) else None)
                             if risk_uuid:
                                 try:
-                                    risk = RiskAssessment.get_by_uuids(current_user.user_uuid, risk_uuid)
-                                    if not risk:
-                                        risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
+                                    risk = resolve_risk_access(risk_uuid, refresh=True)
                                     
                                     if risk:
                                         logger.info(f"[SSE] Event has login_required but user is logged in. Using risk status: {risk.status}")
@@ -299,11 +299,12 @@ def stream_workflow_updates(task_id):
                                         event_data.pop('login_required', None)
                                 except Exception as e:
                                     logger.error(f"[SSE] Error checking risk status in event: {str(e)}")
+                                release_db_connection()
                         
                         logger.info(f"[SSE] Received event: {event_data.get('status')} - {event_data.get('meta', {}).get('message', '')}")
                         yield f"data: {json.dumps(event_data)}\n\n"
                         last_heartbeat = now
-                        if event_data.get('status') in ['completed', 'failed']:
+                        if event_data.get('status') in ['completed', 'failed', 'rejected']:
                             logger.info(f"[SSE] Task finished, closing stream")
                             break
                     except json.JSONDecodeError as e:
@@ -0,0 +1,293 @@
+"""
+xrisk - Workflow Lease
+Author: Manuel Schott
+
+DB-backed lease per risk assessment with heartbeats and fencing tokens
+
+Ein Workflow-Task darf einen Risk nur bearbeiten, solange er den Lease hält
+(risk_assessments.lease_owner / lease_expires_at). Die Übernahme erfolgt atomar
+per UPDATE ... WHERE (kein oder abgelaufener Lease) und erhöht lease_token.
+Task-IDs wie workflow_resume_{risk_uuid} werden wiederverwendet - der Besitz
+hängt deshalb am Token, nicht an lease_owner.
+Ein Heartbeat-Thread verlängert den Lease alle WORKFLOW_LEASE_TTL/3 Sekunden.
+
+Fencing: Jeder Flush, der den geleasten Risk ändert (jeder Stage-Commit), prüft
+im selben Statement lease_token. Hat inzwischen ein anderer Task den Lease
+übernommen (z.B. nach einem hängenden Worker), schlägt der Commit fehl und
+der veraltete Task beendet sich ohne weitere Schreibzugriffe oder LLM-Aufrufe.
+"""
+
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from config import Config
+
+logger = logging.getLogger('celery')
+
+# Lease des laufenden Workflow-Tasks oder None
+_current_lease = contextvars.ContextVar('workflow_lease', default=None)
+
+_fencing_installed = False
+
+
+class WorkflowLeaseBusy(Exception):
+    """The risk is leased by another running task"""
+
+    def __init__(self, risk_uuid: str, owner: Optional[str]):
+        super().__init__(f"Risk {risk_uuid} is leased by {owner}")
+        self.risk_uuid = risk_uuid
+        self.owner = owner
+
+
+class WorkflowLeaseLost(Exception):
+    """The lease was taken over by another task (stale fencing token)"""
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class WorkflowLease:
+    """Lease of one task on one risk assessment (token None = risk not found, no fencing)"""
+
+    def __init__(self, engine, risk_uuid: str, owner: str, token: Optional[int]):
+        self.engine = engine
+        self.risk_uuid = risk_uuid
+        self.owner = owner
+        self.token = token
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> bool:
+        return self.token is not None
+
+    def _expires_at(self) -> datetime:
+        return _utcnow() + timedelta(seconds=Config.WORKFLOW_LEASE_TTL)
+
+    def extend(self, conn=None) -> bool:
+        """
+        Extend the lease if this task still holds it
+
+        Args:
+            conn: Connection of the current transaction (None: own transaction)
+
+        Returns:
+            bool: False if the lease was lost
+        """
+        from sqlalchemy import update
+        from models import RiskAssessment
+
+        table = RiskAssessment.__table__
+        statement = update(table).where(
+            table.c.risk_uuid == self.risk_uuid,
+            table.c.lease_token == self.token
+        ).values(lease_expires_at=self._expires_at())
+
+        if conn is not None:
+            held = conn.execute(statement).rowcount == 1
+        else:
+            with self.engine.begin() as own_conn:
+                held = own_conn.execute(statement).rowcount == 1
+        if not held:
+            self.lost = True
+        return held
+
+    def start_heartbeat(self) -> None:
+        self._thread = threading.Thread(target=self._heartbeat, name=f'lease-{self.risk_uuid[:8]}', daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self) -> None:
+        interval = max(1.0, Config.WORKFLOW_LEASE_TTL / 3.0)
+        while not self._stop.wait(interval):
+            try:
+                if not self.extend():
+                    logger.warning(f"[Lease {self.risk_uuid}] Lease lost to another task (token {self.token})")
+                    return
+            except Exception as e:
+                # Ein verpasster Heartbeat ist unkritisch, solange der nächste vor Ablauf des TTL gelingt
+                logger.warning(f"[Lease {self.risk_uuid}] Heartbeat failed: {e}")
+
+    def release(self) -> None:
+        """Stop the heartbeat and give the lease back (the token stays for fencing)"""
+        self._stop.set()
+        if not self.active or self.lost:
+            return
+        from sqlalchemy import update
+        from models import RiskAssessment
+
+        table = RiskAssessment.__table__
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(update(table).where(
+                    table.c.risk_uuid == self.risk_uuid,
+                    table.c.lease_token == self.token
+                ).values(lease_owner=None, lease_expires_at=None))
+        except Exception as e:
+            # Lease läuft spätestens nach WORKFLOW_LEASE_TTL ab
+            logger.warning(f"[Lease {self.risk_uuid}] Release failed: {e}")
+
+
+def acquire_workflow_lease(risk_uuid: str, owner: str) -> WorkflowLease:
+    """
+    Atomically take the lease of a risk assessment (requires an app context)
+
+    Args:
+        risk_uuid (str): Risk UUID
+        owner (str): Lease owner (Celery task id, informational)
+
+    Returns:
+        WorkflowLease: Held lease (inactive if the risk does not exist)
+
+    Raises:
+        WorkflowLeaseBusy: If another task holds an unexpired lease
+    """
+    from sqlalchemy import update, select, or_
+    from models import RiskAssessment, db
+
+    _install_fencing()
+
+    table = RiskAssessment.__table__
+    engine = db.engine
+    now = _utcnow()
+    with engine.begin() as conn:
+        result = conn.execute(update(table).where(
+            table.c.risk_uuid == risk_uuid,
+            or_(
+                table.c.lease_expires_at.is_(None),
+                table.c.lease_expires_at < now
+            )
+        ).values(
+            lease_token=table.c.lease_token + 1,
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=Config.WORKFLOW_LEASE_TTL)
+        ))
+        row = conn.execute(
+            select(table.c.lease_token, table.c.lease_owner).where(table.c.risk_uuid == risk_uuid)
+        ).first()
+
+    if row is None:
+        return WorkflowLease(engine, risk_uuid, owner, None)
+    if result.rowcount != 1:
+        raise WorkflowLeaseBusy(risk_uuid, row.lease_owner)
+
+    lease = WorkflowLease(engine, risk_uuid, owner, row.lease_token)
+    lease.start_heartbeat()
+    return lease
+
+
+def break_workflow_lease(risk_uuid: str) -> None:
+    """
+    Invalidate the lease of a terminated task (revoke with terminate=True)
+
+    The token is incremented, so a task that is somehow still running is fenced off.
+    The enqueue marker is cleared as well, so a replacement task can be dispatched.
+
+    Args:
+        risk_uuid (str): Risk UUID
+    """
+    from sqlalchemy import update
+    from models import RiskAssessment, db
+    from workflow_dispatch import clear_enqueue_marker
+
+    table = RiskAssessment.__table__
+    with db.engine.begin() as conn:
+        conn.execute(update(table).where(table.c.risk_uuid == risk_uuid).values(
+            lease_token=table.c.lease_token + 1,
+            lease_owner=None,
+            lease_expires_at=None
+        ))
+    clear_enqueue_marker(risk_uuid)
+
+
+@contextmanager
+def workflow_lease_scope(risk_uuid: str, task_id: str):
+    """
+    Hold the lease of a risk for the duration of a workflow task (requires an app context)
+
+    A duplicate task (lease held by another task) and a task whose lease was taken
+    over are ended with celery.exceptions.Ignore: no failure marking, and the task
+    state is not stored - task ids are reused, so a stored result would overwrite
+    the state of the task that actually runs the risk.
+
+    Args:
+        risk_uuid (str): Risk UUID
+        task_id (str): Celery task id
+
+    Yields:
+        WorkflowLease: Held lease
+    """
+    from celery.exceptions import Ignore
+    from models import db
+    from workflow_dispatch import clear_enqueue_marker
+
+    try:
+        lease = acquire_workflow_lease(risk_uuid, task_id)
+    except WorkflowLeaseBusy as e:
+        clear_enqueue_marker(risk_uuid, task_id)
+        logger.info(f"[Workflow {risk_uuid}] Duplicate task {task_id} skipped - lease held by {e.owner}")
+        raise Ignore()
+
+    # Der Task läuft - die Enqueue-Sperre wird nicht mehr gebraucht
+    clear_enqueue_marker(risk_uuid, task_id)
+    token = activate_lease(lease)
+    try:
+        yield lease
+    except Exception:
+        if not lease.lost:
+            raise
+        db.session.rollback()
+        logger.warning(f"[Workflow {risk_uuid}] Task {task_id} lost its lease (token {lease.token}) - stopped without writing")
+        raise Ignore()
+    finally:
+        deactivate_lease(token)
+        lease.release()
+
+
+def current_lease() -> Optional[WorkflowLease]:
+    """Get the lease of the running workflow task or None"""
+    return _current_lease.get()
+
+
+def activate_lease(lease: WorkflowLease):
+    """
+    Make a lease the fencing context of the current task
+
+    Returns:
+        contextvars.Token: Token for deactivate_lease
+    """
+    return _current_lease.set(lease)
+
+
+def deactivate_lease(token) -> None:
+    _current_lease.reset(token)
+
+
+def _check_fencing(session, flush_context, instances):
+    """before_flush: stage commits of the leased risk must still hold the lease"""
+    lease = _current_lease.get()
+    if lease is None or not lease.active:
+        return
+
+    from models import RiskAssessment
+    if not any(isinstance(obj, RiskAssessment) and obj.risk_uuid == lease.risk_uuid for obj in session.dirty):
+        return
+
+    # Im selben Statement prüfen und verlängern - die Zeilensperre hält bis zum Commit
+    if lease.lost or not lease.extend(session.connection()):
+        raise WorkflowLeaseLost(f"Lease on risk {lease.risk_uuid} lost (token {lease.token}) - write rejected")
+
+
+def _install_fencing() -> None:
+    global _fencing_installed
+    if _fencing_installed:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'before_flush', _check_fencing)
+    _fencing_installed = True
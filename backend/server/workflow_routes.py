@@ -9,9 +9,17 @@ from flask import Blueprint, request, jsonify, redirect, url_for, session
 from flask_login import current_user
 from datetime import datetime, date
 from models import RiskAssessment, db, User
-from agents import ValidationAgent
+from agents.validation import prefilter_risk_description
 from performance_logger import perf_timer
 from workflow_task import DEFAULT_ANONYMOUS_USER_UUID
+from workflow_dispatch import workflow_queue, dispatch_workflow, risk_uuid_from_task_id
+from workflow_lease import break_workflow_lease
+from db_routing import read_replica, read_with_primary_fallback, reads_from_replica
+from risk_access import resolve_risk_access, check_risk_access, accessible_user_uuids
+from workflow_status import (
+    load_task_status, load_risk_status, store_risk_status_if_missing, risk_status_document,
+    serve_status, task_status_channel, risk_status_channel
+)
 import logging
 import json
 
@@ -20,6 +28,29 @@ logger = logging.getLogger('application')
 workflow_bp = Blueprint('workflow', __name__, url_prefix='/workflow')
 
 
+def _usable_task_status(task_id):
+    """
+    Status document of a task, unless the response needs more than the document
+    (completed: result from Celery; login_required for a logged-in user: status from the DB)
+    """
+    doc_json = load_task_status(task_id)
+    if not doc_json:
+        return None
+    status = json.loads(doc_json).get('status')
+    if status == 'completed' or (status == 'login_required' and current_user.is_authenticated):
+        return None
+    return doc_json
+
+
+def _usable_risk_status(risk_uuid):
+    """Status document of a risk if the current caller may access the risk"""
+    cached = load_risk_status(risk_uuid)
+    if not cached:
+        return None
+    doc_json, owner = cached
+    return doc_json if owner in accessible_user_uuids() else None
+
+
 @workflow_bp.route('/start', methods=['POST'])
 def start_workflow():
     """
@@ -28,7 +59,7 @@ def start_workflow():
     tags:
       - Workflow
     summary: Startet einen asynchronen Workflow zur Risikobewertung
-    description: Erstellt eine neue Risikobewertung und startet den asynchronen Verarbeitungsprozess
+    description: Erstellt eine neue Risikobewertung und startet den asynchronen Verarbeitungsprozess. Die Validierung durch den ValidationAgent ist die erste Stufe des Workflows - eine Ablehnung wird über den Status-/SSE-Kanal gemeldet (status "rejected" mit reason). Im Request selbst findet nur eine lokale Vorprüfung statt.
     consumes:
       - application/json
     produces:
@@ -83,8 +114,11 @@ def start_workflow():
             user_uuid:
               type: string
               example: "abcdef01-0000-4678-9abc-def012345678"
+            status:
+              type: string
+              example: "created"
       400:
-        description: Validierungsfehler oder Risiko wurde abgelehnt
+        description: Ungültige Eingabe oder Risiko durch die lokale Vorprüfung abgelehnt
         schema:
           type: object
           properties:
@@ -141,6 +175,17 @@ def start_workflow():
         except ValueError as e:
             return jsonify({'error': f'Invalid format: {str(e)}'}), 400
         
+        # Nur lokale Vorprüfung im Request - der ValidationAgent läuft als erste Workflow-Stufe
+        prefilter_result = prefilter_risk_description(data['initial_prompt'], insurance_value)
+        if prefilter_result is not None:
+            logger.info(f"Risk description rejected by pre-check: {prefilter_result['reason']}")
+            return jsonify({
+                'error': 'risk_validation_failed',
+                'reason': prefilter_result['reason'],
+                'retryable': False,
+                'status': 'rejected'
+            }), 400
+        
         with perf_timer("Workflow Start - Create Risk"):
             risk = RiskAssessment(
                 user_uuid=user_uuid,
@@ -151,45 +196,24 @@ def start_workflow():
             )
             db.session.add(risk)
             db.session.commit()
-
-        from app import app
-        with perf_timer("Workflow Start - Validation"):
-            validation_agent = ValidationAgent(app.config['OPENAI_API_KEY'])
-            risk_description_with_value = f"{data['initial_prompt']}\n\nVersicherungswert: {insurance_value:,.2f} EUR"
-            validation_result = validation_agent.validate_risk(risk_description_with_value)
-            if not validation_result.get('valid', False):
-                risk.update_status('rejected')
-                logger.info(f"Risk assessment rejected: {risk.risk_uuid}")
-                return jsonify({
-                    'error': 'risk_validation_failed',
-                    'reason': validation_result.get('reason', 'Risk description not accepted'),
-                    'retryable': False,
-                    'risk_uuid': risk.risk_uuid,
-                    'status': 'rejected'
-                }), 400
-            else:
-                risk.update_status('validated')
-            
-            logger.info(f"Risk assessment created: {risk.risk_uuid}")
-            
-            from workflow_task import execute_risk_workflow
-            
-            queue_name = 'celery'
-            
-            logger.info(f"Starting workflow task - queue={queue_name}")
-            
-            task = execute_risk_workflow.apply_async(
-                args=[risk.risk_uuid, risk.user_uuid],
-                task_id=f"workflow_{risk.risk_uuid}",
-                queue=queue_name
-            )
-            
-            logger.info(f"Workflow task started: {task.id} on queue {queue_name}")
+        
+        logger.info(f"Risk assessment created: {risk.risk_uuid}")
+        
+        from workflow_task import execute_risk_workflow
+        
+        queue_name = workflow_queue(risk.insurance_value)
+        
+        logger.info(f"Starting workflow task - queue={queue_name}")
+        
+        task = dispatch_workflow(execute_risk_workflow, risk, f"workflow_{risk.risk_uuid}")
+        
+        logger.info(f"Workflow task started: {task.id} on queue {queue_name}")
         
         return jsonify({
             'task_id': task.id,
             'risk_uuid': risk.risk_uuid,
-            'user_uuid': risk.user_uuid
+            'user_uuid': risk.user_uuid,
+            'status': risk.status
         }), 202  # 202 Accepted
         
     except Exception as e:
@@ -203,6 +227,7 @@ def start_workflow():
 
 
 @workflow_bp.route('/state/risk/<risk_uuid>', methods=['GET'])
+@read_replica
 def get_workflow_status_by_risk(risk_uuid):
     """
     Get workflow status by risk UUID
@@ -220,6 +245,16 @@ def get_workflow_status_by_risk(risk_uuid):
         required: true
         description: UUID der Risikobewertung
         example: "abcdef01-2345-4678-9abc-def012345678"
+      - in: query
+        name: wait
+        type: integer
+        required: false
+        description: Long-Poll - wartet bis zu 25 Sekunden auf eine Änderung, wenn If-None-Match dem aktuellen Stand entspricht
+      - in: header
+        name: If-None-Match
+        type: string
+        required: false
+        description: ETag der letzten Antwort
     responses:
       200:
         description: Status erfolgreich abgerufen
@@ -241,6 +276,8 @@ def get_workflow_status_by_risk(risk_uuid):
             failed_reason:
               type: string
               nullable: true
+      304:
+        description: Status unverändert (If-None-Match)
       400:
         description: Fehlende Parameter
       404:
@@ -249,49 +286,21 @@ def get_workflow_status_by_risk(risk_uuid):
         description: Server-Fehler
     """
     try:
-        if current_user.is_authenticated:
-            user_uuid = current_user.user_uuid
-        else:
-            user_uuid = DEFAULT_ANONYMOUS_USER_UUID
-        
-        risk = None
-        if current_user.is_authenticated:
-            risk = RiskAssessment.get_by_uuids(current_user.user_uuid, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with logged-in user UUID {current_user.user_uuid}")
-        
-        if not risk:
-            risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with DEFAULT_ANONYMOUS_USER_UUID")
-        
-        if not risk:
-            return jsonify({'error': 'Risk assessment not found'}), 404
-        
-        if current_user.is_authenticated:
-            if risk.user_uuid != current_user.user_uuid and risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-                logger.warning(f"Status check attempt by wrong user: {current_user.user_uuid} tried to access risk {risk.risk_uuid} owned by {risk.user_uuid}")
-                return jsonify({
-                    'error': 'not_found',
-                    'message': 'Risikoeintrag nicht gefunden.',
-                    'suggest_logout': True
-                }), 404
-        elif risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-            logger.info(f"Status check attempt for non-anonymous risk {risk.risk_uuid} without login")
-            return jsonify({
-                'error': 'login_required',
-                'message': 'Bitte loggen Sie sich ein, um den Status abzurufen.',
-                'requires_login': True,
-                'user_uuid': risk.user_uuid
-            }), 401
-        
-        return jsonify({
-            'status': risk.status,
-            'inquiry': risk.inquiry,
-            'risk_uuid': risk_uuid,
-            'user_uuid': risk.user_uuid,
-            'failed_reason': risk.failed_reason
-        })
+        # Statusdokument aus Redis - kein DB-Zugriff, solange der Aufrufer den Risk sehen darf
+        doc_json = _usable_risk_status(risk_uuid)
+        if doc_json:
+            response = serve_status(doc_json, lambda: _usable_risk_status(risk_uuid), risk_status_channel(risk_uuid))
+            if response is not None:
+                return response
+        
+        risk = resolve_risk_access(risk_uuid)
+        denied = check_risk_access(risk, 'Status check', 'Bitte loggen Sie sich ein, um den Status abzurufen.')
+        if denied:
+            return denied
+        
+        if not reads_from_replica():
+            store_risk_status_if_missing(risk)
+        return jsonify(risk_status_document(risk))
         
     except Exception as e:
         logger.error(f"Status check failed: {str(e)}")
@@ -302,6 +311,7 @@ def get_workflow_status_by_risk(risk_uuid):
 
 
 @workflow_bp.route('/state/task/<task_id>', methods=['GET'])
+@read_replica
 def get_workflow_status(task_id):
     """
     Get workflow status by task ID
@@ -319,6 +329,16 @@ def get_workflow_status(task_id):
         required: true
         description: Celery Task ID
         example: "workflow_abc123..."
+      - in: query
+        name: wait
+        type: integer
+        required: false
+        description: Long-Poll - wartet bis zu 25 Sekunden auf eine Änderung, wenn If-None-Match dem aktuellen Stand entspricht
+      - in: header
+        name: If-None-Match
+        type: string
+        required: false
+        description: ETag der letzten Antwort
     responses:
       200:
         description: Status erfolgreich abgerufen
@@ -351,10 +371,19 @@ def get_workflow_status(task_id):
             result:
               type: object
               description: Ergebnis (nur bei completed)
+      304:
+        description: Status unverändert (If-None-Match)
       500:
         description: Server-Fehler
     """
     try:
+        # Statusdokument aus Redis (update_and_publish) - kein Zugriff auf das Celery-Result-Backend
+        doc_json = _usable_task_status(task_id)
+        if doc_json:
+            response = serve_status(doc_json, lambda: _usable_task_status(task_id), task_status_channel(task_id))
+            if response is not None:
+                return response
+        
         from celery_app import celery_app
         from celery.result import AsyncResult
         
@@ -383,9 +412,7 @@ def get_workflow_status(task_id):
             risk_uuid = meta.get('risk_uuid') or (task.result.get('risk_uuid') if isinstance(task.result, dict) else None)
             if risk_uuid:
                 try:
-                    risk = RiskAssessment.get_by_uuids(current_user.user_uuid, risk_uuid)
-                    if not risk:
-                        risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
+                    risk = resolve_risk_access(risk_uuid)
                     
                     if risk:
                         logger.info(f"Task {task_id} has login_required but user is now logged in. Using risk status: {risk.status}")
@@ -518,36 +545,10 @@ def submit_inquiry_response():
         else:
             user_uuid = DEFAULT_ANONYMOUS_USER_UUID
         
-        risk = None
-        if current_user.is_authenticated:
-            risk = RiskAssessment.get_by_uuids(current_user.user_uuid, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with logged-in user UUID {current_user.user_uuid}")
-        
-        if not risk:
-            risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with DEFAULT_ANONYMOUS_USER_UUID")
-        
-        if not risk:
-            return jsonify({'error': 'Risk assessment not found'}), 404
-        
-        if current_user.is_authenticated:
-            if risk.user_uuid != current_user.user_uuid and risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-                logger.warning(f"Inquiry response attempt by wrong user: {current_user.user_uuid} tried to respond to risk {risk.risk_uuid} owned by {risk.user_uuid}")
-                return jsonify({
-                    'error': 'not_found',
-                    'message': 'Risikoeintrag nicht gefunden.',
-                    'suggest_logout': True
-                }), 404
-        elif risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-            logger.info(f"Inquiry response attempt for non-anonymous risk {risk.risk_uuid} without login")
-            return jsonify({
-                'error': 'login_required',
-                'message': 'Bitte loggen Sie sich ein, um die Rückfragen zu beantworten.',
-                'requires_login': True,
-                'user_uuid': risk.user_uuid
-            }), 401
+        risk = resolve_risk_access(risk_uuid)
+        denied = check_risk_access(risk, 'Inquiry response', 'Bitte loggen Sie sich ein, um die Rückfragen zu beantworten.')
+        if denied:
+            return denied
         
         if risk.status != 'inquiry_awaiting_response':
             return jsonify({'error': f'Invalid status {risk.status}, expected inquiry_awaiting_response'}), 400
@@ -557,7 +558,7 @@ def submit_inquiry_response():
             logger.error(f"Inquiry response count mismatch for {risk.risk_uuid}: expected {expected_count}, received {received_count}")
             return jsonify({'error': 'inquiry_response_count_mismatch', 'expected': expected_count, 'received': received_count}), 400
 
-        with perf_timer(f"Inquiry Response - Resume Workflow [{data['risk_uuid']}]"):
+        with perf_timer("Inquiry Response - Resume Workflow", data['risk_uuid']):
             from workflow_task import resume_workflow_after_inquiry
             import os
             
@@ -566,14 +567,13 @@ def submit_inquiry_response():
             old_task = AsyncResult(data['task_id'], app=celery_app)
             old_task.revoke()
             
-            queue_name = 'celery'
+            queue_name = workflow_queue(risk.insurance_value)
             
             logger.info(f"Resuming workflow - queue={queue_name}")
             
-            task = resume_workflow_after_inquiry.apply_async(
-                args=[risk_uuid, user_uuid, data['responses']],
-                task_id=f"workflow_resume_{risk_uuid}",
-                queue=queue_name
+            task = dispatch_workflow(
+                resume_workflow_after_inquiry, risk, f"workflow_resume_{risk_uuid}",
+                args=[risk_uuid, user_uuid, data['responses']]
             )
             
             logger.info(f"Workflow resumed: {task.id} on queue {queue_name}")
@@ -619,35 +619,18 @@ def resume_workflow_get(risk_uuid):
         else:
             user_uuid = DEFAULT_ANONYMOUS_USER_UUID
         
-        risk = None
-        if current_user.is_authenticated:
-            risk = RiskAssessment.get_by_uuids(current_user.user_uuid, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with logged-in user UUID {current_user.user_uuid}")
-        
-        if not risk:
-            risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with DEFAULT_ANONYMOUS_USER_UUID")
-        
-        if not risk:
-            if not current_user.is_authenticated:
-                return jsonify({
-                    'error': 'login_required',
-                    'message': 'Bitte loggen Sie sich ein, um diesen Risikoeintrag fortzusetzen.',
-                    'requires_login': True
-                }), 401
-            return jsonify({'error': 'Risk assessment not found'}), 404
+        risk = resolve_risk_access(risk_uuid)
+        if not risk and not current_user.is_authenticated:
+            return jsonify({
+                'error': 'login_required',
+                'message': 'Bitte loggen Sie sich ein, um diesen Risikoeintrag fortzusetzen.',
+                'requires_login': True
+            }), 401
+        denied = check_risk_access(risk, 'Resume', 'Bitte loggen Sie sich ein, um diesen Risikoeintrag fortzusetzen.')
+        if denied:
+            return denied
         
         if current_user.is_authenticated:
-            if risk.user_uuid != current_user.user_uuid and risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-                logger.warning(f"Resume attempt by wrong user: {current_user.user_uuid} tried to resume risk {risk.risk_uuid} owned by {risk.user_uuid}")
-                return jsonify({
-                    'error': 'not_found',
-                    'message': 'Risikoeintrag nicht gefunden.',
-                    'suggest_logout': True
-                }), 404
-            
             if risk.user_uuid == DEFAULT_ANONYMOUS_USER_UUID:
                 old_user_uuid = risk.user_uuid
                 risk.user_uuid = current_user.user_uuid
@@ -660,26 +643,16 @@ def resume_workflow_get(risk_uuid):
                         
                         # Automatically continue workflow after inquiry responses
                         from workflow_task import resume_from_current_status
-                        queue_name = 'celery'
-                        task = resume_from_current_status.apply_async(
-                            args=[risk.risk_uuid, current_user.user_uuid],
-                            task_id=f"workflow_resume_{risk.risk_uuid}",
-                            queue=queue_name
+                        queue_name = workflow_queue(risk.insurance_value)
+                        task = dispatch_workflow(
+                            resume_from_current_status, risk, f"workflow_resume_{risk.risk_uuid}",
+                            args=[risk.risk_uuid, current_user.user_uuid]
                         )
                         logger.info(f"Auto-continued workflow after inquiry responses: {task.id} on queue {queue_name}")
                 
                 db.session.commit()
                 logger.info(f"Auto-assigned risk {risk.risk_uuid} from anonymous user to logged-in user {current_user.user_uuid}")
         
-        elif risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-            logger.info(f"Resume attempt for non-anonymous risk {risk.risk_uuid} without login")
-            return jsonify({
-                'error': 'login_required',
-                'message': 'Bitte loggen Sie sich ein, um diesen Risikoeintrag fortzusetzen.',
-                'requires_login': True,
-                'user_uuid': risk.user_uuid
-            }), 401
-        
         logger.info(f"Resume GET request for risk {risk_uuid}, returning current DB status: {risk.status}")
         
         response_data = {
@@ -706,6 +679,9 @@ def resume_workflow_get(risk_uuid):
             response_data['failed_reason'] = risk.failed_reason
             response_data['retry_count'] = risk.retry_count
         
+        if risk.status == 'rejected':
+            response_data['reason'] = risk.failed_reason
+        
         return jsonify(response_data), 200
         
     except Exception as e:
@@ -792,33 +768,16 @@ def resume_workflow():
         else:
             user_uuid = DEFAULT_ANONYMOUS_USER_UUID
         
-        # Try to find risk with logged-in user's UUID first, then with anonymous UUID
-        risk = None
-        if current_user.is_authenticated:
-            risk = RiskAssessment.get_by_uuids(current_user.user_uuid, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with logged-in user UUID {current_user.user_uuid}")
+        # Risk des eingeloggten Nutzers oder anonymer Risk - eine Abfrage
+        risk = resolve_risk_access(risk_uuid)
         
-        # If not found and user is logged in, try with anonymous UUID (for risks that were created anonymously)
-        if not risk:
-            risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with DEFAULT_ANONYMOUS_USER_UUID")
+        # Security check: logged-in users may access their own risks and risks with DEFAULT_ANONYMOUS_USER_UUID,
+        # anonymous callers only risks with DEFAULT_ANONYMOUS_USER_UUID
+        denied = check_risk_access(risk, 'Resume', 'Bitte loggen Sie sich ein, um diesen Risikoeintrag fortzusetzen.')
+        if denied:
+            return denied
         
-        if not risk:
-            return jsonify({'error': 'Risk assessment not found'}), 404
-        
-        # Security check: If user is logged in, verify they own this risk assessment
-        # Exception: logged-in users can access risks with DEFAULT_ANONYMOUS_USER_UUID
         if current_user.is_authenticated:
-            if risk.user_uuid != current_user.user_uuid and risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-                logger.warning(f"Resume attempt by wrong user: {current_user.user_uuid} tried to resume risk {risk.risk_uuid} owned by {risk.user_uuid}")
-                return jsonify({
-                    'error': 'not_found',
-                    'message': 'Risikoeintrag nicht gefunden.',
-                    'suggest_logout': True
-                }), 404
-            
             if risk.user_uuid == DEFAULT_ANONYMOUS_USER_UUID:
                 old_user_uuid = risk.user_uuid
                 risk.user_uuid = current_user.user_uuid
@@ -831,11 +790,10 @@ def resume_workflow():
                         
                         # Automatically continue workflow after inquiry responses
                         from workflow_task import resume_from_current_status
-                        queue_name = 'celery'
-                        task = resume_from_current_status.apply_async(
-                            args=[risk.risk_uuid, current_user.user_uuid],
-                            task_id=f"workflow_resume_{risk.risk_uuid}",
-                            queue=queue_name
+                        queue_name = workflow_queue(risk.insurance_value)
+                        task = dispatch_workflow(
+                            resume_from_current_status, risk, f"workflow_resume_{risk.risk_uuid}",
+                            args=[risk.risk_uuid, current_user.user_uuid]
                         )
                         logger.info(f"Auto-continued workflow after inquiry responses: {task.id} on queue {queue_name}")
                 
@@ -863,15 +821,6 @@ def resume_workflow():
                             old_task.revoke(terminate=True)
                     except Exception as e:
                         logger.debug(f"Could not revoke old task {old_task_id}: {str(e)}")
-        # If not logged in but risk belongs to a registered user (not anonymous), require login
-        elif risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-            logger.info(f"Resume attempt for non-anonymous risk {risk.risk_uuid} without login")
-            return jsonify({
-                'error': 'login_required',
-                'message': 'Bitte loggen Sie sich ein, um diesen Risikoeintrag fortzusetzen.',
-                'requires_login': True,
-                'user_uuid': risk.user_uuid
-            }), 401
         
         logger.info(f"Resume request for risk {risk_uuid}, returning current DB status: {risk.status}")
         
@@ -898,6 +847,9 @@ def resume_workflow():
             response_data['failed_reason'] = risk.failed_reason
             response_data['retry_count'] = risk.retry_count
         
+        if risk.status == 'rejected':
+            response_data['reason'] = risk.failed_reason
+        
         return jsonify(response_data), 200
         
     except Exception as e:
@@ -944,6 +896,11 @@ def cancel_workflow(task_id):
         task = AsyncResult(task_id, app=celery_app)
         task.revoke(terminate=True)
         
+        # Lease des abgebrochenen Tasks sofort freigeben (sonst erst nach WORKFLOW_LEASE_TTL)
+        cancelled_risk_uuid = risk_uuid_from_task_id(task_id)
+        if cancelled_risk_uuid:
+            break_workflow_lease(cancelled_risk_uuid)
+        
         logger.info(f"Workflow cancelled: {task_id}")
         
         return jsonify({
@@ -959,6 +916,7 @@ def cancel_workflow(task_id):
 
 
 @workflow_bp.route('/result/<risk_uuid>', methods=['GET'])
+@read_replica
 def get_workflow_result(risk_uuid):
     """
     Get final workflow result by risk UUID
@@ -1021,38 +979,16 @@ def get_workflow_result(risk_uuid):
         else:
             user_uuid = DEFAULT_ANONYMOUS_USER_UUID
         
-        # Try to find risk with logged-in user's UUID first, then with anonymous UUID
-        risk = None
-        if current_user.is_authenticated:
-            risk = RiskAssessment.get_by_uuids(current_user.user_uuid, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with logged-in user UUID {current_user.user_uuid}")
-        
-        # If not found and user is logged in, try with anonymous UUID (for risks that were created anonymously)
-        if not risk:
-            risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with DEFAULT_ANONYMOUS_USER_UUID")
+        # Der Client fragt direkt nach dem 'completed'-Event - hinkt die Replica hinterher, vom Primary lesen
+        # (refresh: der Fallback leert die Session, das gemerkte Replica-Objekt ist dann ungültig)
+        risk = read_with_primary_fallback(
+            lambda: resolve_risk_access(risk_uuid, refresh=True),
+            lambda risk: risk is not None and risk.report is not None
+        )
         
-        if not risk:
-            return jsonify({'error': 'Risk assessment not found'}), 404
-        
-        if current_user.is_authenticated:
-            if risk.user_uuid != current_user.user_uuid and risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-                logger.warning(f"Result retrieval attempt by wrong user: {current_user.user_uuid} tried to access risk {risk.risk_uuid} owned by {risk.user_uuid}")
-                return jsonify({
-                    'error': 'not_found',
-                    'message': 'Risikoeintrag nicht gefunden.',
-                    'suggest_logout': True
-                }), 404
-        elif risk.user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-            logger.info(f"Result retrieval attempt for non-anonymous risk {risk.risk_uuid} without login")
-            return jsonify({
-                'error': 'login_required',
-                'message': 'Bitte loggen Sie sich ein, um das Ergebnis abzurufen.',
-                'requires_login': True,
-                'user_uuid': risk.user_uuid
-            }), 401
+        denied = check_risk_access(risk, 'Result retrieval', 'Bitte loggen Sie sich ein, um das Ergebnis abzurufen.')
+        if denied:
+            return denied
         
         return jsonify(risk.to_dict())
         
@@ -1128,24 +1064,14 @@ def update_risk_user():
         old_user_uuid = data.get('old_user_uuid')
         new_user_uuid = current_user.user_uuid
         
-        # Try to find risk assessment with old_user_uuid first
+        # Risk with old_user_uuid, the logged-in user's UUID (in case it was already updated)
+        # or DEFAULT_ANONYMOUS_USER_UUID (old_user_uuid not provided) - one query
+        user_uuids = {new_user_uuid, DEFAULT_ANONYMOUS_USER_UUID}
         if old_user_uuid:
-            risk = RiskAssessment.get_by_uuids(old_user_uuid, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with old_user_uuid: {old_user_uuid}")
-        
-        # If not found, try with logged-in user's UUID (in case it was already updated)
-        if not risk:
-            risk = RiskAssessment.get_by_uuids(new_user_uuid, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with new_user_uuid: {new_user_uuid}")
-        
-        # If still not found and old_user_uuid is not DEFAULT_ANONYMOUS_USER_UUID, try with DEFAULT_ANONYMOUS_USER_UUID
-        # This handles the case where old_user_uuid was not provided but risk belongs to anonymous user
-        if not risk and old_user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-            risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
-            if risk:
-                logger.info(f"Found risk {risk_uuid} with DEFAULT_ANONYMOUS_USER_UUID")
+            user_uuids.add(old_user_uuid)
+        risk = RiskAssessment.get_accessible(risk_uuid, user_uuids)
+        if risk:
+            logger.info(f"Found risk {risk_uuid} with user_uuid: {risk.user_uuid}")
         
         if not risk:
             logger.warning(f"Risk assessment not found: {risk_uuid}")
@@ -1176,7 +1102,7 @@ def update_risk_user():
                 from celery.result import AsyncResult
                 from celery_app import celery_app
                 
-                queue_name = 'celery'
+                queue_name = workflow_queue(risk.insurance_value)
                 
                 old_task_ids = [
                     f"workflow_{risk_uuid}",
@@ -1195,21 +1121,23 @@ def update_risk_user():
                         if old_task_status and old_task_status not in ('completed', 'failed', 'unknown'):
                             # Task is still running or in intermediate state - revoke it
                             old_task.revoke(terminate=True)
+                            break_workflow_lease(risk_uuid)
                             logger.info(f"Revoked old task {old_task_id} (status: {old_task_status}) before starting new one")
                         elif old_task_status == 'login_required':
                             logger.info(f"Revoking old task {old_task_id} with login_required status (user is now logged in)")
                             old_task.revoke(terminate=True)
                     except Exception as e:
                         logger.debug(f"Could not revoke old task {old_task_id}: {str(e)}")
+                # Lease-Spalten nach break_workflow_lease neu laden
+                db.session.expire(risk, ['lease_owner', 'lease_token', 'lease_expires_at'])
                 
                 logger.info(f"Resuming workflow for risk {risk_uuid} after user login (status: {risk.status})")
                 
                 # Use workflow_resume task_id for the new resume task
                 new_task_id = f"workflow_resume_{risk_uuid}"
-                task = resume_from_current_status.apply_async(
-                    args=[risk_uuid, new_user_uuid],
-                    task_id=new_task_id,
-                    queue=queue_name
+                task = dispatch_workflow(
+                    resume_from_current_status, risk, new_task_id,
+                    args=[risk_uuid, new_user_uuid]
                 )
                 
                 logger.info(f"Workflow resume task started: {task.id} for risk {risk_uuid}")
@@ -0,0 +1,261 @@
+"""
+xrisk - Workflow Status Cache
+Author: Manuel Schott
+
+Compact status documents in Redis for the polling endpoints
+/workflow/state/task/<task_id> and /workflow/state/risk/<risk_uuid>
+
+- Task-Status: update_and_publish schreibt neben dem Celery-Result-Backend ein
+  kompaktes Statusdokument (workflow:status:{task_id}, ohne gestreamte
+  Teilergebnisse). Der Endpoint liefert es ohne AsyncResult- und DB-Zugriff aus.
+- Risk-Status: Nach jedem Commit, der Status, Inquiry, Besitzer oder Fehlergrund
+  eines Risks ändert, wird das Dokument neu geschrieben (Session-Events after_flush/
+  after_commit) und auf workflow:risk:{risk_uuid} angekündigt. Fehlt es, liest der
+  Endpoint aus der DB und legt es an (SET NX - ein gleichzeitiger Commit gewinnt).
+
+ETag = Hash des Dokuments; If-None-Match mit aktuellem Stand ergibt 304. Mit ?wait=N
+(höchstens WORKFLOW_STATUS_MAX_WAIT Sekunden) wartet ein solcher Request per Pub/Sub
+auf die nächste Änderung (Long-Poll als Alternative zu SSE). Ohne Dokument (ältere
+Tasks, Redis-Fehler) gilt der bisherige Weg über Celery bzw. die DB.
+"""
+
+import hashlib
+import json
+import logging
+import time
+
+from flask import Response, request
+
+from config import Config
+from db_pool import release_db_connection
+from workflow_dispatch import get_redis_client
+
+logger = logging.getLogger('application')
+
+# Nur für SSE interessant - würde den ETag bei jedem gestreamten Feld ändern
+TRANSIENT_META_FIELDS = ('partial',)
+
+_RISK_STATUS_ATTRIBUTES = ('status', 'inquiry', 'user_uuid', 'failed_reason')
+_PENDING_KEY = 'risk_status_documents'
+
+_tracking_installed = False
+
+
+def _task_status_key(task_id: str) -> str:
+    return f"workflow:status:{task_id}"
+
+
+def _risk_status_key(risk_uuid: str) -> str:
+    return f"workflow:status:risk:{risk_uuid}"
+
+
+def task_status_channel(task_id: str) -> str:
+    """Pub/Sub channel of update_and_publish (also used by the SSE stream)"""
+    return f"workflow:{task_id}"
+
+
+def risk_status_channel(risk_uuid: str) -> str:
+    return f"workflow:risk:{risk_uuid}"
+
+
+def _serialize(doc: dict) -> str:
+    return json.dumps(doc, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def status_etag(doc_json: str) -> str:
+    return hashlib.sha1(doc_json.encode('utf-8')).hexdigest()[:20]
+
+
+def store_task_status(task_id: str, meta: dict) -> None:
+    """
+    Write the status document of a workflow task (called by update_and_publish)
+
+    Args:
+        task_id (str): Celery task id
+        meta (dict): Published meta (meta.status is the source of truth)
+    """
+    doc = {
+        'task_id': task_id,
+        'status': meta.get('status'),
+        'meta': {key: value for key, value in meta.items() if key not in TRANSIENT_META_FIELDS}
+    }
+    try:
+        get_redis_client().set(_task_status_key(task_id), _serialize(doc), ex=Config.WORKFLOW_STATUS_TTL)
+    except Exception as e:
+        # Pollende Clients fallen auf das Celery-Result-Backend zurück
+        logger.warning(f"Could not store status document for task {task_id}: {e}")
+
+
+def load_task_status(task_id: str):
+    """
+    Returns:
+        str: Status document (JSON) or None
+    """
+    try:
+        return get_redis_client().get(_task_status_key(task_id))
+    except Exception as e:
+        logger.warning(f"Could not load status document for task {task_id}: {e}")
+        return None
+
+
+def risk_status_document(risk) -> dict:
+    """Body of /workflow/state/risk/<risk_uuid>"""
+    return {
+        'status': risk.status,
+        'inquiry': risk.inquiry,
+        'risk_uuid': risk.risk_uuid,
+        'user_uuid': risk.user_uuid,
+        'failed_reason': risk.failed_reason
+    }
+
+
+def load_risk_status(risk_uuid: str):
+    """
+    Returns:
+        tuple: (status document (JSON), owner user_uuid) or None
+    """
+    try:
+        doc_json = get_redis_client().get(_risk_status_key(risk_uuid))
+    except Exception as e:
+        logger.warning(f"Could not load status document for risk {risk_uuid}: {e}")
+        return None
+    if not doc_json:
+        return None
+    return doc_json, json.loads(doc_json).get('user_uuid')
+
+
+def store_risk_status_if_missing(risk):
+    """
+    Create the status document of a risk read from the DB
+
+    Only on the primary: a lagging replica would cache an outdated state.
+
+    Args:
+        risk: RiskAssessment instance
+
+    Returns:
+        str: Status document (JSON) if it was stored, otherwise None
+    """
+    doc_json = _serialize(risk_status_document(risk))
+    try:
+        if get_redis_client().set(_risk_status_key(risk.risk_uuid), doc_json, nx=True, ex=Config.WORKFLOW_STATUS_TTL):
+            return doc_json
+    except Exception as e:
+        logger.warning(f"Could not store status document for risk {risk.risk_uuid}: {e}")
+    return None
+
+
+def requested_wait() -> int:
+    """Long-poll seconds requested with ?wait= (capped at WORKFLOW_STATUS_MAX_WAIT)"""
+    wait = request.args.get('wait', 0, type=int) or 0
+    return max(0, min(wait, Config.WORKFLOW_STATUS_MAX_WAIT))
+
+
+def _wait_for_change(channel: str, load, etag: str, timeout: int):
+    """
+    Wait until the document returned by load() no longer matches etag
+
+    Returns:
+        str: Current document or None if it is no longer usable
+    """
+    redis_client = get_redis_client()
+    pubsub = redis_client.pubsub()
+    try:
+        # Erst abonnieren, dann erneut lesen - sonst geht eine Änderung dazwischen verloren
+        pubsub.subscribe(channel)
+        doc_json = load()
+        deadline = time.time() + timeout
+        while doc_json is not None and status_etag(doc_json) == etag:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            message = pubsub.get_message(ignore_subscribe_messages=True, timeout=min(remaining, 1.0))
+            if message:
+                doc_json = load()
+        return doc_json
+    finally:
+        pubsub.unsubscribe(channel)
+        pubsub.close()
+
+
+def serve_status(doc_json: str, load, channel: str):
+    """
+    Respond with a status document (ETag, 304, long-poll)
+
+    Args:
+        doc_json (str): Current status document
+        load: Callable returning the current document (or None if it is no longer usable)
+        channel (str): Pub/Sub channel announcing changes
+
+    Returns:
+        Response or None if the document became unusable while waiting (caller falls back)
+    """
+    etag = status_etag(doc_json)
+    wait = requested_wait()
+    if wait and request.if_none_match.contains(etag):
+        # Während des Wartens keine DB-Verbindung halten (Login-Lookup von Flask-Login)
+        release_db_connection()
+        try:
+            doc_json = _wait_for_change(channel, load, etag, wait)
+        except Exception as e:
+            logger.warning(f"Long-poll on {channel} failed: {e}")
+        if doc_json is None:
+            return None
+
+    response = Response(doc_json, mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+    response.set_etag(status_etag(doc_json))
+    return response.make_conditional(request)
+
+
+def _collect_risk_status(session, flush_context):
+    """after_flush: remember the status documents of changed risks until the commit"""
+    from sqlalchemy import inspect
+    from models import RiskAssessment
+
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, RiskAssessment):
+            continue
+        state = inspect(obj)
+        if obj not in session.new and not any(state.attrs[name].history.has_changes() for name in _RISK_STATUS_ATTRIBUTES):
+            continue
+        # Inquiry ist deferred - nicht nachladen, Dokument stattdessen verwerfen
+        pending[obj.risk_uuid] = None if 'inquiry' in state.unloaded else _serialize(risk_status_document(obj))
+    for obj in session.deleted:
+        if isinstance(obj, RiskAssessment):
+            pending[obj.risk_uuid] = None
+
+
+def _publish_risk_status(session):
+    """after_commit: write the collected status documents and announce them"""
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        for risk_uuid, doc_json in pending.items():
+            if doc_json is None:
+                pipe.delete(_risk_status_key(risk_uuid))
+            else:
+                pipe.set(_risk_status_key(risk_uuid), doc_json, ex=Config.WORKFLOW_STATUS_TTL)
+            pipe.publish(risk_status_channel(risk_uuid), '1')
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Could not update risk status documents {list(pending)}: {e}")
+
+
+def _discard_risk_status(session, previous_transaction=None):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def install_risk_status_tracking() -> None:
+    """Keep the risk status documents in sync with committed changes"""
+    global _tracking_installed
+    if _tracking_installed:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'after_flush', _collect_risk_status)
+    event.listen(Session, 'after_commit', _publish_risk_status)
+    event.listen(Session, 'after_rollback', _discard_risk_status)
+    _tracking_installed = True
@@ -6,12 +6,18 @@ Async workflow orchestration task for risk assessment
 """
 
 from celery_app import celery_app
+from contextlib import ExitStack, contextmanager
 from datetime import datetime, timezone
 from config import Config
 from performance_logger import perf_timer
-from models import db
-import redis
-import ssl
+from db_pool import detached
+from llm_batch import LLMBatchPending, workflow_execution_scope
+from llm_ledger import llm_ledger_scope
+from tracing import span
+from workflow_dispatch import get_redis_client
+from workflow_lease import workflow_lease_scope
+from workflow_status import store_task_status
+from celery.exceptions import Ignore
 import logging
 import json
 
@@ -34,6 +40,36 @@ def is_anonymous_user(user_uuid):
     return user_uuid == DEFAULT_ANONYMOUS_USER_UUID
 
 
+@contextmanager
+def workflow_app_context(risk_uuid, user_uuid, execution_mode=None, task_id=None):
+    """
+    Fresh Flask app context (and thereby SQLAlchemy session) for one workflow task
+    
+    Flask-SQLAlchemy scopes db.session on the app context. With the gevent/threads
+    worker profiles many tasks run in one process, so every task must push its own
+    context - never share one between tasks, greenlets or threads. Popping the
+    context removes the session and returns its connection to the pool.
+    
+    With task_id the task holds the lease of the risk (workflow_lease.py): a duplicate
+    task or one whose lease was taken over ends with celery.exceptions.Ignore.
+    
+    Args:
+        risk_uuid: UUID of the risk assessment (LLM ledger attribution)
+        user_uuid: UUID of the user
+        execution_mode: 'interactive' or 'batch' (None: no Batch API scope)
+        task_id: Celery task id (None: no lease)
+    """
+    from app import app
+    with ExitStack() as stack:
+        stack.enter_context(app.app_context())
+        if task_id is not None:
+            stack.enter_context(workflow_lease_scope(risk_uuid, task_id))
+        if execution_mode is not None:
+            stack.enter_context(workflow_execution_scope(execution_mode, risk_uuid, user_uuid))
+        stack.enter_context(llm_ledger_scope(risk_uuid))
+        yield
+
+
 def get_answered_inquiries(risk):
     """
     Get list of answered inquiries from a risk assessment
@@ -74,17 +110,7 @@ def publish_workflow_event(task_id, meta):
         meta: Metadata dict with step info (MUST contain 'status' field - this is the source of truth)
     """
     try:
-        if Config.REDIS_URL.startswith('rediss://'):
-            redis_client = redis.from_url(
-                Config.REDIS_URL,
-                ssl_cert_reqs=ssl.CERT_NONE,
-                decode_responses=True
-            )
-        else:
-            redis_client = redis.from_url(
-                Config.REDIS_URL,
-                decode_responses=True
-            )
+        redis_client = get_redis_client()
         
         # meta.status is the source of truth - must always be set
         status = meta.get('status')
@@ -100,8 +126,8 @@ def publish_workflow_event(task_id, meta):
         }
         
         channel = f"workflow:{task_id}"
-        redis_client.publish(channel, json.dumps(event_data))
-        redis_client.close()
+        with span('redis.publish', kind='producer', channel=channel, status=status):
+            redis_client.publish(channel, json.dumps(event_data))
         
         logger.debug(f"[Redis Pub/Sub] Published event to {channel}: {status}")
         
@@ -115,7 +141,8 @@ def update_and_publish(task_self, meta):
     
     Wrapper function that combines:
     1. self.update_state() - Updates Celery result backend
-    2. publish_workflow_event() - Publishes to Redis Pub/Sub for SSE
+    2. store_task_status() - Status document for polling clients (workflow_status.py)
+    3. publish_workflow_event() - Publishes to Redis Pub/Sub for SSE and long-polls
     
     Args:
         task_self: Celery task instance (self)
@@ -148,14 +175,82 @@ def update_and_publish(task_self, meta):
         celery_state = 'FAILURE'
     
     task_self.update_state(state=celery_state, meta=meta)
+    # Vor dem Publish schreiben - Long-Poll-Requests lesen das Dokument nach der Ankündigung
+    store_task_status(task_self.request.id, meta)
     publish_workflow_event(task_self.request.id, meta)
 
 
  
 
 
+def make_partial_publisher(task_self, step, risk_uuid, user_uuid, current_agent):
+    """
+    Build the on_partial callback for streamed agent responses
+    
+    Publishes fields that are already complete (e.g. title, summary) while the
+    agent is still generating. The DB status is not touched - the final result
+    is persisted by the regular step logic.
+    
+    Args:
+        task_self: Celery task instance (self)
+        step: Current workflow step (e.g. 'report')
+        risk_uuid: Risk UUID
+        user_uuid: User UUID
+        current_agent: Name of the running agent
+    
+    Returns:
+        Callable: Callback accepting a dict of partial fields
+    """
+    def _publish_partial(fields):
+        update_and_publish(
+            task_self,
+            meta={
+                'step': step,
+                'status': 'processing',
+                'risk_uuid': risk_uuid,
+                'user_uuid': user_uuid,
+                'current_agent': current_agent,
+                'partial': fields
+            }
+        )
+    return _publish_partial
+
+
+def _pause_for_batch(task_self, risk_uuid, user_uuid, pending):
+    """
+    Pause a non-interactive workflow until its Batch API requests are finished
+    
+    The DB status stays unchanged (no failure, no retry). The beat task
+    workflow.poll_llm_batches resumes the workflow once all results are in.
+    
+    Args:
+        task_self: Celery task instance (self)
+        risk_uuid: Risk UUID
+        user_uuid: User UUID
+        pending: LLMBatchPending exception
+    
+    Returns:
+        dict: Workflow result with status 'batch_pending'
+    """
+    logger.info(f"[Workflow {risk_uuid}] Workflow paused - waiting for Batch API ({pending.custom_id})")
+    update_and_publish(
+        task_self,
+        meta={
+            'step': 'batch_pending',
+            'status': 'processing',
+            'risk_uuid': risk_uuid,
+            'user_uuid': user_uuid
+        }
+    )
+    return {
+        'status': 'batch_pending',
+        'risk_uuid': risk_uuid,
+        'user_uuid': user_uuid
+    }
+
+
 @celery_app.task(bind=True, name='workflow.execute_risk_workflow')
-def execute_risk_workflow(self, risk_uuid, user_uuid):
+def execute_risk_workflow(self, risk_uuid, user_uuid, execution_mode='interactive'):
     """
     Execute complete risk assessment workflow asynchronously
     
@@ -163,41 +258,110 @@ def execute_risk_workflow(self, risk_uuid, user_uuid):
         self: Celery task instance (bound)
         risk_uuid: UUID of the risk assessment
         user_uuid: UUID of the user
+        execution_mode: 'interactive' or 'batch' (non-interactive, uses the OpenAI Batch API)
         
     Returns:
         dict: Final workflow result
     """
-    from models import RiskAssessment, db
+    from models import RiskAssessment
     try:
         from agents import (
-            ClassificationAgent, InquiryAgent, ResearchAgent,
+            ValidationAgent, ClassificationAgent, InquiryAgent, ResearchAgent,
             AnalysisAgent, ReportAgent
         )
     except ImportError as e:
         logger.error(f"[Workflow {risk_uuid}] Failed to import agents: {e}")
         raise Exception(f"Agent import failed: {str(e)}")
     
-    from app import app
     from config import Config
     
     logger.info(f"[Workflow {risk_uuid}] Starting workflow execution")
     
-    update_and_publish(
-        self,
-        meta={
-            'step': 'started',
-            'status': 'processing',  # Workflow is processing, DB status is still 'validated'
-            'risk_uuid': risk_uuid,
-            'user_uuid': user_uuid
-        }
-    )
-    
     try:
-        with app.app_context():
+        with workflow_app_context(risk_uuid, user_uuid, execution_mode, task_id=self.request.id):
+            update_and_publish(
+                self,
+                meta={
+                    'step': 'started',
+                    'status': 'processing',  # Workflow is processing, DB status is still 'created' or 'validated'
+                    'risk_uuid': risk_uuid,
+                    'user_uuid': user_uuid
+                }
+            )
+            
             risk = RiskAssessment.get_by_uuids(user_uuid, risk_uuid)
             if not risk:
                 raise Exception('Risk assessment not found')
             
+            risk_description = f"{risk.initial_prompt}\n\nVersicherungswert: {risk.insurance_value:,.2f} EUR"
+            
+            if risk.status == 'created':
+                logger.info(f"[Workflow {risk_uuid}] Step 0: Validation")
+                update_and_publish(
+                    self,
+                    meta={
+                        'step': 'validation',
+                        'status': 'processing',
+                        'risk_uuid': risk_uuid,
+                        'user_uuid': user_uuid,
+                        'current_agent': 'validation'
+                    }
+                )
+                
+                try:
+                    with perf_timer("Validation Step", risk_uuid, stage='validation'):
+                        validation_agent = ValidationAgent(Config.OPENAI_API_KEY)
+                        with detached(risk):
+                            validation_result = validation_agent.validate_risk(risk_description)
+                except LLMBatchPending:
+                    raise
+                except Exception as e:
+                    logger.error(f"[Workflow {risk_uuid}] Validation failed: {str(e)}")
+                    try:
+                        risk.mark_as_failed(str(e))
+                    except Exception:
+                        pass
+                    raise Exception(f"Validierung fehlgeschlagen: {str(e)}")
+                
+                if not validation_result.get('valid', False):
+                    reason = validation_result.get('reason', 'Risk description not accepted')
+                    # Ablehnung ist ein Endzustand (kein Retry) - Begründung für Status-Abfragen speichern
+                    risk.failed_reason = reason
+                    risk.update_status('rejected')
+                    logger.info(f"[Workflow {risk_uuid}] Risk assessment rejected: {reason}")
+                    update_and_publish(
+                        self,
+                        meta={
+                            'step': 'rejected',
+                            'status': 'rejected',
+                            'reason': reason,
+                            'retryable': False,
+                            'risk_uuid': risk_uuid,
+                            'user_uuid': user_uuid,
+                            'current_agent': 'validation'
+                        }
+                    )
+                    return {
+                        'status': 'rejected',
+                        'reason': reason,
+                        'retryable': False,
+                        'risk_uuid': risk_uuid,
+                        'user_uuid': user_uuid
+                    }
+                
+                risk.update_status('validated')
+                update_and_publish(
+                    self,
+                    meta={
+                        'step': 'validated',
+                        'status': 'validated',
+                        'risk_uuid': risk_uuid,
+                        'user_uuid': user_uuid,
+                        'current_agent': 'validation'
+                    }
+                )
+                logger.info(f"[Workflow {risk_uuid}] Validation complete")
+            
             logger.info(f"[Workflow {risk_uuid}] Step 1: Classification")
             
             if risk.status != 'validated':
@@ -214,30 +378,33 @@ def execute_risk_workflow(self, risk_uuid, user_uuid):
             )
             
             try:
-                with perf_timer(f"Classification Step [{risk_uuid}]"):
+                with perf_timer("Classification Step", risk_uuid, stage='classification'):
                     classification_agent = ClassificationAgent(Config.OPENAI_API_KEY)
-                    risk_description = f"{risk.initial_prompt}\n\nVersicherungswert: {risk.insurance_value:,.2f} EUR"
-                    risk_type = classification_agent.classify_risk(risk_description)
-                
-                risk.risk_type = risk_type
-                risk.update_status('classified')
-                update_and_publish(
-                    self,
-                    meta={
-                    'step': 'classified',
-                    'status': 'classified',
-                    'risk_uuid': risk_uuid,
-                        'user_uuid': user_uuid,
-                        'current_agent': 'classification',
-                        'risk_type': risk_type
-                    }
-                )
+                    with detached(risk):
+                        risk_type = classification_agent.classify_risk(risk_description)
                 
-                if risk.retry_count > 0 or risk.failed_at:
-                    risk.reset_retry_state()
-                    logger.info(f"[Workflow {risk_uuid}] Retry successful - retry state reset")
+                with risk.stage_transaction() as stage:
+                    risk.risk_type = risk_type
+                    risk.update_status('classified')
+                    if risk.retry_count > 0 or risk.failed_at:
+                        risk.reset_retry_state()
+                        logger.info(f"[Workflow {risk_uuid}] Retry successful - retry state reset")
+                    stage.after_commit(
+                        update_and_publish,
+                        self,
+                        meta={
+                            'step': 'classified',
+                            'status': 'classified',
+                            'risk_uuid': risk_uuid,
+                            'user_uuid': user_uuid,
+                            'current_agent': 'classification',
+                            'risk_type': risk_type
+                        }
+                    )
                 
                 logger.info(f"[Workflow {risk_uuid}] Classification complete: {risk_type}")
+            except LLMBatchPending:
+                raise
             except Exception as e:
                 logger.error(f"[Workflow {risk_uuid}] Classification failed: {str(e)}")
                 try:
@@ -263,18 +430,19 @@ def execute_risk_workflow(self, risk_uuid, user_uuid):
             )
             
             try:
-                with perf_timer(f"Inquiry Step [{risk_uuid}]"):
+                with perf_timer("Inquiry Step", risk_uuid, stage='inquiry'):
                     inquiry_agent = InquiryAgent(Config.OPENAI_API_KEY)
-                    inquiries = inquiry_agent.generate_inquiries(risk_description)
+                    with detached(risk):
+                        inquiries = inquiry_agent.generate_inquiries(risk_description)
                 
                 if inquiries and len(inquiries) > 0:
                     if risk.inquiry and any(q.get('response') for q in (risk.inquiry or [])):
                         logger.info(f"[Workflow {risk_uuid}] Existing inquiry responses detected, skipping regeneration")
                     else:
                         inquiry_data = [{'question': q, 'response': None} for q in inquiries]
-                        risk.inquiry = inquiry_data
-                        db.session.commit()
-                        risk.update_status('inquiry_awaiting_response')
+                        with risk.stage_transaction():
+                            risk.inquiry = inquiry_data
+                            risk.update_status('inquiry_awaiting_response')
                     
                     logger.info(f"[Workflow {risk_uuid}] Inquiry generated: {len(inquiries)} questions")
                     
@@ -389,6 +557,8 @@ def execute_risk_workflow(self, risk_uuid, user_uuid):
                         logger.info(f"[Workflow {risk_uuid}] No inquiries needed, continuing to research")
                         return _continue_workflow_after_inquiry(self, risk, risk_uuid, user_uuid)
                     
+            except LLMBatchPending:
+                raise
             except Exception as e:
                 logger.error(f"[Workflow {risk_uuid}] Inquiry failed: {str(e)}")
                 try:
@@ -397,6 +567,10 @@ def execute_risk_workflow(self, risk_uuid, user_uuid):
                     pass
                 raise Exception(f"Rückfragen fehlgeschlagen: {str(e)}")
             
+    except Ignore:
+        raise
+    except LLMBatchPending as pending:
+        return _pause_for_batch(self, risk_uuid, user_uuid, pending)
     except Exception as e:
         # Ensure error message is JSON serializable
         error_message = str(e)
@@ -426,6 +600,28 @@ def execute_risk_workflow(self, risk_uuid, user_uuid):
         raise
 
 
+def _complete_stage(risk, risk_uuid, report, analysis=None):
+    """
+    Store the report and complete the workflow with one commit
+    (status transition, processing lock and retry state)
+    
+    Args:
+        risk: RiskAssessment instance
+        risk_uuid: UUID of risk
+        report: Report result
+        analysis: Analysis result (combined agent only)
+    """
+    with risk.stage_transaction():
+        if analysis is not None:
+            risk.analysis = analysis
+        risk.report = report
+        risk.update_status('completed')
+        risk.clear_processing_lock()
+        if risk.retry_count > 0 or risk.failed_at:
+            logger.info(f"[Workflow {risk_uuid}] Workflow completed after {risk.retry_count} retries - retry state reset")
+            risk.reset_retry_state()
+
+
 def _continue_workflow_after_inquiry(self, risk, risk_uuid, user_uuid):
     """
     Continue workflow after inquiry step (with or without user responses)
@@ -502,31 +698,36 @@ def _continue_workflow_after_inquiry(self, risk, risk_uuid, user_uuid):
                                    for q in answered_inquiries])
             research_prompt += f"\n\nZusätzliche Informationen: {inquiry_text}"
         
-        with perf_timer(f"Research Step [{risk_uuid}]"):
-            research_results = research_agent.conduct_comprehensive_research(
-                research_prompt,
-                risk_type=risk.risk_type or "allgemein"
-            )
+        with perf_timer("Research Step", risk_uuid, stage='research'):
+            risk_type = risk.risk_type or "allgemein"
+            with detached(risk):
+                research_results = research_agent.conduct_comprehensive_research(
+                    research_prompt,
+                    risk_type=risk_type
+                )
         
-        risk.research_current = research_results.get('current', {})
-        risk.research_historical = research_results.get('historical', {})
-        risk.research_regulatory = research_results.get('regulatory', {})
-        # Persist research blocks immediately to avoid losing progress
-        db.session.commit()
-        risk.update_status('researched')
-        # Immediately reflect DB transition in Celery result backend to avoid stale 'research' on reconnects
-        update_and_publish(
-            self,
-            meta={
-                'step': 'researched',
-                'status': risk.status,  # Use risk.status as source of truth
-                'risk_uuid': risk_uuid,
-                'user_uuid': user_uuid,
-                'current_agent': 'research'
-            }
-        )
+        # Persist research blocks together with the status transition to avoid losing progress
+        with risk.stage_transaction() as stage:
+            risk.research_current = research_results.get('current', {})
+            risk.research_historical = research_results.get('historical', {})
+            risk.research_regulatory = research_results.get('regulatory', {})
+            risk.update_status('researched')
+            # Immediately reflect DB transition in Celery result backend to avoid stale 'research' on reconnects
+            stage.after_commit(
+                update_and_publish,
+                self,
+                meta={
+                    'step': 'researched',
+                    'status': 'researched',
+                    'risk_uuid': risk_uuid,
+                    'user_uuid': user_uuid,
+                    'current_agent': 'research'
+                }
+            )
         
         logger.info(f"[Workflow {risk_uuid}] Research complete")
+    except LLMBatchPending:
+        raise
     except Exception as e:
         logger.error(f"[Workflow {risk_uuid}] Research failed: {str(e)}")
         # Mark as failed for retry mechanism
@@ -565,8 +766,12 @@ def _continue_workflow_after_inquiry(self, risk, risk_uuid, user_uuid):
             'insurance_value': risk.insurance_value
         }
         
-        with perf_timer(f"Analysis Step [{risk_uuid}]"):
-            analysis_result = analysis_agent.analyze_risk(risk_description, research_data)
+        with perf_timer("Analysis Step", risk_uuid, stage='analysis'):
+            with detached(risk):
+                analysis_result = analysis_agent.analyze_risk(
+                    risk_description, research_data,
+                    on_partial=make_partial_publisher(self, 'analysis', risk_uuid, user_uuid, 'analysis')
+                )
             risk.analysis = analysis_result
             risk.update_status('analyzed')
             # Reflect DB transition to Celery result backend
@@ -604,6 +809,8 @@ def _continue_workflow_after_inquiry(self, risk, risk_uuid, user_uuid):
                 logger.error(f"[Workflow {risk_uuid}] Error sending analysis complete notification email: {str(e)}")
         
         logger.info(f"[Workflow {risk_uuid}] Analysis complete")
+    except LLMBatchPending:
+        raise
     except Exception as e:
         logger.error(f"[Workflow {risk_uuid}] Analysis failed: {str(e)}")
         try:
@@ -630,22 +837,22 @@ def _continue_workflow_after_inquiry(self, risk, risk_uuid, user_uuid):
     )
     
     try:
-        with perf_timer(f"Report Step [{risk_uuid}]"):
+        with perf_timer("Report Step", risk_uuid, stage='report'):
             report_agent = ReportAgent(Config.OPENAI_API_KEY)
             
             report_data = risk.to_dict()
             report_data['initial_prompt'] = f"{risk.initial_prompt}\n\nVersicherungswert: {risk.insurance_value:,.2f} EUR"
             
-            report = report_agent.generate_report(report_data)
-            risk.report = report
-            risk.update_status('completed')
-            
-            risk.clear_processing_lock()
-            if risk.retry_count > 0 or risk.failed_at:
-                risk.reset_retry_state()
-                logger.info(f"[Workflow {risk_uuid}] Workflow completed after {risk.retry_count} retries - retry state reset")
+            with detached(risk):
+                report = report_agent.generate_report(
+                    report_data,
+                    on_partial=make_partial_publisher(self, 'report', risk_uuid, user_uuid, 'report')
+                )
+            _complete_stage(risk, risk_uuid, report=report)
         
         logger.info(f"[Workflow {risk_uuid}] Report complete")
+    except LLMBatchPending:
+        raise
     except Exception as e:
         logger.error(f"[Workflow {risk_uuid}] Report failed: {str(e)}")
         try:
@@ -688,8 +895,7 @@ def resume_workflow_after_inquiry(self, risk_uuid, user_uuid, inquiry_responses)
     Returns:
         dict: Workflow result
     """
-    from models import RiskAssessment, db
-    from app import app
+    from models import RiskAssessment
     from config import Config
     
     logger.info(f"[Workflow {risk_uuid}] Resuming workflow after inquiry responses")
@@ -708,7 +914,7 @@ def resume_workflow_after_inquiry(self, risk_uuid, user_uuid, inquiry_responses)
     )
     
     try:
-        with app.app_context():
+        with workflow_app_context(risk_uuid, user_uuid, task_id=self.request.id):
             risk = RiskAssessment.get_by_uuids(user_uuid, risk_uuid)
             if not risk:
                 raise Exception('Risk assessment not found')
@@ -716,7 +922,7 @@ def resume_workflow_after_inquiry(self, risk_uuid, user_uuid, inquiry_responses)
             if risk.status != 'inquiry_awaiting_response':
                 raise Exception(f"Ungültiger Status für Workflow-Fortsetzung: {risk.status} (erwartet: inquiry_awaiting_response)")
             
-            with perf_timer(f"Save Inquiry Responses [{risk_uuid}]"):
+            with perf_timer("Save Inquiry Responses", risk_uuid, stage='inquiry'):
                 if not risk.inquiry:
                     raise Exception('No inquiries found to update')
                 
@@ -747,10 +953,9 @@ def resume_workflow_after_inquiry(self, risk_uuid, user_uuid, inquiry_responses)
                     logger.warning(f"[Workflow {risk_uuid}] Failed to build Q/A preview: {_e}")
                 
                 from sqlalchemy.orm.attributes import flag_modified
-                flag_modified(risk, 'inquiry')
-                
-                db.session.commit()
-                risk.update_status('inquired')
+                with risk.stage_transaction():
+                    flag_modified(risk, 'inquiry')
+                    risk.update_status('inquired')
                 
                 # Check if user is logged in before proceeding with analysis
                 if is_anonymous_user(user_uuid):
@@ -797,6 +1002,10 @@ def resume_workflow_after_inquiry(self, risk_uuid, user_uuid, inquiry_responses)
                     logger.info(f"[Workflow {risk_uuid}] Inquiry responses saved, continuing workflow")
                     return _continue_workflow_after_inquiry(self, risk, risk_uuid, user_uuid)
             
+    except Ignore:
+        raise
+    except LLMBatchPending as pending:
+        return _pause_for_batch(self, risk_uuid, user_uuid, pending)
     except Exception as e:
         error_message = str(e)
         if hasattr(e, '__class__'):
@@ -821,27 +1030,22 @@ def resume_workflow_after_inquiry(self, risk_uuid, user_uuid, inquiry_responses)
 
 
 @celery_app.task(bind=True, name='workflow.resume_from_current_status')
-def resume_from_current_status(self, risk_uuid, user_uuid):
+def resume_from_current_status(self, risk_uuid, user_uuid, execution_mode='interactive'):
     """
     Resume workflow from the current DB status without requiring inquiry responses.
     Supports continuing from 'researched' (runs analysis+report) and 'analyzed' (runs report).
+    With execution_mode='batch' the agent requests go through the OpenAI Batch API.
     """
-    from models import RiskAssessment, db
-    from app import app
-    logger.info(f"[Workflow {risk_uuid}] Resume from current status requested (user_uuid: {user_uuid})")
+    from models import RiskAssessment
+    logger.info(f"[Workflow {risk_uuid}] Resume from current status requested (user_uuid: {user_uuid}, mode: {execution_mode})")
     try:
-        with app.app_context():
-            # Try to find risk with provided user_uuid first
-            risk = RiskAssessment.get_by_uuids(user_uuid, risk_uuid)
-            
-            # If not found and user_uuid is not DEFAULT_ANONYMOUS_USER_UUID, try with DEFAULT_ANONYMOUS_USER_UUID
-            # This handles the case where risk-user updated the risk but the task was started with old user_uuid
-            # We only search with DEFAULT_ANONYMOUS_USER_UUID to avoid accessing risks of other users
-            if not risk and user_uuid != DEFAULT_ANONYMOUS_USER_UUID:
-                logger.info(f"[Workflow {risk_uuid}] Risk not found with user_uuid {user_uuid}, trying with DEFAULT_ANONYMOUS_USER_UUID")
-                risk = RiskAssessment.get_by_uuids(DEFAULT_ANONYMOUS_USER_UUID, risk_uuid)
-                if risk:
-                    logger.info(f"[Workflow {risk_uuid}] Found risk with DEFAULT_ANONYMOUS_USER_UUID (was updated from anonymous to {user_uuid})")
+        with workflow_app_context(risk_uuid, user_uuid, execution_mode, task_id=self.request.id):
+            # Risk with the provided user_uuid or with DEFAULT_ANONYMOUS_USER_UUID - one query
+            # The latter handles the case where risk-user updated the risk but the task was started with old user_uuid
+            # We only accept DEFAULT_ANONYMOUS_USER_UUID to avoid accessing risks of other users
+            risk = RiskAssessment.get_accessible(risk_uuid, {user_uuid, DEFAULT_ANONYMOUS_USER_UUID})
+            if risk and risk.user_uuid != user_uuid:
+                logger.info(f"[Workflow {risk_uuid}] Found risk with DEFAULT_ANONYMOUS_USER_UUID (was updated from anonymous to {user_uuid})")
             
             if not risk:
                 raise Exception('Risk assessment not found')
@@ -862,7 +1066,6 @@ def resume_from_current_status(self, risk_uuid, user_uuid):
                 if are_all_inquiries_answered(risk):
                     # All inquiries answered, update status and continue
                     risk.update_status('inquired')
-                    db.session.commit()
                     return _continue_workflow_after_inquiry(self, risk, risk_uuid, actual_user_uuid)
                 else:
                     # Still waiting for responses, return inquiry required
@@ -902,6 +1105,10 @@ def resume_from_current_status(self, risk_uuid, user_uuid):
                 return {'status': 'completed', 'risk_uuid': risk_uuid}
             else:
                 raise Exception(f"Fortsetzung aus Status {risk.status} nicht unterstützt")
+    except Ignore:
+        raise
+    except LLMBatchPending as pending:
+        return _pause_for_batch(self, risk_uuid, user_uuid, pending)
     except Exception as e:
         update_and_publish(
             self,
@@ -947,8 +1154,12 @@ def _continue_from_researched(self, risk, risk_uuid, user_uuid):
         'end_date': str(risk.end_date),
         'insurance_value': risk.insurance_value
     }
-    with perf_timer(f"Analysis Step [{risk_uuid}]"):
-        analysis_result = analysis_agent.analyze_risk(risk_description, research_data)
+    with perf_timer("Analysis Step", risk_uuid, stage='analysis'):
+        with detached(risk):
+            analysis_result = analysis_agent.analyze_risk(
+                risk_description, research_data,
+                on_partial=make_partial_publisher(self, 'analysis', risk_uuid, user_uuid, 'analysis')
+            )
         risk.analysis = analysis_result
         risk.update_status('analyzed')
         update_and_publish(
@@ -983,13 +1194,16 @@ def _continue_from_analyzed(self, risk, risk_uuid, user_uuid):
         }
     )
 
-    with perf_timer(f"Report Step [{risk_uuid}]"):
+    with perf_timer("Report Step", risk_uuid, stage='report'):
         report_agent = ReportAgent(Config.OPENAI_API_KEY)
         report_data = risk.to_dict()
         report_data['initial_prompt'] = f"{risk.initial_prompt}\n\nVersicherungswert: {risk.insurance_value:,.2f} EUR"
-        report = report_agent.generate_report(report_data)
-        risk.report = report
-        risk.update_status('completed')
+        with detached(risk):
+            report = report_agent.generate_report(
+                report_data,
+                on_partial=make_partial_publisher(self, 'report', risk_uuid, user_uuid, 'report')
+            )
+        _complete_stage(risk, risk_uuid, report=report)
 
     update_and_publish(
         self,
@@ -1071,17 +1285,21 @@ def _continue_from_inquiry_with_combined_agent(self, risk, risk_uuid, user_uuid)
         risk_data['research_regulatory'] = risk.research_regulatory or {}
         
         combined_result = None
-        with perf_timer(f"Combined Analysis & Report Step [{risk_uuid}]"):
-            combined_result = combined_agent.analyze_and_report(risk_description, risk_data)
+        with perf_timer("Combined Analysis & Report Step", risk_uuid, stage='analysis_report'):
+            with detached(risk):
+                combined_result = combined_agent.analyze_and_report(
+                    risk_description, risk_data,
+                    on_partial=make_partial_publisher(self, 'combined_analysis_report', risk_uuid, user_uuid, 'combined_analysis_report')
+                )
             
             # Extract analysis and report from combined result
             # The combined result contains both analysis and report components
             # The structure is now simplified (no "Analyse-Zusammenfassung" wrapper)
             if 'analysis' in combined_result:
-                risk.analysis = combined_result.get('analysis', {})
+                analysis = combined_result.get('analysis', {})
             else:
                 # Fallback: extract directly from result (simplified structure)
-                risk.analysis = {
+                analysis = {
                     'probability_percentage': combined_result.get('probability_percentage', 0),
                     'average_damage_per_event': combined_result.get('average_damage_per_event', 0),
                     'expected_damage': combined_result.get('expected_damage', 0),
@@ -1091,13 +1309,12 @@ def _continue_from_inquiry_with_combined_agent(self, risk, risk_uuid, user_uuid)
                 }
                 # Include title and summary if present
                 if 'title' in combined_result:
-                    risk.analysis['title'] = combined_result.get('title')
+                    analysis['title'] = combined_result.get('title')
                 if 'summary' in combined_result:
-                    risk.analysis['summary'] = combined_result.get('summary')
+                    analysis['summary'] = combined_result.get('summary')
             
-            # Store the full report (which includes analysis summary)
-            risk.report = combined_result
-            risk.update_status('analyzed')
+            # Store analysis and the full report (which includes analysis summary) and mark as completed
+            _complete_stage(risk, risk_uuid, report=combined_result, analysis=analysis)
             
             update_and_publish(
                 self,
@@ -1107,21 +1324,14 @@ def _continue_from_inquiry_with_combined_agent(self, risk, risk_uuid, user_uuid)
                     'risk_uuid': risk_uuid,
                     'user_uuid': user_uuid,
                     'current_agent': 'combined_analysis_report',
-                    'kleinrisiko': True,
-                    'status': risk.status  # Use risk.status as source of truth
+                    'kleinrisiko': True
                 }
             )
             
-            # Mark as completed
-            risk.update_status('completed')
-            
-            risk.clear_processing_lock()
-            if risk.retry_count > 0 or risk.failed_at:
-                risk.reset_retry_state()
-                logger.info(f"[Workflow {risk_uuid}] Workflow completed after {risk.retry_count} retries - retry state reset")
-            
             logger.info(f"[Workflow {risk_uuid}] Combined analysis and report complete")
             
+    except LLMBatchPending:
+        raise
     except Exception as e:
         logger.error(f"[Workflow {risk_uuid}] Combined analysis and report failed: {str(e)}")
         try:
@@ -1175,25 +1385,26 @@ def _continue_from_classified(self, risk, risk_uuid, user_uuid):
 
     risk_description = f"{risk.initial_prompt}\n\nVersicherungswert: {risk.insurance_value:,.2f} EUR"
     inquiry_agent = InquiryAgent(Config.OPENAI_API_KEY)
-    inquiries = inquiry_agent.generate_inquiries(risk_description)
+    with detached(risk):
+        inquiries = inquiry_agent.generate_inquiries(risk_description)
 
     if inquiries and len(inquiries) > 0:
         inquiry_data = [{'question': q, 'response': None} for q in inquiries]
-        risk.inquiry = inquiry_data
-        db.session.commit()
-        risk.update_status('inquiry_awaiting_response')
-
-        update_and_publish(
-            self,
-            meta={
-                'step': 'inquiry_awaiting_response',
-                'status': 'inquiry_awaiting_response',
-                'inquiries': inquiry_data,
-                'risk_uuid': risk_uuid,
-                'user_uuid': user_uuid,
-                'current_agent': 'inquiry'
-            }
-        )
+        with risk.stage_transaction() as stage:
+            risk.inquiry = inquiry_data
+            risk.update_status('inquiry_awaiting_response')
+            stage.after_commit(
+                update_and_publish,
+                self,
+                meta={
+                    'step': 'inquiry_awaiting_response',
+                    'status': 'inquiry_awaiting_response',
+                    'inquiries': inquiry_data,
+                    'risk_uuid': risk_uuid,
+                    'user_uuid': user_uuid,
+                    'current_agent': 'inquiry'
+                }
+            )
         return {
             'status': 'inquiry_required',
             'inquiries': inquiry_data,
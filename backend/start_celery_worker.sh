@@ -31,10 +31,6 @@ mkdir -p "$LOG_DIR" || {
 # Start Celery worker
 echo "Starting Celery worker..."
 
-# Use celery queue
-QUEUE_NAME="celery"
-echo "Using queue: $QUEUE_NAME"
-
 # Use logfile only if LOG_DIR is writable, otherwise use stdout/stderr (Docker best practice)
 if [ -n "$LOG_DIR" ] && [ -w "$LOG_DIR" ]; then
     LOGFILE_ARG="--logfile=$LOG_DIR/celery.log"
@@ -44,13 +40,91 @@ else
     echo "Logging to stdout/stderr (Docker best practice)"
 fi
 
-exec celery -A celery_app.celery_app worker \
-    --loglevel=info \
-    $LOGFILE_ARG \
-    --queues=$QUEUE_NAME \
-    --concurrency=2 \
-    --max-tasks-per-child=50 \
-    --task-events \
-    --without-gossip \
-    --without-mingle \
-    --without-heartbeat
+# Worker profile: default Celery pool for all worker pools
+#   prefork - one task per process (default)
+#   gevent  - many concurrent tasks per process for the I/O-bound agent stages
+#             (they spend almost all their time waiting on OpenAI)
+#   threads - many concurrent tasks per process as threads (no task time limits)
+WORKER_PROFILE=${CELERY_WORKER_PROFILE:-prefork}
+case "$WORKER_PROFILE" in
+    prefork|gevent|threads) ;;
+    *) echo "Unknown CELERY_WORKER_PROFILE '$WORKER_PROFILE', using prefork"; WORKER_PROFILE=prefork ;;
+esac
+echo "Worker profile: $WORKER_PROFILE"
+
+# Worker pools per queue: "queue[,queue]:concurrency[:pool]" separated by ";"
+# Each pool runs as its own Celery worker, so retries on the low queue cannot
+# occupy the slots of interactive users (see workflow_dispatch.py)
+QUEUE_HIGH=${CELERY_QUEUE_HIGH:-workflow_high}
+QUEUE_FAST=${CELERY_QUEUE_FAST:-workflow_fast}
+QUEUE_LOW=${CELERY_QUEUE_LOW:-workflow_low}
+QUEUE_DEFAULT=${CELERY_QUEUE_DEFAULT:-celery}
+if [ "$WORKER_PROFILE" = "prefork" ]; then
+    DEFAULT_POOLS="$QUEUE_HIGH,$QUEUE_DEFAULT:2;$QUEUE_FAST:1;$QUEUE_LOW:1"
+else
+    DEFAULT_POOLS="$QUEUE_HIGH,$QUEUE_DEFAULT:32;$QUEUE_FAST:16;$QUEUE_LOW:8"
+fi
+WORKER_POOLS=${CELERY_WORKER_POOLS:-$DEFAULT_POOLS}
+echo "Worker pools: $WORKER_POOLS"
+
+start_worker() {
+    local queues=$1
+    local concurrency=$2
+    local pool=$3
+    local name=$4
+    local pool_args="--pool=$pool"
+    local pool_env="CELERY_WORKER_POOL=$pool"
+    if [ "$pool" = "prefork" ]; then
+        pool_args="$pool_args --max-tasks-per-child=50"
+    elif [ -z "$DB_POOL_SIZE" ]; then
+        # One DB connection per concurrent task (the session is scoped per task)
+        pool_env="$pool_env DB_POOL_SIZE=$concurrency"
+    fi
+    $WORKER_EXEC env $pool_env \
+        celery -A celery_app.celery_app worker \
+        --loglevel=info \
+        $LOGFILE_ARG \
+        --hostname="$name@%h" \
+        --queues="$queues" \
+        --concurrency="$concurrency" \
+        $pool_args \
+        --task-events \
+        --without-gossip \
+        --without-mingle \
+        --without-heartbeat
+}
+
+IFS=';' read -ra POOL_SPECS <<< "$WORKER_POOLS"
+
+parse_pool_spec() {
+    IFS=':' read -r POOL_QUEUES POOL_CONCURRENCY POOL_TYPE <<< "$1"
+    POOL_CONCURRENCY=${POOL_CONCURRENCY:-1}
+    POOL_TYPE=${POOL_TYPE:-$WORKER_PROFILE}
+    POOL_NAME=$(echo "$POOL_QUEUES" | cut -d, -f1)
+}
+
+# Single pool: exec directly (Celery gets the container signals)
+if [ ${#POOL_SPECS[@]} -eq 1 ]; then
+    parse_pool_spec "${POOL_SPECS[0]}"
+    echo "Using queues: $POOL_QUEUES (concurrency $POOL_CONCURRENCY, pool $POOL_TYPE)"
+    WORKER_EXEC=exec
+    start_worker "$POOL_QUEUES" "$POOL_CONCURRENCY" "$POOL_TYPE" "worker"
+fi
+
+WORKER_EXEC=""
+WORKER_PIDS=""
+for spec in "${POOL_SPECS[@]}"; do
+    parse_pool_spec "$spec"
+    echo "Starting pool $POOL_NAME: queues=$POOL_QUEUES concurrency=$POOL_CONCURRENCY pool=$POOL_TYPE"
+    start_worker "$POOL_QUEUES" "$POOL_CONCURRENCY" "$POOL_TYPE" "$POOL_NAME" &
+    WORKER_PIDS="$WORKER_PIDS $!"
+done
+
+# Forward shutdown to all pools; if one pool dies, stop the others so the container restarts
+trap 'kill -TERM $WORKER_PIDS 2>/dev/null' TERM INT
+set +e
+wait -n
+EXIT_CODE=$?
+kill -TERM $WORKER_PIDS 2>/dev/null
+wait
+exit $EXIT_CODE
@@ -114,7 +114,9 @@ fi
 
 python database_setup.py
 if [ $? -ne 0 ]; then
-    echo "⚠️  Database initialization failed, continuing anyway..."
+    # Die App darf nicht auf einem veralteten Schema starten
+    echo "❌ Database initialization failed - not starting the application"
+    exit 1
 else
     echo "✅ Database initialized successfully"
 fi
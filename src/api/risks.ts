@@ -30,7 +30,24 @@ export const inquiryResponse = (payload: InquiryResponsePayload) =>
     body: JSON.stringify(payload),
   });
 
-export const listRisks = () => apiFetch<unknown>("/api/risks");
+export interface ListRisksParams {
+  scope?: "all" | "own" | "available";
+  q?: string;
+  min_probability?: number;
+  max_probability?: number;
+  max_expected_damage?: number;
+  sort?: "created" | "probability" | "expected_damage" | "max_damage";
+  order?: "asc" | "desc";
+}
+
+export const listRisks = (params: ListRisksParams = {}) => {
+  const query = new URLSearchParams();
+  Object.entries(params).forEach(([key, value]) => {
+    if (value !== undefined && value !== "") query.set(key, String(value));
+  });
+  const suffix = query.toString();
+  return apiFetch<unknown>(suffix ? `/api/risks?${suffix}` : "/api/risks");
+};
 
 export const getRisk = (uuid: string) =>
   apiFetch<Record<string, unknown>>(`/api/risks/${encodeURIComponent(uuid)}`, { method: "GET" });
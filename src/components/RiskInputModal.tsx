@@ -313,6 +313,14 @@ export function RiskInputModal({ open, onClose, initialRiskDescription, onRiskCr
       setIsLoading(false);
       setErrorMessage("Die Risikoanalyse ist fehlgeschlagen. Bitte versuchen Sie es erneut.");
     }
+
+    if (status === "rejected") {
+      const meta = payload.meta as { reason?: string } | undefined;
+      setIsLoading(false);
+      setErrorMessage(
+        meta?.reason || "Die Risikobeschreibung wurde nicht akzeptiert. Bitte überarbeiten Sie Ihre Eingabe."
+      );
+    }
   };
 
   const beginWorkflow = async (payload: WorkflowStartPayload) => {